@@ -0,0 +1,321 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import compare
+import create_benchmark_data
+import csv_scan
+import profiles
+import reports_db
+
+# Benchmarks of the comparison and of saving its results, which write the wall time, rows per second and peak memory
+# of each step they time to a JSON file, so runs can be compared to catch performance regressions:
+#   steps    times each step of a python engine comparison
+#   memory   measures the memory the loaded state and CDC data take as csv.DictReader rows and as CompactRows
+#   persist  times saving report results to SQLite as a list of rows, the way the server used to, and with reports_db
+# The state and CDC files of steps and memory are made by create_benchmark_data.py, either up front or by this
+# script with the same arguments:
+#   python benchmark.py steps -n 1000000 --seed 1 -o benchmark.json
+#   python benchmark.py memory -s bench/state_bench.csv -c bench/cdc_bench.csv -o memory.json
+#   python benchmark.py persist -n 1000000 -o persist.json
+
+def reset_peak_rss():
+    # Linux resets the peak resident memory of the process when 5 is written to clear_refs. Elsewhere the peak
+    # stays the highest of the whole run
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peak_rss_mb():
+    """
+    Returns the peak resident memory of this process in MB, or None if it cannot be read on this platform.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+def measure(timings, name, step, *args, traced=False):
+    """
+    Runs step(*args) and records its time and peak memory under name. step returns its result and the number of rows
+    it went through. If traced, the Python memory the result holds and the peak Python memory of the step are also
+    recorded with tracemalloc, which slows the step down.
+    """
+    gc.collect()
+    reset_peak_rss()
+    if traced:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result, rows = step(*args)
+    seconds = time.perf_counter() - start
+    memory = None
+    if traced:
+        memory = tuple(size / 2**20 for size in tracemalloc.get_traced_memory())
+        tracemalloc.stop()
+    timings.setdefault(name, []).append((seconds, rows, peak_rss_mb(), memory))
+    return result
+
+def read_state(state_file, columns, state_columns):
+    state_rows = list(compare.compact_rows(compare.read_rows(state_file, columns), state_columns))
+    return state_rows, len(state_rows)
+
+def read_cdc(cdc_file, columns, scan_workers):
+    cdc_rows = list(csv_scan.read_rows(cdc_file, columns, scan_workers))
+    return cdc_rows, len(cdc_rows)
+
+def dedup_cdc(reconciler, cdc_rows, filterCDC, cdc_columns):
+    return reconciler.load_cdc_rows(cdc_rows, filterCDC, cdc_columns), len(cdc_rows)
+
+def dedup_state(state_rows, cdcEventCodes, state_columns):
+    return compare.load_state_rows(state_rows, cdcEventCodes, state_columns), len(state_rows)
+
+def compare_cases(reconciler, state_dict, cdc_dict, attributes):
+    rows = len(state_dict) + len(cdc_dict)
+    reconciler.comp(state_dict, cdc_dict, attributes)
+    return (reconciler.results, reconciler.stats), rows
+
+def write_results(results, stats, directory):
+    compare.write_results(results, os.path.join(directory, "results.csv"))
+    compare.write_stats(stats, os.path.join(directory, "stats.csv"))
+    return None, len(results)
+
+def save_report(results, stats, directory):
+    conn = reports_db.connect(os.path.join(directory, "database.db"))
+    try:
+        reports_db.create_tables(conn)
+        reports_db.save_report(conn, results, stats, "Benchmark")
+    finally:
+        conn.close()
+    return None, len(results)
+
+def end_to_end(state_file, cdc_file, filterCDC, attributes, scan_workers, profile, rows):
+    columns = compare.needed_columns(attributes)
+    compare.run_comparison(compare.read_rows(state_file, columns), csv_scan.read_rows(cdc_file, columns, scan_workers),
+                           filterCDC, attributes, profile)
+    return None, rows
+
+def run_steps(timings, args, state_file, cdc_file, profile, directory):
+    """
+    Runs every step of one comparison in turn, the way the server's python engine does them.
+    """
+    filterCDC, attributes, scan_workers = args.filter, args.attributes, args.scan_workers
+    columns = compare.needed_columns(attributes)
+    state_columns, _ = compare.peek_columns(compare.read_rows(state_file, columns))
+    cdc_columns, _ = compare.peek_columns(compare.read_rows(cdc_file, columns))
+    state_columns, cdc_columns = compare.kept_columns(state_columns, cdc_columns, attributes)
+
+    state_rows = measure(timings, "read_state", read_state, state_file, columns, state_columns)
+    cdc_rows = measure(timings, "read_cdc", read_cdc, cdc_file, columns, scan_workers)
+    reconciler = compare.Reconciler(profile)
+    cdc_dict, cdcEventCodes = measure(timings, "dedup_cdc", dedup_cdc, reconciler, cdc_rows, filterCDC, cdc_columns)
+    state_dict = measure(timings, "dedup_state", dedup_state, state_rows, cdcEventCodes, state_columns)
+    del state_rows, cdc_rows
+    results, stats = measure(timings, "compare", compare_cases, reconciler, state_dict, cdc_dict, attributes)
+    del state_dict, cdc_dict
+    measure(timings, "write_results", write_results, results, stats, directory)
+    measure(timings, "save_report", save_report, results, stats, directory)
+    del results, stats, reconciler
+    # Counted as the rows of both files, like the read steps
+    rows = timings["read_state"][-1][1] + timings["read_cdc"][-1][1]
+    measure(timings, "end_to_end", end_to_end, state_file, cdc_file, filterCDC, attributes, scan_workers, profile, rows)
+
+def load_dicts(state_file, cdc_file, attributes):
+    # Every row kept as the full dictionary csv.DictReader gives, like the loaders used to
+    state_dict = {row['CaseID']: row for row in compare.read_csv(state_file)}
+    cdc_dict = {row['CaseID']: row for row in compare.read_csv(cdc_file)}
+    return (state_dict, cdc_dict), len(state_dict) + len(cdc_dict)
+
+def load_compact(state_file, cdc_file, attributes):
+    state_columns, _ = compare.peek_columns(compare.read_csv(state_file))
+    cdc_columns, _ = compare.peek_columns(compare.read_csv(cdc_file))
+    state_columns, cdc_columns = compare.kept_columns(state_columns, cdc_columns, attributes)
+
+    cdc_dict, _ = compare.Reconciler().get_cdc_dict(cdc_file, columns=cdc_columns)
+    state_dict = compare.get_state_dict(state_file, columns=state_columns)
+    return (state_dict, cdc_dict), len(state_dict) + len(cdc_dict)
+
+def run_memory(timings, args, state_file, cdc_file, profile, directory):
+    """
+    Loads the state and CDC data as csv.DictReader rows and as the CompactRows the loaders keep, tracing the memory
+    each one holds.
+    """
+    measure(timings, "dict_rows", load_dicts, state_file, cdc_file, args.attributes, traced=True)
+    measure(timings, "compact_rows", load_compact, state_file, cdc_file, args.attributes, traced=True)
+
+def make_results(rows):
+    for i in range(rows):
+        yield compare.CaseResult(f"CAS{10000000 + i}GA01", str(10000 + i % 200), "2019 Novel Coronavirus", "2023", f"{i % 52 + 1:02}",
+                                 "Case differs on MMWRWeek between State and CDC datasets", "3", "Confirmed")
+
+def make_stats(event_codes):
+    return {str(10000 + i): {'eventName': "2019 Novel Coronavirus", 'totalCases': i, 'totalDuplicates': 0, 'totalMissingCDC': 0,
+                             'totalMissingState': 0, 'totalWrongAttributes': i} for i in range(event_codes)}
+
+def list_cases(conn, reportId, rows):
+    # Every row built up front and inserted with one commit, like the server used to
+    res = [(reportId,) + row for row in reports_db.coded_rows(map(compare.result_row, make_results(rows)), {})]
+    conn.executemany("INSERT INTO Cases (ReportID, CaseID, EventCode, EventName, MMWRYear, MMWRWeek, ReasonCode, ReasonID, CaseClassStatus) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", res)
+    conn.commit()
+    return None, rows
+
+def stage_cases(conn, rows):
+    return reports_db.stage_cases(conn, make_results(rows)), rows
+
+def insert_cases(conn, reportId, codes, rows):
+    # The only part of saving the cases that holds the write lock
+    conn.execute("BEGIN IMMEDIATE")
+    reports_db.insert_cases(conn, reportId, codes)
+    conn.commit()
+    return None, rows
+
+def insert_statistics(conn, reportId, event_codes):
+    reports_db.insert_statistics(conn, reportId, make_stats(event_codes))
+    conn.commit()
+    return None, event_codes
+
+def run_persist(timings, args, state_file, cdc_file, profile, directory):
+    """
+    Saves the same results as a list of rows in the default journal mode, the way the server used to, and streamed
+    through the staging database of reports_db, each into a new database.
+    """
+    with tempfile.TemporaryDirectory(dir=directory) as run_directory:
+        conn = sqlite3.connect(os.path.join(run_directory, "list.db"))
+        try:
+            reports_db.create_tables(conn)
+            conn.execute("PRAGMA journal_mode = DELETE")
+            reportId = reports_db.insert_report(conn, args.rows)
+            conn.commit()
+            measure(timings, "list_cases", list_cases, conn, reportId, args.rows)
+            measure(timings, "list_statistics", insert_statistics, conn, reportId, args.event_codes)
+        finally:
+            conn.close()
+
+        conn = reports_db.connect(os.path.join(run_directory, "database.db"))
+        try:
+            reports_db.create_tables(conn)
+            reportId = reports_db.insert_report(conn, args.rows)
+            conn.commit()
+            with reports_db.staging(conn, run_directory):
+                codes = measure(timings, "stage_cases", stage_cases, conn, args.rows)
+                measure(timings, "insert_cases", insert_cases, conn, reportId, codes, args.rows)
+            measure(timings, "insert_statistics", insert_statistics, conn, reportId, args.event_codes)
+        finally:
+            conn.close()
+
+def summary(timings):
+    """
+    Returns the timings of each step, taking its fastest run and its highest peak memory.
+    """
+    steps = []
+    for name, runs in timings.items():
+        seconds, rows, _, memory = min(runs, key=lambda run: run[0])
+        peaks = [peak for _, _, peak, _ in runs if peak is not None]
+        step = {'name': name, 'seconds': round(seconds, 4), 'rows': rows,
+                'rowsPerSecond': round(rows / seconds) if seconds > 0 else None,
+                'peakRssMB': round(max(peaks), 1) if peaks else None,
+                'runs': [round(run[0], 4) for run in runs]}
+        if memory is not None:
+            step['heldMB'] = round(memory[0], 1)
+            step['tracedPeakMB'] = round(max(run[3][1] for run in runs), 1)
+        steps.append(step)
+    return steps
+
+def add_data_arguments(parser):
+    parser.add_argument('-s', '--state', help='State CSV file, made by create_benchmark_data.py if not given')
+    parser.add_argument('-c', '--cdc', help='CDC CSV file, made by create_benchmark_data.py if not given')
+    parser.add_argument('--data-dir', help='Folder to keep the made benchmark files in, instead of a temporary folder')
+    parser.add_argument('-a', '--attributes', nargs='*', help='Attributes to compare')
+    create_benchmark_data.add_generator_arguments(parser)
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="Benchmark", description='Time the steps of a comparison or of saving its results and write the timings to a JSON file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    steps_parser = commands.add_parser('steps', help='Time each step of a python engine comparison')
+    add_data_arguments(steps_parser)
+    steps_parser.add_argument('-f', '--filter', action='store_true', help='Filter by CDC eventCodes')
+    steps_parser.add_argument('--scan-workers', type=int, help='Processes used to read the CDC file (the number of CPUs by default)')
+    steps_parser.add_argument('-p', '--profile', help='Comparison profile from the comparison_profiles setting to normalise the attributes with')
+    steps_parser.add_argument('--config', default=os.path.join(os.path.dirname(__file__), 'config.json'), help='Config file to read the comparison profiles from')
+    steps_parser.set_defaults(run=run_steps)
+    memory_parser = commands.add_parser('memory', help='Measure the memory the loaded state and CDC data take as dictionaries and as CompactRows')
+    add_data_arguments(memory_parser)
+    memory_parser.set_defaults(run=run_memory)
+    persist_parser = commands.add_parser('persist', help='Time saving report results to SQLite as a list of rows and with reports_db')
+    persist_parser.add_argument('-n', '--rows', type=int, default=1000000, help='Number of cases to save')
+    persist_parser.add_argument('-e', '--event-codes', type=int, default=200, help='Number of statistics rows to save')
+    persist_parser.set_defaults(run=run_persist)
+    for command_parser in (steps_parser, memory_parser, persist_parser):
+        command_parser.add_argument('-o', '--output', default='benchmark.json', help='JSON file to write the timings to')
+        command_parser.add_argument('-r', '--repeat', type=int, default=1, help='Number of times to run every step, keeping the fastest')
+    args = parser.parse_args()
+
+    profile = None
+    if getattr(args, 'profile', None):
+        with open(args.config, 'r') as f:
+            try:
+                profile = profiles.load_profile(json.load(f), args.profile)
+            except ValueError as e:
+                parser.error(str(e))
+
+    with tempfile.TemporaryDirectory() as directory:
+        data = None
+        state_file, cdc_file = getattr(args, 'state', None), getattr(args, 'cdc', None)
+        if args.command != 'persist' and (state_file is None or cdc_file is None):
+            data_dir = args.data_dir or directory
+            start = time.perf_counter()
+            data = create_benchmark_data.generate_from_args(args, data_dir)
+            print(f"Made {data['counts']['stateRows']:,} state and {data['counts']['cdcRows']:,} CDC rows "
+                  f"in {time.perf_counter() - start:.1f} s")
+            state_file = os.path.join(data_dir, "state_bench.csv")
+            cdc_file = os.path.join(data_dir, "cdc_bench.csv")
+
+        timings = {}
+        for _ in range(args.repeat):
+            args.run(timings, args, state_file, cdc_file, profile, directory)
+
+    steps = summary(timings)
+    report = {
+        'command': args.command,
+        'createdAt': datetime.now().isoformat(sep=' ', timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'stateFile': state_file if data is None else None,
+        'cdcFile': cdc_file if data is None else None,
+        'data': data,
+        'filter': getattr(args, 'filter', None),
+        'attributes': getattr(args, 'attributes', None),
+        'scanWorkers': getattr(args, 'scan_workers', None),
+        'profile': profile.definition() if profile is not None else None,
+        'steps': steps,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for step in steps:
+        peak = f"{step['peakRssMB']:.0f} MB peak" if step['peakRssMB'] is not None else "peak memory unknown"
+        traced = f", {step['heldMB']:.1f} MB held after it, {step['tracedPeakMB']:.1f} MB traced peak" if 'heldMB' in step else ""
+        print(f"{step['name']}: {step['seconds']:.2f} s, {step['rowsPerSecond'] or 0:,} rows/s, {peak}{traced}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+import uuid
+import compare
+
+# Cache of loaded CDC files, so a CDC file that is compared again, with or without the CDC filter or with other
+# attributes, is not parsed again. Entries are named by a hash of the file's contents and hold every column of its
+# deduplicated rows, its duplicate rows, its stats and its event codes, pickled as tuples of values that share
+# one copy of each repeated value. The least recently used entries are removed once the cache is larger than
+# max_bytes, and purge removes the entries that were not used for a while. Several processes can share the same
+# folder. Entries are read with pickle, so the folder must only be writable by the processes that use the cache.
+
+# Changed whenever the contents of an entry change, so entries written by older versions are not read
+CACHE_VERSION = 1
+ENTRY_EXTENSION = ".pickle"
+HASH_CHUNK_BYTES = 1024 * 1024
+
+def file_hash(data_file):
+    """
+    Returns a hash of the contents of a file, read a chunk at a time.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(data_file, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def parse_entry(rows):
+    """
+    Loads an iterable of CDC row dictionaries with every column and returns them as a cache entry.
+    """
+    reconciler = compare.Reconciler()
+    columns, rows = compare.peek_columns(rows)
+    cdc_dict, eventCodes = reconciler.load_cdc_rows(rows, True, columns)
+    return {
+        'columns': columns,
+        'rows': [row.values for row in cdc_dict.values()],
+        # The duplicates are kept as the CaseResult values of their rows
+        'duplicates': [compare.result_row(result) for result in reconciler.results],
+        'stats': reconciler.stats,
+        'eventCodes': sorted(eventCodes),
+    }
+
+class CDCCache:
+    """
+    A folder of cached CDC files, counting how many loads were served from it (hits) and how many had to parse the file (misses).
+    """
+    def __init__(self, directory, max_bytes) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, f"{key}-v{CACHE_VERSION}{ENTRY_EXTENSION}")
+
+    def read_entry(self, path):
+        """
+        Returns the entry at path, marking it as used, or None if it is not in the cache.
+        """
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # Missing, or removed by another process while it was being read
+            return None
+        return entry
+
+    def write_entry(self, path, entry):
+        """
+        Saves an entry, then removes the least recently used entries until the cache fits in max_bytes.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        # Written to a temporary file first so other processes never read part of an entry
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        if os.path.getsize(temp_path) > self.max_bytes:
+            os.remove(temp_path)
+            return
+        os.replace(temp_path, path)
+        self.evict()
+
+    def entries(self):
+        """
+        Returns the (last used time, size, path) of every entry, least recently used first.
+        """
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for item in scan:
+                if item.name.endswith(ENTRY_EXTENSION):
+                    try:
+                        info = item.stat()
+                    except OSError:
+                        continue
+                    entries.append((info.st_mtime, info.st_size, item.path))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Already removed, or still open in another process on Windows
+                continue
+            total -= size
+
+    def purge(self, max_age_seconds):
+        """
+        Removes the entries, and temporary files left by writes that failed, not used in the last max_age_seconds.
+        Returns how many files were removed.
+        """
+        if not os.path.isdir(self.directory):
+            return 0
+        oldest = time.time() - max_age_seconds
+        removed = 0
+        with os.scandir(self.directory) as scan:
+            for item in scan:
+                if not (item.name.endswith(ENTRY_EXTENSION) or item.name.endswith(".tmp")):
+                    continue
+                try:
+                    if item.stat().st_mtime < oldest:
+                        os.remove(item.path)
+                        removed += 1
+                except OSError:
+                    # Already removed, or still open in another process on Windows
+                    continue
+        return removed
+
+    def load_cdc(self, reconciler, cdc_file, read_rows, filterCDC=False, compare_attributes=None, state_columns=None):
+        """
+        Loads a CDC file into a Reconciler like Reconciler.load_cdc, from the cache if the same file was loaded before.
+        On a miss, read_rows(cdc_file) is used to read every column of the file and the result is added to the cache.
+        """
+        path = self.entry_path(file_hash(cdc_file))
+        entry = self.read_entry(path)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None:
+            entry = parse_entry(read_rows(cdc_file))
+            self.write_entry(path, entry)
+
+        # The rows only keep the columns this comparison needs, like Reconciler.load_cdc
+        _, cdc_columns = compare.kept_columns(state_columns, entry['columns'], compare_attributes)
+        index = compare.RowLayout(cdc_columns).index
+        cached_index = compare.RowLayout(entry['columns']).index
+        case_position = cached_index.get('CaseID')
+        if index == cached_index:
+            cdc_dict = {values[case_position]: compare.CompactRow(index, values) for values in entry['rows']}
+        else:
+            get_values = compare.tuple_getter([cached_index[column] for column in sorted(index, key=index.get)])
+            cdc_dict = {values[case_position]: compare.CompactRow(index, get_values(values)) for values in entry['rows']}
+
+        reconciler.results.extend(compare.CaseResult(*values) for values in entry['duplicates'])
+        for eventCode, counts in entry['stats'].items():
+            reconciler.stats[eventCode] = dict(counts)
+        return cdc_dict, set(entry['eventCodes']) if filterCDC else None
+
+    def info(self):
+        """
+        Returns the hit and miss counts of this process and the number and total size of the cached entries.
+        """
+        entries = self.entries() if os.path.isdir(self.directory) else []
+        return {"hits": self.hits, "misses": self.misses, "entries": len(entries), "bytes": sum(size for _, size, _ in entries)}
@@ -2,9 +2,10 @@ import argparse
 import os
 import pyodbc
 import json
-import uuid
-import csv
 import compare
+import profiles
+import reports_db
+import state_snapshot
 
 config = None
 conn = None
@@ -18,7 +19,7 @@ with open(config_file_path, "r") as f:
     db_username = config.get("database_username") or os.getenv('DB_USERNAME')
     db_password = config.get("database_password") or os.getenv('DB_PASSWORD')
 
-def get_state_csv(year: int):
+def run_query(year: int):
     query = None
     query_file_path = os.path.join(configDir, "query.sql")
     with open(query_file_path, 'r') as f:
@@ -27,36 +28,58 @@ def get_state_csv(year: int):
     cursor = conn.cursor()
     cursor.execute(query, year)
 
-    # Return the queried data as a list of dicts
+    # Return the column names and the queried records, which are fetched in batches as they are used
     column_names = [col[0] for col in cursor.description]
-    state_content = cursor.fetchall()
+    state_content = compare.fetch_records(cursor, config.get("query_batch_size", 10000))
 
-    id = str(uuid.uuid4())
-    state_save_to = os.path.join(configDir, f"{id}.csv")
-    with open(state_save_to, "w", newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(column_names)
-        writer.writerows(state_content)
+    return (column_names, state_content)
 
-    return state_save_to
+def snapshot_query(year: int):
+    """
+    Like run_query, but reads the state data from the local snapshot of the year in database.db after pulling the
+    cases that changed since the last run into it.
+    """
+    with open(os.path.join(configDir, "query.sql"), 'r') as f:
+        query = f.read()
+    with open(os.path.join(configDir, "delta_query.sql"), 'r') as f:
+        delta_query = f.read()
+
+    liteConn = reports_db.connect(os.path.join(configDir, "database.db"))
+    reports_db.create_tables(liteConn)
+    column_names = state_snapshot.update(conn, liteConn, year, query, delta_query, config.get("snapshot_overlap_minutes", 60),
+                                         config.get("snapshot_refresh_days", 7), config.get("query_batch_size", 10000))
+    return (column_names, state_snapshot.snapshot_records(liteConn, year, config.get("query_batch_size", 10000)))
     
 def main():
     global conn
 
     parser = argparse.ArgumentParser(
         prog="AutoCompare", description='Auto Comparison')
-    parser.add_argument('-c', '--cdc', required=True, help='Local Path to CDC CSV file')
+    parser.add_argument('-c', '--cdc', required=True, help='Local Path to CDC CSV, Parquet or Arrow file')
     parser.add_argument('-o', '--output', required=True, help='Name of folder that should be created to store the report files')
     parser.add_argument('-y', '--year', required=True, help='Year to compare')
     # defaulting to filtering by CDC event codes
     parser.add_argument('-nf', '--nofilter', default=False, action="store_true", help='Do not filter by CDC eventCodes')
     parser.add_argument('-a', '--attributes', nargs='*', help='Attributes to compare')
+    parser.add_argument('-e', '--engine', choices=compare.ENGINES, default='python', help='Comparison engine to use')
+    parser.add_argument('--format', choices=['csv', 'parquet', 'arrow'], default='csv', help='File format of the report files')
+    parser.add_argument('--spill-rows', type=int, default=500000, help='Most rows of each dataset held in memory by the external engine')
+    parser.add_argument('--snapshot', action='store_true', help='Only pull the cases changed since the last run into a local snapshot of the state data')
+    parser.add_argument('--scan-workers', type=int, help='Processes used by the python engine to read a CDC CSV file (the number of CPUs by default)')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Processes the python engine splits the comparison across by CaseID')
+    parser.add_argument('-p', '--profile', help='Comparison profile to normalise the attributes with, instead of the comparison_profile setting')
+    parser.add_argument('--case-class-status', action='store_true', help='Add a CaseClassStatus column to the results file')
     args = parser.parse_args()
 
     if (args.cdc is None or args.output is None or args.year is None):
         print("Please provide the CDC CSV file, the output folder name, and the year to compare")
         return
 
+    try:
+        profile = profiles.load_profile(config, args.profile)
+    except ValueError as e:
+        parser.error(str(e))
+
     # Connect to the SQL Server
     connection_string_base = 'DRIVER={' + config["driver"] + \
         '}' + \
@@ -70,45 +93,43 @@ def main():
     connection_string = connection_string_base + connection_string_auth
     conn = pyodbc.connect(connection_string)
 
-    # Get the state CSV
-    state_csv = get_state_csv(args.year)
+    # Get the state data
+    (column_names, state_content) = snapshot_query(int(args.year)) if args.snapshot else run_query(args.year)
 
     filterByCDC = not args.nofilter
-    
-    cdc_dict, cdcEventCodes = compare.get_cdc_dict(args.cdc, filterByCDC)
-    state_dict = compare.get_state_dict(state_csv, cdcEventCodes)
-    
-    compare.comp(state_dict, cdc_dict, args.attributes)
-
-    os.remove(state_csv)
+    # Only the columns the comparison uses are read from a Parquet or Arrow CDC file
+    columns = compare.needed_columns(args.attributes)
+
+    if args.engine == 'columnar':
+        import columnar
+        state_frame = columnar.query_frame(column_names, state_content)
+        results, stats = columnar.run_comparison(state_frame, args.cdc, filterByCDC, args.attributes, profile)
+    elif args.engine == 'external':
+        import sortmerge
+        state_rows = compare.query_rows(column_names, state_content)
+        results, stats = sortmerge.run_comparison(state_rows, compare.read_rows(args.cdc, columns), filterByCDC, args.attributes,
+                                                  args.spill_rows, configDir, profile)
+    elif args.workers > 1:
+        import csv_scan
+        import partitioned
+        state_rows = compare.query_rows(column_names, state_content)
+        results, stats = partitioned.run_comparison(state_rows, csv_scan.read_rows(args.cdc, columns, args.scan_workers), filterByCDC,
+                                                    args.attributes, args.workers, profile)
+    else:
+        import csv_scan
+        state_rows = compare.query_rows(column_names, state_content)
+        results, stats = compare.run_comparison(state_rows, csv_scan.read_rows(args.cdc, columns, args.scan_workers), filterByCDC, args.attributes,
+                                                 profile, stream=True)
 
     # Create output folder
     output_folder = os.path.join(configDir, args.output)
     os.makedirs(output_folder)
 
-    # Create Results CSV File and write the results to it
-    with open(os.path.join(output_folder, "results.csv"), 'w', newline='') as csvfile:
-        fieldnames = ['CaseID', 'EventCode', 'EventName', 'MMWRYear',
-                      'MMWRWeek', 'Reason', 'ReasonID']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-        writer.writeheader()
-        for result in compare.results:
-            writer.writerow({'CaseID': result.caseID, 'EventCode': result.eventCode, 'EventName': result.eventName,'MMWRYear': result.MMWRYear,
-                            'MMWRWeek': result.MMWRWeek, 'Reason': result.reason, 'ReasonID': result.reasonID})
-            
-    # writing stats data to the csv
-    with open(os.path.join(output_folder, 'stats.csv'), 'w', newline='') as csvfile:
-        fieldNames = ['EventCode', 'EventName', 'TotalCases', 'TotalDuplicates',
-                      'TotalMissingFromCDC', 'TotalMissingFromState', 'TotalWrongAttributes']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldNames)
-        
-        writer.writeheader()
-        for eventCode, data in compare.stats.items():
-            writer.writerow({'EventCode': eventCode, 'EventName': data['eventName'], 'TotalCases': data['totalCases'],
-                             'TotalDuplicates': data['totalDuplicates'], 'TotalMissingFromCDC': data['totalMissingCDC'],
-                             'TotalMissingFromState': data['totalMissingState'], 'TotalWrongAttributes': data['totalWrongAttributes']})
+    # The results are written as they are compared, the stats are complete once they all are
+    # cli.py's results have always left out CaseClassStatus, so it is only written when asked for
+    fieldnames = compare.RESULT_FIELDNAMES if args.case_class_status else compare.RESULT_FIELDNAMES[:-1]
+    compare.write_results(results, os.path.join(output_folder, f"results.{args.format}"), fieldnames)
+    compare.write_stats(stats, os.path.join(output_folder, f"stats.{args.format}"))
 
 if __name__ == "__main__": 
     main()
-    
\ No newline at end of file
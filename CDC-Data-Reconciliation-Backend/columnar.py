@@ -0,0 +1,179 @@
+from itertools import repeat
+import pandas as pd
+import compare
+import profiles
+
+# Columnar comparison engine. Loads the state and CDC data as columns and does the same comparison as
+# compare.Reconciler with vector operations, which is much faster on files with millions of rows.
+# The results and stats it returns are the same as compare.run_comparison, in the same order.
+
+STATS_COLUMNS = ['totalCases', 'totalDuplicates', 'totalMissingCDC', 'totalMissingState', 'totalWrongAttributes']
+
+def read_csv(source):
+    """
+    Reads a CSV file path or file object into a DataFrame with every column kept as a string.
+    """
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return pd.read_csv(source, dtype=object, keep_default_na=False, na_filter=False, encoding='utf-8-sig')
+
+def read_table(source, columns=None):
+    """
+    Reads a CSV, Parquet or Arrow IPC file path, or a CSV file object, into a DataFrame with every column kept as a
+    string. Only the given columns are read from Parquet and Arrow files.
+    """
+    if hasattr(source, 'seek') or compare.file_format(source) == 'csv':
+        return read_csv(source)
+    import pyarrow as pa
+    table = pa.Table.from_batches(list(compare.string_batches(source, columns)))
+    return pd.DataFrame({name: table.column(name).to_numpy(zero_copy_only=False) for name in table.column_names}, dtype=object)
+
+def query_frame(column_names, records):
+    """
+    Builds a DataFrame from database query records, formatting each value like compare.query_rows.
+    """
+    frame = pd.DataFrame.from_records([tuple(record) for record in records], columns=column_names)
+    for column in frame.columns:
+        frame[column] = frame[column].map(lambda value: "" if value is None else str(value))
+    return frame
+
+def time_keys(add_times):
+    """
+    Returns compare.time_key for a column of add_time strings, only calling it for values that are not already zero-padded.
+    """
+    keys = add_times.copy()
+    padded = add_times.str.fullmatch(compare.ADD_TIME_PATTERN.pattern)
+    if not padded.all():
+        keys[~padded] = add_times[~padded].map(compare.time_key)
+    fraction = padded & add_times.str.contains('.', regex=False)
+    keys[fraction] = add_times[fraction].str.rstrip('0').str.rstrip('.')
+    return keys
+
+def dedup_state(state, eventCodes=None):
+    """
+    Filters the state data the same way as compare.load_state_rows and keeps the row with the latest add_time
+    for each CaseID. Ties go to the first row, and CaseIDs stay in the order they first appeared.
+    """
+    # If the EventCode is not a number, skip the row (Getting rid of values like MAPPING and ZT_PP_Condition3)
+    keep = state['EventCode'].str.isnumeric()
+    if eventCodes is not None:
+        keep &= state['EventCode'].isin(eventCodes)
+    state = state[keep].reset_index(drop=True)
+
+    repeated = state['CaseID'].duplicated(keep=False)
+    if not repeated.any():
+        return state
+
+    # Only repeated CaseIDs need their add_time looked at. Sorting by add_time and taking the last row keeps the latest one,
+    # and sorting ties by descending position makes the first of several equal add_times win, like compare.load_state_rows
+    candidates = pd.DataFrame({'CaseID': state.loc[repeated, 'CaseID'], 'time': time_keys(state.loc[repeated, 'add_time']),
+                               'position': state.index[repeated]})
+    candidates['firstPosition'] = candidates.groupby('CaseID', sort=False)['position'].transform('min')
+    winners = candidates.sort_values(['CaseID', 'time', 'position'], ascending=[True, True, False], kind='stable')
+    winners = winners.drop_duplicates('CaseID', keep='last')
+
+    # Each winning row takes the place of the first row seen for its CaseID
+    positions = pd.concat([
+        pd.Series(state.index[~repeated], index=state.index[~repeated]),
+        pd.Series(winners['position'].to_numpy(), index=winners['firstPosition'].to_numpy()),
+    ]).sort_index()
+
+    return state.iloc[positions.to_numpy()].reset_index(drop=True)
+
+def normalised(column, normalise):
+    """
+    Returns the values of a column normalised with a comparison profile's normaliser, which is called once for each distinct value.
+    """
+    if normalise is profiles.exact:
+        return column.replace("", "NULL").to_numpy()
+    values = column.unique()
+    return column.map(dict(zip(values, map(normalise, values)))).to_numpy()
+
+def mismatch_reasons(state, cdc, compare_attributes, profile=None):
+    """
+    Returns a Series with the "Case differs on ..." reason for each matched case, or None where every attribute matches.
+    """
+    profile = profile if profile is not None else profiles.EXACT
+    attributes = [attribute for attribute in profile.attributes(list(state.columns), cdc.columns, compare_attributes)
+                  if attribute in state.columns]
+
+    # Each case gets a bitmask of the attributes that differ, and each distinct mask is turned into a reason once
+    masks = pd.Series(0, index=state.index, dtype='int64')
+    for bit, attribute in enumerate(attributes):
+        normalise = profile.normaliser(attribute)
+        state_attribute = normalised(state[attribute], normalise)
+        cdc_attribute = normalised(cdc[attribute], normalise)
+        masks |= (state_attribute != cdc_attribute).astype('int64') << bit
+
+    reasons = {}
+    for mask in masks.unique():
+        if mask == 0:
+            reasons[mask] = None
+            continue
+        reasons[mask] = compare.mismatch_reason([attribute for bit, attribute in enumerate(attributes) if mask >> bit & 1])
+
+    return masks.map(reasons)
+
+def case_results(frame, reasons, reasonIDs):
+    """
+    Builds a CaseResult for every row of the frame. The reasons and reasonIDs can be one value for every row or a column.
+    """
+    if isinstance(reasons, str):
+        reasons = repeat(reasons)
+    if isinstance(reasonIDs, str):
+        reasonIDs = repeat(reasonIDs)
+    return [compare.CaseResult(*values) for values in
+            zip(frame['CaseID'], frame['EventCode'], frame['EventName'], frame['MMWRYear'], frame['MMWRWeek'],
+                reasons, reasonIDs, frame['CaseClassStatus'])]
+
+def run_comparison(state_source, cdc_source, filterCDC=False, compare_attributes=None, profile=None):
+    """
+    Compares the state and CDC data, given as CSV, Parquet or Arrow paths, CSV file objects or DataFrames, and returns
+    (results, stats) in the same form as compare.run_comparison.
+    """
+    columns = compare.needed_columns(compare_attributes)
+    state = state_source if isinstance(state_source, pd.DataFrame) else read_table(state_source, columns)
+    cdc = cdc_source if isinstance(cdc_source, pd.DataFrame) else read_table(cdc_source, columns)
+
+    cdcEventCodes = set(cdc['EventCode']) if filterCDC else None
+
+    duplicated = cdc['CaseID'].duplicated()
+    duplicates = cdc[duplicated]
+    cdc = cdc[~duplicated]
+
+    state = dedup_state(state, cdcEventCodes)
+
+    matched = state['CaseID'].isin(cdc['CaseID'])
+    missing_cdc = state[~matched]
+    missing_state = cdc[~cdc['CaseID'].isin(state['CaseID'])]
+
+    matched_state = state[matched].reset_index(drop=True)
+    matched_cdc = cdc.set_index('CaseID', drop=False).loc[matched_state['CaseID']].reset_index(drop=True)
+    reasons = mismatch_reasons(matched_state, matched_cdc, compare_attributes, profile)
+
+    # The state side results are listed in the order of the state data, like compare.Reconciler.comp
+    state_reasons = pd.Series("CaseID not found in CDC dataset", index=state.index, dtype=object)
+    state_reasons[matched] = reasons.to_numpy()
+    state_reasonIDs = pd.Series("2", index=state.index, dtype=object)
+    state_reasonIDs[matched] = "3"
+    has_result = state_reasons.notna()
+
+    results = case_results(duplicates, "Duplicate CaseID found in CDC dataset", "1")
+    results.extend(case_results(state[has_result], state_reasons[has_result], state_reasonIDs[has_result]))
+    results.extend(case_results(missing_state, "CaseID not found in State dataset", "4"))
+
+    # Stats entries are created in the same order as compare.Reconciler: CDC EventCodes first, then new state EventCodes
+    names = pd.concat([cdc[['EventCode', 'EventName']], state[['EventCode', 'EventName']]]).drop_duplicates('EventCode')
+    counts = pd.DataFrame({
+        'totalCases': state['EventCode'].value_counts().add(missing_state['EventCode'].value_counts(), fill_value=0),
+        'totalDuplicates': duplicates['EventCode'].value_counts(),
+        'totalMissingCDC': missing_cdc['EventCode'].value_counts(),
+        'totalMissingState': missing_state['EventCode'].value_counts(),
+        'totalWrongAttributes': matched_state.loc[reasons.notna(), 'EventCode'].value_counts(),
+    }, columns=STATS_COLUMNS).reindex(names['EventCode']).fillna(0).astype(int)
+
+    stats = {}
+    for eventCode, eventName, *totals in zip(names['EventCode'], names['EventName'], *(counts[column] for column in STATS_COLUMNS)):
+        stats[eventCode] = {'eventName': eventName, **{column: int(total) for column, total in zip(STATS_COLUMNS, totals)}}
+
+    return results, stats
@@ -1,9 +1,17 @@
 import csv
 import argparse
+import json
+import re
 from datetime import datetime
 import os
+from itertools import chain
+from functools import lru_cache
+from operator import itemgetter
+import profiles
 
 class CaseResult:
+    __slots__ = ('caseID', 'eventCode', 'eventName', 'MMWRYear', 'MMWRWeek', 'reason', 'reasonID', 'caseClassStatus')
+
     def __init__(self, caseID, eventCode, eventName, MMWRYear, MMWRWeek, reason, reasonID, caseClassStatus) -> None:
         self.caseID = caseID
         self.eventCode = eventCode
@@ -14,10 +22,90 @@ class CaseResult:
         self.reasonID = reasonID
         self.caseClassStatus = caseClassStatus
 
-# dictionary holding all stats for this report
-stats = {}
+class CompactRow:
+    """
+    A row of state or CDC data stored as a tuple of values. The column index is shared by every row of the
+    same RowLayout, and rows can be read like the dictionaries csv.DictReader gives.
+    """
+    __slots__ = ('index', 'values')
+
+    def __init__(self, index, values) -> None:
+        self.index = index
+        self.values = values
+
+    def __getitem__(self, column):
+        return self.values[self.index[column]]
+
+    def __contains__(self, column):
+        return column in self.index
+
+    def keys(self):
+        return self.index.keys()
+
+def tuple_getter(columns):
+    """
+    Returns a function that gets the values of the given columns from a row as a tuple.
+    """
+    if len(columns) == 1:
+        return lambda row: (row[columns[0]],)
+    if len(columns) == 0:
+        return lambda row: ()
+    return itemgetter(*columns)
+
+class RowLayout:
+    """
+    The columns kept for the rows of one dataset. Rows are turned into CompactRows that only hold these
+    columns, and repeated values like EventName are pooled so every row shares one copy of them.
+    """
+    # CaseIDs and add_times are nearly all different, so pooling them would only cost memory
+    UNPOOLED_COLUMNS = ('CaseID', 'add_time')
+
+    def __init__(self, columns) -> None:
+        self.columns = list(columns)
+        plain = [column for column in self.columns if column in self.UNPOOLED_COLUMNS]
+        pooled = [column for column in self.columns if column not in self.UNPOOLED_COLUMNS]
+        # Values are stored plain columns first, but the index keeps the columns in their original order
+        positions = {column: position for position, column in enumerate(plain + pooled)}
+        self.index = {column: positions[column] for column in self.columns}
+        self.get_plain = tuple_getter(plain)
+        self.get_pooled = tuple_getter(pooled)
+        self.pool = {}
+
+    def compact(self, row):
+        pooled = self.get_pooled(row)
+        return CompactRow(self.index, self.get_plain(row) + tuple(map(self.pool.setdefault, pooled, pooled)))
+
+    def compactor(self, row):
+        """
+        Returns a function that turns rows like the given one into CompactRows of this layout. CompactRows, like the
+        ones csv_scan gives, are only narrowed down to the columns of this layout.
+        """
+        if not isinstance(row, CompactRow):
+            return self.compact
+        if row.index == self.index:
+            return lambda row: row
+        # The values are already pooled, so only the needed ones are taken from each row's tuple
+        get_values = tuple_getter([row.index[column] for column in sorted(self.index, key=self.index.get)])
+        return lambda row: CompactRow(self.index, get_values(row.values))
+
+# Columns every comparison needs for its results, whatever attributes are compared
+REQUIRED_COLUMNS = ['CaseID', 'EventCode', 'EventName', 'MMWRYear', 'MMWRWeek', 'CaseClassStatus']
+
+RESULT_FIELDNAMES = ['CaseID', 'EventCode', 'EventName', 'MMWRYear',
+                     'MMWRWeek', 'Reason', 'ReasonID', 'CaseClassStatus']
 
-results: list[CaseResult] = []
+# Comparison engines that can be picked with --engine. The columnar engine needs pandas installed,
+# and the external engine sorts both datasets on disk for inputs that do not fit in memory.
+ENGINES = ['python', 'columnar', 'external']
+
+# Files with these extensions are read and written as Parquet or Arrow IPC instead of CSV, which needs pyarrow installed
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+# Rows are read from and written to Parquet and Arrow files in batches of this many
+TABLE_BATCH_ROWS = 65536
+
+STATS_FIELDNAMES = ['EventCode', 'EventName', 'TotalCases', 'TotalDuplicates',
+                    'TotalMissingFromCDC', 'TotalMissingFromState', 'TotalWrongAttributes']
 
 def parse_time(time_string):
     try:
@@ -25,173 +113,581 @@ def parse_time(time_string):
     except ValueError:
         return datetime.strptime(time_string, "%Y-%m-%d %H:%M:%S")
 
-def get_state_dict(state_file, eventCodes=None):
-    state_dict = {}
-    # Open the state CSV file
-    with open(state_file, newline='', encoding='utf-8-sig') as csvfile:
+# add_time values in either of the formats parse_time accepts, written with zero-padded fields
+ADD_TIME_PATTERN = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]{1,6})?")
+
+def time_key(time_string):
+    """
+    Returns a string that sorts the same way as parse_time(time_string), so add_times can be compared without
+    parsing them. Zero-padded times are used as they are, only dropping trailing zeros from the fraction so that
+    equal times give equal keys. Anything else is parsed once with parse_time.
+    """
+    if ADD_TIME_PATTERN.fullmatch(time_string) is None:
+        time = parse_time(time_string)
+        time_string = f"{time.year:04d}-{time.month:02d}-{time.day:02d} {time.hour:02d}:{time.minute:02d}:{time.second:02d}.{time.microsecond:06d}"
+    if '.' in time_string:
+        time_string = time_string.rstrip('0').rstrip('.')
+    return time_string
+
+def read_csv(csv_file):
+    """
+    Yields each row of a CSV file as a dictionary.
+    """
+    with open(csv_file, newline='', encoding='utf-8-sig') as csvfile:
         # Create a CSV reader object
         reader = csv.DictReader(csvfile)
-        # Loop through each row in the CSV file
         for row in reader:
-            # If the EventCode is not a number, skip the row (Getting rid of values like MAPPING and ZT_PP_Condition3)
-            if row['EventCode'].isnumeric() == False:
-                continue
-            # Here we are filtering out the rows of the database by the event code that they have
-            if eventCodes is not None and row['EventCode'] not in eventCodes:
-                continue
-            if row['CaseID'] in state_dict:
-                # If the case ID already exists in the dictionary, check to see if the new row has a more recent add_time
+            yield row
 
-                existing_date_string = state_dict[row['CaseID']]['add_time']
-                existing_datetime = parse_time(existing_date_string)
+def file_format(data_file):
+    """
+    Returns 'parquet', 'arrow' or 'csv' for a file path, going by its extension.
+    """
+    extension = os.path.splitext(str(data_file))[1].lower()
+    if extension in PARQUET_EXTENSIONS:
+        return 'parquet'
+    if extension in ARROW_EXTENSIONS:
+        return 'arrow'
+    return 'csv'
 
-                new_date_string = row['add_time']
-                new_datetime = parse_time(new_date_string)
+def needed_columns(compare_attributes=None):
+    """
+    Returns the columns a comparison reads from its input files, or None if it needs every column.
+    """
+    if compare_attributes is None:
+        return None
+    return list(dict.fromkeys(REQUIRED_COLUMNS + ['add_time'] + list(compare_attributes)))
 
-                if new_datetime > existing_datetime:
-                    state_dict[row['CaseID']] = row
+def string_batches(data_file, columns=None):
+    """
+    Yields the record batches of a Parquet or Arrow IPC file with every column cast to strings and nulls read as
+    empty strings, so the values are the same as they would be in a CSV file. If columns are given, only those that
+    are in the file are read.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
 
-            else:
-                # Add the row as a dictionary to the list
-                state_dict[row['CaseID']] = row
+    def as_string(column):
+        # Timestamps are written in a format parse_time reads: local time without an offset, and at most 6
+        # fractional digits, so nanoseconds are cut to microseconds
+        if pa.types.is_timestamp(column.type):
+            if column.type.tz is not None:
+                column = pc.local_timestamp(column)
+            if column.type.unit == 'ns':
+                column = column.cast(pa.timestamp('us'), safe=False)
+        return pc.fill_null(column.cast(pa.string()), "")
+
+    def as_strings(batch):
+        if columns is not None:
+            batch = batch.select([column for column in batch.schema.names if column in columns])
+        return pa.record_batch([as_string(column) for column in batch.columns], names=batch.schema.names)
+
+    if file_format(data_file) == 'parquet':
+        parquet_file = pq.ParquetFile(data_file)
+        # Column projection: the columns that are not needed are never read from the file
+        projection = None if columns is None else [column for column in parquet_file.schema_arrow.names if column in columns]
+        for batch in parquet_file.iter_batches(batch_size=TABLE_BATCH_ROWS, columns=projection):
+            yield as_strings(batch)
+    else:
+        with pa.memory_map(str(data_file)) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield as_strings(reader.get_batch(i))
+
+def read_table_rows(data_file, columns=None):
+    """
+    Yields each row of a Parquet or Arrow IPC file as a dictionary of strings.
+    """
+    for batch in string_batches(data_file, columns):
+        names = batch.schema.names
+        for values in zip(*(column.to_pylist() for column in batch.columns)):
+            yield dict(zip(names, values))
+
+def read_rows(data_file, columns=None):
+    """
+    Yields each row of a CSV, Parquet or Arrow IPC file as a dictionary, going by the file's extension.
+    Only the given columns are read from Parquet and Arrow files, while CSV files always give every column.
+    """
+    if file_format(data_file) == 'csv':
+        return read_csv(data_file)
+    return read_table_rows(data_file, columns)
+
+class TableWriter:
+    """
+    Writes rows to a CSV, Parquet or Arrow IPC file, going by the file's extension. Parquet and Arrow rows are
+    written in batches of TABLE_BATCH_ROWS, with integer_fields stored as integers and the other fields as strings.
+    """
+    def __init__(self, data_file, fieldnames, integer_fields=()) -> None:
+        self.format = file_format(data_file)
+        if self.format == 'csv':
+            self.file = open(data_file, 'w', newline='')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(fieldnames)
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.schema = pa.schema([(field, pa.int64() if field in integer_fields else pa.string()) for field in fieldnames])
+        if self.format == 'parquet':
+            self.writer = pq.ParquetWriter(data_file, self.schema)
+        else:
+            self.writer = pa.ipc.new_file(data_file, self.schema)
+        self.buffer = []
+
+    def writerow(self, row):
+        if self.format == 'csv':
+            self.writer.writerow(row)
+            return
+        self.buffer.append(row)
+        if len(self.buffer) >= TABLE_BATCH_ROWS:
+            self.flush()
+
+    def writerows(self, rows):
+        if self.format == 'csv':
+            self.writer.writerows(rows)
+            return
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if self.format == 'csv' or not self.buffer:
+            return
+        import pyarrow as pa
+        columns = [pa.array(values, type=field.type) for values, field in zip(zip(*self.buffer), self.schema)]
+        self.writer.write_batch(pa.record_batch(columns, schema=self.schema))
+        self.buffer = []
+
+    def close(self):
+        if self.format == 'csv':
+            self.file.close()
+            return
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def fetch_records(cursor, batch_size=10000):
+    """
+    Yields the records of an executed database query, fetching batch_size records at a time so the whole
+    result is never held in memory and the records can be used while the rest are still being fetched.
+    """
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        yield from batch
+
+def query_rows(column_names, records):
+    """
+    Yields database query records as row dictionaries, formatting each value the same way it would be written to a CSV file.
+    """
+    for record in records:
+        yield {column: "" if value is None else str(value) for column, value in zip(column_names, record)}
+
+def peek_columns(rows):
+    """
+    Returns the columns of an iterable of row dictionaries along with an iterable that still yields every row.
+    """
+    rows = iter(rows)
+    first_row = next(rows, None)
+    if first_row is None:
+        return [], rows
+    return list(first_row.keys()), chain([first_row], rows)
+
+def kept_columns(state_columns, cdc_columns, compare_attributes=None):
+    """
+    Returns the state and CDC columns a comparison needs to keep: the columns used for the results, the
+    compared attributes (every state column when none are given) and add_time for picking the latest state row.
+    If the state columns are not known yet (None) and no attributes are given, every CDC column is kept.
+    """
+    if state_columns is None and compare_attributes is None:
+        return None, list(cdc_columns)
+    compared = state_columns if compare_attributes is None else compare_attributes
+    needed = set(REQUIRED_COLUMNS) | set(compared) | {'add_time'}
+    return ([column for column in state_columns if column in needed] if state_columns is not None else None,
+            [column for column in cdc_columns if column in needed])
+
+# Most normalised values each attribute keeps, so values repeated across cases are only normalised once
+NORMALISED_CACHE_SIZE = 65536
+
+class AttributeComparer:
+    """
+    Finds the attributes a state row and a CDC row differ on, normalising their values with a comparison profile.
+    The attributes compared and the positions of their values are worked out once for the CompactRows of each pair
+    of layouts, and values are only normalised when they are not already equal.
+    """
+    def __init__(self, compare_attributes=None, profile=None) -> None:
+        self.compare_attributes = compare_attributes
+        self.profile = profile if profile is not None else profiles.EXACT
+        self.normalisers = {}
+        self.layouts = None
+        self.plan = None
+
+    def normaliser(self, column):
+        normalise = self.normalisers.get(column)
+        if normalise is None:
+            normalise = self.profile.normaliser(column)
+            if normalise is not profiles.exact:
+                normalise = lru_cache(maxsize=NORMALISED_CACHE_SIZE)(normalise)
+            self.normalisers[column] = normalise
+        return normalise
+
+    def compile(self, state_index, cdc_index):
+        """
+        Returns the (attribute, state position, CDC position, normaliser) of every attribute compared between rows
+        of the given layouts.
+        """
+        return [(attribute, state_index[attribute], cdc_index[attribute], self.normaliser(attribute))
+                for attribute in self.profile.attributes(state_index.keys(), cdc_index, self.compare_attributes)]
+
+    def differing(self, state_row, cdc_row):
+        """
+        Returns the list of attributes that differ between a state row and a CDC row for the same case.
+        """
+        if isinstance(state_row, CompactRow) and isinstance(cdc_row, CompactRow):
+            if self.layouts is None or self.layouts[0] is not state_row.index or self.layouts[1] is not cdc_row.index:
+                self.layouts = (state_row.index, cdc_row.index)
+                self.plan = self.compile(state_row.index, cdc_row.index)
+            state_values, cdc_values = state_row.values, cdc_row.values
+            return [attribute for attribute, state_position, cdc_position, normalise in self.plan
+                    if state_values[state_position] != cdc_values[cdc_position]
+                    and normalise(state_values[state_position]) != normalise(cdc_values[cdc_position])]
+
+        # Other rows are read by column name
+        return [attribute for attribute in self.profile.attributes(state_row.keys(), cdc_row, self.compare_attributes)
+                if state_row[attribute] != cdc_row[attribute]
+                and self.normaliser(attribute)(state_row[attribute]) != self.normaliser(attribute)(cdc_row[attribute])]
+
+def differing_attributes(state_row, cdc_row, compare_attributes=None, profile=None):
+    """
+    Returns the list of attributes that differ between a state row and a CDC row for the same case.
+    """
+    return AttributeComparer(compare_attributes, profile).differing(state_row, cdc_row)
+
+MISMATCH_PREFIX = "Case differs on "
+MISMATCH_SUFFIX = " between State and CDC datasets"
+
+def mismatch_reason(att_list):
+    wrong_attribute_string = ", ".join(att_list)
+    return f"{MISMATCH_PREFIX}{wrong_attribute_string}{MISMATCH_SUFFIX}"
+
+def mismatch_attributes(reason):
+    """
+    Returns the list of attributes in a reason made by mismatch_reason, or None if it is another kind of reason.
+    """
+    if reason.startswith(MISMATCH_PREFIX) and reason.endswith(MISMATCH_SUFFIX):
+        return reason[len(MISMATCH_PREFIX):-len(MISMATCH_SUFFIX)].split(", ")
+    return None
+
+def compact_rows(rows, columns=None):
+    """
+    Yields the rows of an iterable of row dictionaries as CompactRows holding the given columns, or every column if
+    none are given. CompactRows, like the ones csv_scan gives, are only narrowed down to the given columns.
+    """
+    rows = iter(rows)
+    first_row = next(rows, None)
+    if first_row is None:
+        return
+    layout = RowLayout(list(first_row.keys()) if columns is None else columns)
+    yield from map(layout.compactor(first_row), chain([first_row], rows))
+
+def get_state_dict(state_file, eventCodes=None, columns=None):
+    return load_state_rows(read_rows(state_file, columns), eventCodes, columns)
+
+def load_state_rows(rows, eventCodes=None, columns=None):
+    """
+    Builds the state dictionary from an iterable of row dictionaries, keeping the most recent row for each CaseID.
+    Rows are stored as CompactRows holding the given columns, or every column if none are given.
+    """
+    state_dict = {}
+    latest_times = {}
+    layout = RowLayout(columns) if columns is not None else None
+    compact = None
+    # Loop through each row of the state data
+    for row in rows:
+        # If the EventCode is not a number, skip the row (Getting rid of values like MAPPING and ZT_PP_Condition3)
+        if row['EventCode'].isnumeric() == False:
+            continue
+        # Here we are filtering out the rows of the database by the event code that they have
+        if eventCodes is not None and row['EventCode'] not in eventCodes:
+            continue
+        if compact is None:
+            if layout is None:
+                layout = RowLayout(row.keys())
+            compact = layout.compactor(row)
+        row = compact(row)
+
+        existing_row = state_dict.get(row['CaseID'])
+        if existing_row is None:
+            # Add the row as a dictionary to the list
+            state_dict[row['CaseID']] = row
+            continue
+
+        # If the case ID already exists in the dictionary, check to see if the new row has a more recent add_time.
+        # Each add_time is only turned into a key once, the key of the current row is kept in latest_times
+        existing_time = latest_times.get(row['CaseID'])
+        if existing_time is None:
+            existing_time = time_key(existing_row['add_time'])
+
+        new_time = time_key(row['add_time'])
+
+        if new_time > existing_time:
+            state_dict[row['CaseID']] = row
+            latest_times[row['CaseID']] = new_time
+        else:
+            latest_times[row['CaseID']] = existing_time
 
     return state_dict
 
-def get_cdc_dict(cdc_file, filterCDC = False):
-    cdc_dict = {}
-    # Open the cdc CSV file
-    cdcEventCodes = set() if filterCDC else None
-    with open(cdc_file, newline='', encoding='utf-8-sig') as csvfile:
-        # Create a CSV reader object
-        reader = csv.DictReader(csvfile)
-        # Loop through each row in the CSV file
-        for row in reader:
+class Reconciler:
+    """
+    A single comparison between state and CDC data, holding its own results and stats so that
+    several comparisons can run in the same process at once.
+    """
+    def __init__(self, profile=None) -> None:
+        # dictionary holding all stats for this report
+        self.stats = {}
+        # comparison profile the attributes are normalised with, values are compared as they are if None
+        self.profile = profile
+
+        self.results: list[CaseResult] = []
+
+    def get_cdc_dict(self, cdc_file, filterCDC = False, columns=None):
+        return self.load_cdc_rows(read_rows(cdc_file, columns), filterCDC, columns)
+
+    def load_cdc_rows(self, rows, filterCDC = False, columns=None):
+        """
+        Builds the CDC dictionary from an iterable of row dictionaries, recording any duplicate CaseIDs as results.
+        Rows are stored as CompactRows holding the given columns, or every column if none are given.
+        """
+        cdc_dict = {}
+        cdcEventCodes = set() if filterCDC else None
+        # Loop through each row of the CDC data
+        for row in compact_rows(rows, columns):
             # Add the row as a dictionary to the list
             if filterCDC:
                 cdcEventCodes.add(row['EventCode'])
             if row['CaseID'] in cdc_dict:
-                results.append(CaseResult(row['CaseID'], row['EventCode'],
+                self.results.append(CaseResult(row['CaseID'], row['EventCode'],
                                row['EventName'], row['MMWRYear'], row['MMWRWeek'], "Duplicate CaseID found in CDC dataset", "1", row["CaseClassStatus"]))
-                
+            
                 # adding duplicates to duplicate count if needed
-                stats[row['EventCode']]['totalDuplicates'] += 1
-                
+                self.stats[row['EventCode']]['totalDuplicates'] += 1
+            
             else:
                 cdc_dict[row['CaseID']] = row
-                if row['EventCode'] not in stats:
-                    stats[row['EventCode']] = {'eventName': row['EventName'], 'totalCases': 0, 'totalDuplicates': 0, 'totalMissingCDC': 0, 'totalMissingState': 0, 'totalWrongAttributes': 0}
+                if row['EventCode'] not in self.stats:
+                    self.stats[row['EventCode']] = {'eventName': row['EventName'], 'totalCases': 0, 'totalDuplicates': 0, 'totalMissingCDC': 0, 'totalMissingState': 0, 'totalWrongAttributes': 0}
+
+        return cdc_dict, cdcEventCodes
 
-    return cdc_dict, cdcEventCodes
+    # place the stats stuff here
+    def comp(self, state_dict, cdc_dict, compare_attributes=None):
+        self.results.extend(self.compare_cases(state_dict, cdc_dict, compare_attributes))
 
-# place the stats stuff here
-def comp(state_dict, cdc_dict, compare_attributes=None):
-    for state_case_id in state_dict:
-        state_row = state_dict[state_case_id]
+    def compare_cases(self, state_dict, cdc_dict, compare_attributes=None):
+        """
+        Compares the state and CDC dictionaries, yielding each CaseResult as soon as it is found and counting it in
+        the stats, which are only complete once every result has been read.
+        """
+        comparer = AttributeComparer(compare_attributes, self.profile)
+        # Cases that differ on the same attributes share one reason string
+        reasons = {}
+        for state_case_id in state_dict:
+            state_row = state_dict[state_case_id]
         
-        # checking if a given event code already exists in the stats dictionary
-        if state_row['EventCode'] in stats:
-            stats[state_row['EventCode']]['totalCases'] += 1
-        else:
-            stats[state_row['EventCode']] = {'eventName': state_row['EventName'], 'totalCases': 1, 'totalDuplicates': 0, 'totalMissingCDC': 0, 'totalMissingState': 0, 'totalWrongAttributes': 0}
+            # checking if a given event code already exists in the stats dictionary
+            if state_row['EventCode'] in self.stats:
+                self.stats[state_row['EventCode']]['totalCases'] += 1
+            else:
+                self.stats[state_row['EventCode']] = {'eventName': state_row['EventName'], 'totalCases': 1, 'totalDuplicates': 0, 'totalMissingCDC': 0, 'totalMissingState': 0, 'totalWrongAttributes': 0}
 
-        # If a case ID is in the state DB but not the CDC DB, mark it as a missing case
-        if state_case_id not in cdc_dict:
-            results.append(CaseResult(
-                state_case_id, state_row['EventCode'], state_row['EventName'], state_row['MMWRYear'], state_row['MMWRWeek'], "CaseID not found in CDC dataset", "2", state_row["CaseClassStatus"]))
+            # If a case ID is in the state DB but not the CDC DB, mark it as a missing case
+            if state_case_id not in cdc_dict:
+                yield CaseResult(
+                    state_case_id, state_row['EventCode'], state_row['EventName'], state_row['MMWRYear'], state_row['MMWRWeek'], "CaseID not found in CDC dataset", "2", state_row["CaseClassStatus"])
             
-            # counting the missing case in totalMissingCDC for this eventCode
-            stats[state_row['EventCode']]['totalMissingCDC'] += 1
+                # counting the missing case in totalMissingCDC for this eventCode
+                self.stats[state_row['EventCode']]['totalMissingCDC'] += 1
             
-        else:
-            # Determine which attributes to compare: specified ones or all
-            attributes_to_compare = compare_attributes if compare_attributes is not None else state_row.keys()
-            att_list = []
-            for attribute in attributes_to_compare:
-                # Skip if the attribute is not in the CDC dict
-                if attribute not in cdc_dict[state_case_id]:
-                    continue
-
-                state_attribute = state_row[attribute]
-                cdc_attribute = cdc_dict[state_case_id][attribute]
-
-                if state_attribute == "":
-                    state_attribute = "NULL"
-
-                if cdc_attribute == "":
-                    cdc_attribute = "NULL"
-
-                # If a case has different attributes between state and CDC DBs, mark it as such
-                if state_attribute != cdc_attribute:
-                    att_list.append(attribute)
-
-            if (att_list != []):
-                wrong_attribute_string = ", ".join(att_list)
-                reason_string = f"Case differs on {wrong_attribute_string} between State and CDC datasets"
-                
-                results.append(CaseResult(state_case_id, state_row['EventCode'], state_row['EventName'], state_row[
-                                   'MMWRYear'], state_row['MMWRWeek'], reason_string, "3", state_row["CaseClassStatus"]))
-                # making sure to also count this discrepancy in the stats.csv file
-                stats[state_row['EventCode']]['totalWrongAttributes'] += 1
+            else:
+                att_list = tuple(comparer.differing(state_row, cdc_dict[state_case_id]))
+                reason_string = reasons.get(att_list)
+                if reason_string is None:
+                    reason_string = reasons[att_list] = mismatch_reason(att_list) if att_list != () else ""
+
+                if reason_string:
+                    yield CaseResult(state_case_id, state_row['EventCode'], state_row['EventName'], state_row[
+                                     'MMWRYear'], state_row['MMWRWeek'], reason_string, "3", state_row["CaseClassStatus"])
+                    # making sure to also count this discrepancy in the stats.csv file
+                    self.stats[state_row['EventCode']]['totalWrongAttributes'] += 1
                 
-            # Remove the case from the CDC dict so we can track what cases are missing from the state side
-            del cdc_dict[state_case_id]
-
-    # If there exists cases in the CDC dictionary still, mark it as a missing case on the state side
-    for cdc_case_id in cdc_dict:
-        cdc_row = cdc_dict[cdc_case_id]
-        results.append(CaseResult(cdc_case_id, cdc_row['EventCode'], cdc_row['EventName'],
-                       cdc_row['MMWRYear'], cdc_row['MMWRWeek'], "CaseID not found in State dataset", "4", cdc_row["CaseClassStatus"]))
+                # Remove the case from the CDC dict so we can track what cases are missing from the state side
+                del cdc_dict[state_case_id]
+
+        # If there exists cases in the CDC dictionary still, mark it as a missing case on the state side
+        for cdc_case_id in cdc_dict:
+            cdc_row = cdc_dict[cdc_case_id]
+            yield CaseResult(cdc_case_id, cdc_row['EventCode'], cdc_row['EventName'],
+                             cdc_row['MMWRYear'], cdc_row['MMWRWeek'], "CaseID not found in State dataset", "4", cdc_row["CaseClassStatus"])
         
-        # adding in missing from state count, total case count, and caseID to the stats dict
-        # only counting cases that are not duplicates, otherwise counting as duplicate
-        if cdc_row['EventCode'] in stats:
-            stats[cdc_row['EventCode']]['totalMissingState'] += 1
-            stats[cdc_row['EventCode']]['totalCases'] += 1
-        else:
-            stats[cdc_row['EventCode']] = {'eventName': cdc_row['EventName'], 'totalCases': 1, 'totalDuplicates': 0, 'totalMissingCDC': 0, 'totalMissingState': 1, 'totalWrongAttributes': 0}
+            # adding in missing from state count, total case count, and caseID to the stats dict
+            # only counting cases that are not duplicates, otherwise counting as duplicate
+            if cdc_row['EventCode'] in self.stats:
+                self.stats[cdc_row['EventCode']]['totalMissingState'] += 1
+                self.stats[cdc_row['EventCode']]['totalCases'] += 1
+            else:
+                self.stats[cdc_row['EventCode']] = {'eventName': cdc_row['EventName'], 'totalCases': 1, 'totalDuplicates': 0, 'totalMissingCDC': 0, 'totalMissingState': 1, 'totalWrongAttributes': 0}
+
+    def load_cdc(self, cdc_rows, filterCDC=False, compare_attributes=None, state_columns=None):
+        """
+        Loads the CDC rows keeping only the columns the comparison needs. The state columns can be left out
+        so the CDC data can be loaded before the state data is available.
+        """
+        cdc_columns, cdc_rows = peek_columns(cdc_rows)
+        _, cdc_columns = kept_columns(state_columns, cdc_columns, compare_attributes)
+        return self.load_cdc_rows(cdc_rows, filterCDC, cdc_columns)
+
+    def compare_state(self, state_rows, cdc_dict, cdcEventCodes, compare_attributes=None, stream=False):
+        """
+        Loads the state rows and compares them against CDC data loaded with load_cdc, returning (results, stats).
+        If stream is True, results is an iterator that compares the cases as it is read, see streamed.
+        """
+        state_dict = self.load_state(state_rows, cdcEventCodes, compare_attributes)
+        if stream:
+            return self.streamed(state_dict, cdc_dict, compare_attributes)
+        self.comp(state_dict, cdc_dict, compare_attributes)
+
+        return self.results, self.stats
+
+    def streamed(self, state_dict, cdc_dict, compare_attributes=None):
+        """
+        Returns (results, stats) where results yields the CDC duplicates already found and then the results of
+        compare_cases, so they can be written out without being kept in memory. The stats are only complete once
+        every result has been read.
+        """
+        return chain(self.results, self.compare_cases(state_dict, cdc_dict, compare_attributes)), self.stats
+
+    def load_state(self, state_rows, cdcEventCodes=None, compare_attributes=None):
+        """
+        Loads the state dictionary keeping only the columns the comparison needs.
+        """
+        state_columns, state_rows = peek_columns(state_rows)
+        state_columns, _ = kept_columns(state_columns, [], compare_attributes)
+        return load_state_rows(state_rows, cdcEventCodes, state_columns)
+
+    def run(self, state_rows, cdc_rows, filterCDC=False, compare_attributes=None, stream=False):
+        """
+        Compares iterables of state and CDC row dictionaries and returns the (results, stats) of the comparison.
+        """
+        # Only keep the columns this comparison uses
+        state_columns, state_rows = peek_columns(state_rows)
+        cdc_dict, cdcEventCodes = self.load_cdc(cdc_rows, filterCDC, compare_attributes, state_columns)
+        return self.compare_state(state_rows, cdc_dict, cdcEventCodes, compare_attributes, stream)
+
+def run_comparison(state_rows, cdc_rows, filterCDC=False, compare_attributes=None, profile=None, stream=False):
+    """
+    Runs a new Reconciler over the given state and CDC rows and returns its (results, stats).
+    """
+    return Reconciler(profile).run(state_rows, cdc_rows, filterCDC, compare_attributes, stream)
+
+def result_row(result):
+    """
+    Returns a CaseResult as a tuple in the column order of RESULT_FIELDNAMES.
+    """
+    return (result.caseID, result.eventCode, result.eventName, result.MMWRYear,
+            result.MMWRWeek, result.reason, result.reasonID, result.caseClassStatus)
+
+def stats_rows(stats):
+    """
+    Yields the stats dictionary as tuples in the column order of STATS_FIELDNAMES.
+    """
+    for eventCode, data in stats.items():
+        yield (eventCode, data['eventName'], data['totalCases'], data['totalDuplicates'],
+               data['totalMissingCDC'], data['totalMissingState'], data['totalWrongAttributes'])
+
+def write_results(results, results_file, fieldnames=RESULT_FIELDNAMES):
+    # Create Results File (CSV, Parquet or Arrow) and write the results to it. fieldnames can leave out
+    # the last columns of RESULT_FIELDNAMES
+    with TableWriter(results_file, fieldnames) as writer:
+        writer.writerows(result_row(result)[:len(fieldnames)] for result in results)
+
+def write_stats(stats, stats_file):
+    # writing stats data to the file, keeping the totals as numbers
+    with TableWriter(stats_file, STATS_FIELDNAMES, STATS_FIELDNAMES[2:]) as writer:
+        writer.writerows(stats_rows(stats))
 
 def main():
     parser = argparse.ArgumentParser(
-        prog="CompareCDCAndState", description='Compare CDC and State CSV files')
-    parser.add_argument('-s', '--state', help='Local Path to State CSV file')
-    parser.add_argument('-c', '--cdc', help='Local Path to CDC CSV file')
-    parser.add_argument('-o', '--output', help='Local Path to Output CSV file')
+        prog="CompareCDCAndState", description='Compare CDC and State CSV, Parquet or Arrow files')
+    parser.add_argument('-s', '--state', help='Local Path to State CSV, Parquet or Arrow file')
+    parser.add_argument('-c', '--cdc', help='Local Path to CDC CSV, Parquet or Arrow file')
+    parser.add_argument('-o', '--output', help='Local Path to Output CSV, Parquet or Arrow file')
     # if the parameter below is specified the value stored is true
     parser.add_argument('-f', '--filter', action='store_true', help='Filter by CDC eventCodes')
     parser.add_argument('-a', '--attributes', nargs='*', help='Attributes to compare')
+    parser.add_argument('-e', '--engine', choices=ENGINES, default='python', help='Comparison engine to use')
+    parser.add_argument('--spill-rows', type=int, default=500000, help='Most rows of each file held in memory by the external engine')
+    parser.add_argument('--spill-dir', help='Folder for the external engine\'s temporary sort files')
+    parser.add_argument('--scan-workers', type=int, help='Processes used by the python engine to read a CDC CSV file (the number of CPUs by default)')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Processes the python engine splits the comparison across by CaseID')
+    parser.add_argument('--cdc-cache', help='Folder to cache loaded CDC files in, so comparing the same CDC file again skips parsing it')
+    parser.add_argument('--cdc-cache-mb', type=int, default=1024, help='Largest size of the CDC cache in MB')
+    parser.add_argument('-p', '--profile', help='Comparison profile from the comparison_profiles setting to normalise the attributes with')
+    parser.add_argument('--config', default=os.path.join(os.path.dirname(__file__), 'config.json'), help='Config file to read the comparison profiles from')
     args = parser.parse_args()
 
-    cdc_dict, cdcEventCodes = get_cdc_dict(args.cdc, args.filter)
-    state_dict = get_state_dict(args.state, cdcEventCodes)
-    comp(state_dict, cdc_dict, args.attributes)
+    profile = None
+    if args.profile:
+        with open(args.config, 'r') as f:
+            try:
+                profile = profiles.load_profile(json.load(f), args.profile)
+            except ValueError as e:
+                parser.error(str(e))
 
-    # Create Results CSV File and write the results to it
-    with open(args.output, 'w', newline='') as csvfile:
-        fieldnames = ['CaseID', 'EventCode', 'EventName', 'MMWRYear',
-                      'MMWRWeek', 'Reason', 'ReasonID', 'CaseClassStatus']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    # Only the columns the comparison uses are read from Parquet and Arrow inputs
+    columns = needed_columns(args.attributes)
+    if args.engine == 'columnar':
+        import columnar
+        results, stats = columnar.run_comparison(args.state, args.cdc, args.filter, args.attributes, profile)
+    elif args.engine == 'external':
+        import sortmerge
+        results, stats = sortmerge.run_comparison(read_rows(args.state, columns), read_rows(args.cdc, columns), args.filter,
+                                                  args.attributes, args.spill_rows, args.spill_dir, profile)
+    elif args.workers > 1:
+        import csv_scan
+        import partitioned
+        results, stats = partitioned.run_comparison(read_rows(args.state, columns), csv_scan.read_rows(args.cdc, columns, args.scan_workers),
+                                                    args.filter, args.attributes, args.workers, profile)
+    elif args.cdc_cache:
+        import cdc_cache
+        import csv_scan
+        cache = cdc_cache.CDCCache(args.cdc_cache, args.cdc_cache_mb * 1024 * 1024)
+        reconciler = Reconciler(profile)
+        state_columns, state_rows = peek_columns(read_rows(args.state, columns))
+        cdc_dict, cdcEventCodes = cache.load_cdc(reconciler, args.cdc, lambda path: csv_scan.read_rows(path, None, args.scan_workers),
+                                                 args.filter, args.attributes, state_columns)
+        results, stats = reconciler.compare_state(state_rows, cdc_dict, cdcEventCodes, args.attributes, stream=True)
+    else:
+        import csv_scan
+        results, stats = run_comparison(read_rows(args.state, columns), csv_scan.read_rows(args.cdc, columns, args.scan_workers),
+                                        args.filter, args.attributes, profile, stream=True)
 
-        writer.writeheader()
-        for result in results:
-            writer.writerow({'CaseID': result.caseID, 'EventCode': result.eventCode, 'EventName': result.eventName,'MMWRYear': result.MMWRYear,
-                            'MMWRWeek': result.MMWRWeek, 'Reason': result.reason, 'ReasonID': result.reasonID, 'CaseClassStatus':result.caseClassStatus})
-            
-    # writing to stats.csv but first grabbing the folder location of results.csv
+    # The results are written as they are compared, the stats are complete once they all are
+    write_results(results, args.output)
+
+    # writing to stats.csv (or stats.parquet/stats.arrow for those outputs) but first grabbing the folder location of results.csv
     output_directory = os.path.dirname(args.output)
     if output_directory == '':
         output_directory = '.'
-    
-    # writing stats data to the csv
-    with open(os.path.join(output_directory, 'stats.csv'), 'w', newline='') as csvfile:
-        fieldNames = ['EventCode', 'EventName', 'TotalCases', 'TotalDuplicates',
-                      'TotalMissingFromCDC', 'TotalMissingFromState', 'TotalWrongAttributes']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldNames)
-        
-        writer.writeheader()
-        for eventCode, data in stats.items():
-            writer.writerow({'EventCode': eventCode, 'EventName': data['eventName'], 'TotalCases': data['totalCases'],
-                             'TotalDuplicates': data['totalDuplicates'], 'TotalMissingFromCDC': data['totalMissingCDC'],
-                             'TotalMissingFromState': data['totalMissingState'], 'TotalWrongAttributes': data['totalWrongAttributes']})
+
+    stats_file = 'stats.csv' if file_format(args.output) == 'csv' else 'stats' + os.path.splitext(args.output)[1]
+    write_stats(stats, os.path.join(output_directory, stats_file))
 
 if __name__ == "__main__":
     main()
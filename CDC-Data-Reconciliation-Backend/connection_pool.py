@@ -0,0 +1,91 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+# Thread-safe pool of database connections, used by the server for both the SQLite reports database and
+# the NBS SQL Server. Each connection is only used by one thread at a time, and at most size connections
+# are in use at once, so requests wait for a free connection instead of sharing one.
+
+class ConnectionPool:
+    """
+    A fixed-size pool of connections made by calling connect. Connections are opened when first needed.
+    If check is given, it is called on an idle connection before it is handed out, and a connection it
+    raises on is closed and replaced with a new one.
+    """
+    def __init__(self, connect, size, check=None) -> None:
+        self.connect = connect
+        self.check = check
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        """
+        Waits for a free slot and returns a healthy connection. It must be given back with release.
+        """
+        self.slots.acquire()
+        try:
+            while True:
+                try:
+                    conn = self.idle.get_nowait()
+                except queue.Empty:
+                    return self.connect()
+                if self.healthy(conn):
+                    return conn
+                self.discard(conn)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, conn, failed=False):
+        """
+        Gives a connection back to the pool. Changes that were not committed on a failed connection are rolled back,
+        and the connection is closed if even that fails.
+        """
+        try:
+            if failed:
+                try:
+                    conn.rollback()
+                except Exception:
+                    self.discard(conn)
+                    return
+            self.idle.put(conn)
+        finally:
+            self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that holds a connection from the pool for the duration of the block.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, failed=True)
+            raise
+        self.release(conn)
+
+    def healthy(self, conn):
+        if self.check is None:
+            return True
+        try:
+            self.check(conn)
+            return True
+        except Exception:
+            return False
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        Closes every idle connection.
+        """
+        while True:
+            try:
+                self.discard(self.idle.get_nowait())
+            except queue.Empty:
+                return
@@ -1,39 +1,180 @@
+import argparse
 import csv
+import json
+import os
 import random
-import uuid
-
-def read_csv_to_dict(file_path):
-    data_dict = {}
-    with open(file_path, 'r') as file:
-        reader = csv.DictReader(file)
-        i = 0
-        for row in reader:
-            data_dict[i] = row
-            i += 1
-    return data_dict
-
-cdc_file_path = 'cdc.csv'
-cdc_data_dict = read_csv_to_dict(cdc_file_path)
-
-state_file_path = 'state.csv'
-state_data_dict = read_csv_to_dict(state_file_path)
-
-# Create two new files, cdc_bench.csv and state_bench.csv, each benchmark csv file should contain 1000000 rows of data
-# The CaseID column should be randomly generated and unique while the other columns should be taken from random rows in the original files
-def generate_benchmark_csv(file_path, data_dict, unique_ids):
-    with open(file_path, 'w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=data_dict[0].keys())
-        writer.writeheader()
-        for id in unique_ids:
-            random_row = random.choice(list(data_dict.values()))
-            random_row['CaseID'] = id
-            writer.writerow(random_row)
-
-benchmark_num_rows = 1000000
-benchmark_ids = [str(uuid.uuid4()) for _ in range(benchmark_num_rows)]
-
-cdc_bench_file_path = 'cdc_bench.csv'
-generate_benchmark_csv(cdc_bench_file_path, cdc_data_dict, benchmark_ids)
-
-state_bench_file_path = 'state_bench.csv'
-generate_benchmark_csv(state_bench_file_path, state_data_dict, benchmark_ids)
+from datetime import datetime, timedelta
+
+# Makes large state and CDC files for benchmarks out of the rows of smaller state and CDC files. Each case takes the
+# values of a random state row, and its CDC row takes the values of a random CDC row with the columns both files have
+# copied from the state row, so the case matches unless it is picked to be changed. The rates below pick which cases
+# are missing from either file, duplicated in the CDC file, repeated in the state file with older rows or with a row
+# of the same add_time, or changed to mismatch, and the same seed always makes the same files. Rows are written as they are made, so files of 10M+ rows
+# never have to fit in memory:
+#   python create_benchmark_data.py -n 1000000 --seed 1 -o bench
+
+DEFAULT_STATE_FILE = os.path.join(os.path.dirname(__file__), "example-data", "state.csv")
+DEFAULT_CDC_FILE = os.path.join(os.path.dirname(__file__), "example-data", "cdc.csv")
+
+# Columns that are never changed to make a mismatch, since they identify the case or group it in the stats
+FIXED_COLUMNS = ('CaseID', 'add_time', 'EventCode', 'EventName', 'MMWRYear')
+
+# CaseIDs are the case number times this odd number modulo 2**48, so they are all different but not in order
+CASE_ID_MULTIPLIER = 0x9E3779B97F4A7C15
+CASE_ID_MODULUS = 1 << 48
+
+# The add_times of the newest rows of the cases are spread over the year after this
+FIRST_ADD_TIME = datetime(2023, 1, 1)
+
+def case_id(number):
+    return f"CAS{number * CASE_ID_MULTIPLIER % CASE_ID_MODULUS:012X}BM01"
+
+def read_templates(file_path):
+    """
+    Returns the header of a CSV file and its rows as lists, leaving out rows that do not have every column.
+    """
+    with open(file_path, 'r', newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        return header, [row for row in reader if len(row) == len(header)]
+
+def changed_value(rng, choices, value):
+    choice = rng.choice(choices)
+    return choice if choice != value else value + "0"
+
+def drift(rng, row, columns, drift_rate):
+    """
+    Changes the value of one random column of a row, and of each other column with a chance of drift_rate.
+    columns is a list of (position, values to pick from) pairs.
+    """
+    first = rng.randrange(len(columns))
+    for i, (position, choices) in enumerate(columns):
+        if i == first or rng.random() < drift_rate:
+            row[position] = changed_value(rng, choices, row[position])
+
+def generate(output_dir, rows=1000000, seed=0, state_file=DEFAULT_STATE_FILE, cdc_file=DEFAULT_CDC_FILE, mismatch_rate=0.05,
+             drift_rate=0.2, duplicate_rate=0.01, missing_cdc_rate=0.02, missing_state_rate=0.02, repeat_rate=0.1,
+             tie_rate=0.01):
+    """
+    Writes state_bench.csv and cdc_bench.csv with the given number of cases to output_dir, along with
+    benchmark_data.json, which holds the settings they were made with and how many cases of each kind they have.
+    Returns the contents of benchmark_data.json.
+    """
+    rng = random.Random(seed)
+    state_header, state_templates = read_templates(state_file)
+    cdc_header, cdc_templates = read_templates(cdc_file)
+    # State rows without a numeric EventCode are skipped by the comparison, so they would not make the cases counted below
+    event_code = state_header.index('EventCode')
+    state_templates = [row for row in state_templates if row[event_code].isnumeric()]
+    state_case = state_header.index('CaseID')
+    state_time = state_header.index('add_time')
+    cdc_case = cdc_header.index('CaseID')
+    # (state position, CDC position) of the columns the CDC rows copy from the state rows
+    shared = [(state_header.index(column), position) for position, column in enumerate(cdc_header)
+              if column in state_header and column != 'CaseID']
+    # Mismatches are made by changing the CDC row, and older state rows by changing the state row, to values the column has elsewhere
+    cdc_drift = [(position, sorted({row[position] for row in cdc_templates} | {row[state_header.index(column)] for row in state_templates}))
+                 for position, column in enumerate(cdc_header) if column in state_header and column not in FIXED_COLUMNS]
+    state_drift = [(position, sorted({row[position] for row in state_templates}))
+                   for position, column in enumerate(state_header) if column not in FIXED_COLUMNS]
+
+    counts = {'cases': rows, 'stateRows': 0, 'cdcRows': 0, 'missingFromCDC': 0, 'missingFromState': 0,
+              'duplicates': 0, 'mismatches': 0, 'repeatedCases': 0, 'tiedCases': 0}
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'state_bench.csv'), 'w', newline='') as state_out, \
+            open(os.path.join(output_dir, 'cdc_bench.csv'), 'w', newline='') as cdc_out:
+        state_writer = csv.writer(state_out)
+        cdc_writer = csv.writer(cdc_out)
+        state_writer.writerow(state_header)
+        cdc_writer.writerow(cdc_header)
+
+        for number in range(rows):
+            caseID = case_id(number)
+            state_row = list(rng.choice(state_templates))
+            state_row[state_case] = caseID
+            add_time = FIRST_ADD_TIME + timedelta(seconds=rng.randrange(365 * 86400), milliseconds=rng.randrange(1000))
+            state_row[state_time] = add_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+            kind = rng.random()
+            in_state = kind >= missing_state_rate
+            in_cdc = kind < missing_state_rate or kind >= missing_state_rate + missing_cdc_rate
+
+            if in_cdc:
+                cdc_row = list(rng.choice(cdc_templates))
+                cdc_row[cdc_case] = caseID
+                for state_position, cdc_position in shared:
+                    cdc_row[cdc_position] = state_row[state_position]
+                if in_state and cdc_drift and rng.random() < mismatch_rate:
+                    drift(rng, cdc_row, cdc_drift, drift_rate)
+                    counts['mismatches'] += 1
+                cdc_writer.writerow(cdc_row)
+                counts['cdcRows'] += 1
+                # The duplicate is a copy of the row, so the first of them is the one compared
+                if rng.random() < duplicate_rate:
+                    cdc_writer.writerow(cdc_row)
+                    counts['cdcRows'] += 1
+                    counts['duplicates'] += 1
+            else:
+                counts['missingFromCDC'] += 1
+
+            if in_state:
+                case_rows = [state_row]
+                # Older rows of the case with other values, which the state loader has to skip for the newest one
+                if state_drift and rng.random() < repeat_rate:
+                    for _ in range(rng.randint(1, 3)):
+                        older_row = list(state_row)
+                        older_time = add_time - timedelta(days=rng.randint(1, 30), milliseconds=rng.randrange(1000))
+                        older_row[state_time] = older_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+                        drift(rng, older_row, state_drift, drift_rate)
+                        case_rows.append(older_row)
+                    rng.shuffle(case_rows)
+                    counts['repeatedCases'] += 1
+                # A row with the same add_time as the newest one but other values, right after it, so the state loader
+                # has to keep the first of the rows with the latest add_time
+                if state_drift and rng.random() < tie_rate:
+                    tied_row = list(state_row)
+                    drift(rng, tied_row, state_drift, drift_rate)
+                    case_rows.insert(next(i for i, row in enumerate(case_rows) if row is state_row) + 1, tied_row)
+                    counts['tiedCases'] += 1
+                state_writer.writerows(case_rows)
+                counts['stateRows'] += len(case_rows)
+            else:
+                counts['missingFromState'] += 1
+
+    data = {'seed': seed, 'stateTemplate': state_file, 'cdcTemplate': cdc_file, 'mismatchRate': mismatch_rate,
+            'driftRate': drift_rate, 'duplicateRate': duplicate_rate, 'missingCDCRate': missing_cdc_rate,
+            'missingStateRate': missing_state_rate, 'repeatRate': repeat_rate, 'tieRate': tie_rate, 'counts': counts}
+    with open(os.path.join(output_dir, 'benchmark_data.json'), 'w') as f:
+        json.dump(data, f, indent=2)
+    return data
+
+def add_generator_arguments(parser):
+    parser.add_argument('-n', '--rows', type=int, default=1000000, help='Number of cases to make')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random choices, the same seed makes the same files')
+    parser.add_argument('--state-template', default=DEFAULT_STATE_FILE, help='State CSV file to take the state rows from')
+    parser.add_argument('--cdc-template', default=DEFAULT_CDC_FILE, help='CDC CSV file to take the CDC rows from')
+    parser.add_argument('--mismatch-rate', type=float, default=0.05, help='Share of the cases in both files whose CDC row differs')
+    parser.add_argument('--drift-rate', type=float, default=0.2, help='Chance of each other attribute of a changed row differing too')
+    parser.add_argument('--duplicate-rate', type=float, default=0.01, help='Share of the CDC rows that are duplicated')
+    parser.add_argument('--missing-cdc-rate', type=float, default=0.02, help='Share of the cases missing from the CDC file')
+    parser.add_argument('--missing-state-rate', type=float, default=0.02, help='Share of the cases missing from the state file')
+    parser.add_argument('--repeat-rate', type=float, default=0.1, help='Share of the state cases that also have older rows')
+    parser.add_argument('--tie-rate', type=float, default=0.01, help='Share of the state cases that also have a row with the same add_time')
+
+def generate_from_args(args, output_dir):
+    return generate(output_dir, args.rows, args.seed, args.state_template, args.cdc_template, args.mismatch_rate,
+                    args.drift_rate, args.duplicate_rate, args.missing_cdc_rate, args.missing_state_rate, args.repeat_rate,
+                    args.tie_rate)
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="CreateBenchmarkData", description='Make large state and CDC CSV files for benchmarks')
+    parser.add_argument('-o', '--output', default='.', help='Folder to write state_bench.csv and cdc_bench.csv to')
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+
+    data = generate_from_args(args, args.output)
+    print(json.dumps(data['counts'], indent=2))
+
+if __name__ == "__main__":
+    main()
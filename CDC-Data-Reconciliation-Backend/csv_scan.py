@@ -0,0 +1,128 @@
+import csv
+import io
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+import compare
+
+# Fast loader for large CDC CSV extracts. The file is memory-mapped and split into byte ranges that start and end
+# on row boundaries, and the ranges are parsed in parallel by a pool of processes. Each process only keeps the
+# columns the comparison needs, as the value tuples of CompactRows, instead of building a dictionary for every row.
+# The rows are handed back in the order they are in the file, so Reconciler.load_cdc finds the same duplicate
+# CaseIDs as it does with compare.read_csv, counting the first occurrence of each CaseID as the original.
+
+# Size of the byte ranges the file is split into
+CHUNK_BYTES = 16 * 1024 * 1024
+
+def next_row(mm, start, position, quoted=True):
+    """
+    Returns the offset of the row after the one at position, where start is the offset of a row at or before
+    position. Newlines inside quoted fields are skipped by counting the quotes from start, which is only needed
+    if the file has quoted fields.
+    """
+    quotes = mm[start:position].count(b'"') if quoted else 0
+    while True:
+        newline = mm.find(b'\n', position)
+        if newline == -1:
+            return len(mm)
+        if quoted:
+            quotes += mm[position:newline].count(b'"')
+        position = newline + 1
+        if quotes % 2 == 0:
+            return position
+
+def row_ranges(mm, start, chunk_bytes=CHUNK_BYTES):
+    """
+    Splits the file from start to its end into (start, end) byte ranges of about chunk_bytes that each hold whole rows.
+    """
+    ranges = []
+    size = len(mm)
+    quoted = mm.find(b'"', start) != -1
+    while start < size:
+        end = size if start + chunk_bytes >= size else next_row(mm, start, start + chunk_bytes, quoted)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+def parse_header(mm):
+    """
+    Returns the column names of a memory-mapped CSV file and the offset of its first row.
+    """
+    end = next_row(mm, 0, 0)
+    header = next(csv.reader(io.StringIO(mm[:end].decode('utf-8-sig'), newline='')), [])
+    return header, end
+
+def read_header(csv_file):
+    with open(csv_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return parse_header(mm)[0]
+
+def parse_range(csv_file, start, end, positions, pooled_from, width):
+    """
+    Parses the rows between two byte offsets of a CSV file with width columns, returning a list with a tuple of
+    the values at positions for each row. Values from pooled_from on are pooled so the rows share one copy of them.
+    """
+    with open(csv_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode('utf-8')
+
+    get_plain = compare.tuple_getter(positions[:pooled_from])
+    get_pooled = compare.tuple_getter(positions[pooled_from:])
+    pool = {}
+    rows = []
+    for row in csv.reader(io.StringIO(text, newline='')):
+        # Blank lines are skipped and short rows are read as None like csv.DictReader does
+        if not row:
+            continue
+        if len(row) < width:
+            row += [None] * (width - len(row))
+        pooled = get_pooled(row)
+        rows.append(get_plain(row) + tuple(map(pool.setdefault, pooled, pooled)))
+    return rows
+
+def scan_rows(csv_file, columns=None, workers=None):
+    """
+    Yields the rows of a CSV file as CompactRows holding the given columns, or every column if none are given,
+    in the order they are in the file. The file is parsed by up to workers processes (the number of CPUs by default).
+    """
+    with open(csv_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header, start = parse_header(mm)
+            ranges = row_ranges(mm, start)
+
+    # A repeated column name gives the values of its last column, as with csv.DictReader
+    header_index = {column: position for position, column in enumerate(header)}
+    layout = compare.RowLayout(header_index.keys() if columns is None else [column for column in columns if column in header_index])
+    value_columns = sorted(layout.index, key=layout.index.get)
+    positions = [header_index[column] for column in value_columns]
+    pooled_from = sum(1 for column in value_columns if column in layout.UNPOOLED_COLUMNS)
+    args = (positions, pooled_from, len(header))
+
+    workers = min(workers or os.cpu_count() or 1, len(ranges))
+    if workers <= 1:
+        chunks = (parse_range(csv_file, start, end, *args) for start, end in ranges)
+        for chunk in chunks:
+            for values in chunk:
+                yield compare.CompactRow(layout.index, values)
+        return
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(parse_range, csv_file, start, end, *args) for start, end in ranges]
+        for future in futures:
+            for values in future.result():
+                yield compare.CompactRow(layout.index, values)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def read_rows(data_file, columns=None, workers=None):
+    """
+    Reads a CDC file like compare.read_rows, using scan_rows for CSV files. CSV rows are CompactRows that only hold
+    the given columns, which Reconciler.load_cdc uses as they are.
+    """
+    if compare.file_format(data_file) == 'csv':
+        return scan_rows(data_file, columns, workers)
+    return compare.read_rows(data_file, columns)
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import compare
+import state_snapshot
+
+# Incremental automatic reports, which need the state snapshot. Each incremental report for the same year, CDC
+# filter, compared attributes, profile and columns belongs to the same scope, and CaseOutcomes keeps the result of
+# every case of a scope as it was in its last report, along with a fingerprint of the case's CDC row. The next
+# report of the scope only reads and compares the cases logged in StateSnapshotChanges since then and the cases
+# whose CDC row was added, changed or removed. Every other case keeps its outcome, and only the outcomes of the
+# compared cases are written back. The results and stats are the same as those of a full comparison.
+
+# Outcome columns of CaseOutcomes after Scope and CaseID. Outcome is the ReasonID of the case's result, 0 if it matched
+OUTCOME_COLUMNS = ['Fingerprint', 'EventCode', 'EventName', 'MMWRYear', 'MMWRWeek', 'Reason', 'Outcome', 'CaseClassStatus']
+OUTCOME = OUTCOME_COLUMNS.index('Outcome')
+
+def scope_key(*parts):
+    """
+    Returns the scope of a comparison, a hash of everything its results depend on besides the cases themselves.
+    """
+    return hashlib.blake2b(json.dumps(parts).encode(), digest_size=16).hexdigest()
+
+def fingerprint(cdc_row):
+    """
+    Returns a 64-bit fingerprint of the values of a CDC CompactRow, which are all strings.
+    """
+    return int.from_bytes(hashlib.blake2b("\0".join(cdc_row.values).encode(), digest_size=8).digest(), 'big', signed=True)
+
+def outcome(result, fingerprint):
+    return (fingerprint, result.eventCode, result.eventName, result.MMWRYear, result.MMWRWeek, result.reason,
+            int(result.reasonID), result.caseClassStatus)
+
+class IncrementalRun:
+    """
+    A comparison of a year's state snapshot that carries forward the outcomes of the last report of its scope.
+    """
+    def __init__(self, pool, year, *scope, track=None) -> None:
+        self.pool = pool
+        self.year = year
+        self.scope_parts = (year, *scope)
+        self.track = track if track is not None else iter
+        self.scope = None
+        self.eventCodes = None
+        self.position = None
+        # (ReportID, ChangeID) of the scope's last report if its outcomes can be carried forward
+        self.base = None
+        self.outcomes = {}
+        # The cases whose outcomes are written, or None to write every outcome
+        self.changed = None
+
+    def load(self, conn):
+        """
+        Returns the outcomes of the last report of the scope, or None if there is none or its outcomes cannot be
+        carried forward because the changes since then were not all logged or the CDC filter kept other event codes.
+        """
+        row = conn.execute("SELECT s.ReportID, s.ChangeID, s.EventCodes FROM IncrementalScopes s JOIN StateSnapshots h ON h.Year = s.Year "
+                           "WHERE s.Scope = ? AND s.ChangeID >= h.ChangesFrom", (self.scope,)).fetchone()
+        if row is None or row[2] != self.eventCodes:
+            return None
+        self.base = row[:2]
+        return {row[0]: row[1:] for row in
+                conn.execute(f"SELECT CaseID, {', '.join(OUTCOME_COLUMNS)} FROM CaseOutcomes WHERE Scope = ?", (self.scope,))}
+
+    def compare_state(self, reconciler, column_names, cdc_dict, cdcEventCodes, compare_attributes=None, batch_size=10000):
+        """
+        Compares the changed cases of the snapshot against CDC data loaded with load_cdc, returning (results, stats)
+        like Reconciler.compare_state. Every case is compared when the scope has no outcomes to carry forward.
+        """
+        state_columns, _ = compare.kept_columns(column_names, [], compare_attributes)
+        cdc_columns = list(next(iter(cdc_dict.values())).keys()) if cdc_dict else []
+        profile = reconciler.profile.definition() if reconciler.profile is not None else None
+        self.scope = scope_key(*self.scope_parts, profile, state_columns, cdc_columns)
+        self.eventCodes = json.dumps(sorted(cdcEventCodes)) if cdcEventCodes is not None else None
+        fingerprints = {caseID: fingerprint(cdc_row) for caseID, cdc_row in cdc_dict.items()}
+
+        with self.pool.connection() as conn:
+            # One read transaction, so the rows read are the snapshot as it was at the change position
+            conn.execute("BEGIN")
+            try:
+                self.position = state_snapshot.change_position(conn)
+                previous = self.load(conn)
+                if previous is None:
+                    records = state_snapshot.snapshot_records(conn, self.year, batch_size)
+                    compared_cdc = dict(cdc_dict)
+                else:
+                    changed = {caseID for (caseID,) in conn.execute("SELECT CaseID FROM StateSnapshotChanges WHERE Year = ? AND ID > ?",
+                                                                    (self.year, self.base[1]))}
+                    changed.update(caseID for caseID, value in fingerprints.items()
+                                   if caseID not in previous or previous[caseID][0] != value)
+                    changed.update(caseID for caseID, values in previous.items()
+                                   if values[0] is not None and caseID not in fingerprints)
+                    self.changed = changed
+                    records = state_snapshot.case_records(conn, self.year, changed)
+                    compared_cdc = {caseID: cdc_dict[caseID] for caseID in changed if caseID in cdc_dict}
+                state_dict = reconciler.load_state(self.track(compare.query_rows(column_names, records)), cdcEventCodes, compare_attributes)
+            finally:
+                conn.rollback()
+
+        # The compared cases get new outcomes, found with their own Reconciler so its stats are left out
+        found = {result.caseID: result for result in
+                 compare.Reconciler(reconciler.profile).compare_cases(state_dict, compared_cdc, compare_attributes)}
+        new_outcomes = {}
+        for caseID, state_row in state_dict.items():
+            result = found.pop(caseID, None)
+            if result is None:
+                result = compare.CaseResult(caseID, state_row['EventCode'], state_row['EventName'], state_row['MMWRYear'],
+                                            state_row['MMWRWeek'], "", "0", state_row['CaseClassStatus'])
+            new_outcomes[caseID] = outcome(result, fingerprints.get(caseID))
+        # What is left are the cases missing from the state data
+        for caseID, result in found.items():
+            new_outcomes[caseID] = outcome(result, fingerprints.get(caseID))
+
+        if previous is None:
+            self.outcomes = new_outcomes
+        else:
+            self.outcomes = {caseID: values for caseID, values in previous.items() if caseID not in self.changed}
+            self.outcomes.update(new_outcomes)
+        return self.results(reconciler), self.count(reconciler.stats)
+
+    def ordered(self):
+        """
+        Yields (CaseID, outcome) with the cases missing from the state data last, as a full comparison gives them.
+        """
+        yield from ((caseID, values) for caseID, values in self.outcomes.items() if values[OUTCOME] != 4)
+        yield from ((caseID, values) for caseID, values in self.outcomes.items() if values[OUTCOME] == 4)
+
+    def count(self, stats):
+        """
+        Adds the outcomes to the stats of the loaded CDC data, counting them the way Reconciler.compare_cases does.
+        """
+        for _, (_, eventCode, eventName, _, _, _, reasonID, _) in self.ordered():
+            counts = stats.get(eventCode)
+            if counts is None:
+                counts = stats[eventCode] = {'eventName': eventName, 'totalCases': 0, 'totalDuplicates': 0, 'totalMissingCDC': 0,
+                                             'totalMissingState': 0, 'totalWrongAttributes': 0}
+            counts['totalCases'] += 1
+            if reasonID == 2:
+                counts['totalMissingCDC'] += 1
+            elif reasonID == 3:
+                counts['totalWrongAttributes'] += 1
+            elif reasonID == 4:
+                counts['totalMissingState'] += 1
+        return stats
+
+    def results(self, reconciler):
+        """
+        Yields the CDC duplicates already found and then a CaseResult for every outcome that is a discrepancy.
+        """
+        yield from reconciler.results
+        for caseID, (_, eventCode, eventName, MMWRYear, MMWRWeek, reason, reasonID, caseClassStatus) in self.ordered():
+            if reasonID:
+                yield compare.CaseResult(caseID, eventCode, eventName, MMWRYear, MMWRWeek, reason, str(reasonID), caseClassStatus)
+
+    def stage(self, conn):
+        """
+        Stages the outcomes save writes in the staging database of reports_db.save_report: those of the compared
+        cases, or every outcome if none were carried forward.
+        """
+        # In key order, so save appends them to CaseOutcomes instead of inserting them all over it
+        caseIDs = sorted(self.outcomes.keys() if self.changed is None else self.changed)
+        conn.execute(f"CREATE TABLE staging.StagedOutcomes(CaseID, {', '.join(OUTCOME_COLUMNS)})")
+        conn.executemany(f"INSERT INTO staging.StagedOutcomes VALUES ({', '.join('?' * (len(OUTCOME_COLUMNS) + 1))})",
+                         ((caseID, *self.outcomes[caseID]) for caseID in caseIDs if caseID in self.outcomes))
+        conn.commit()
+
+    def save(self, conn, reportId):
+        """
+        Saves the staged outcomes and makes reportId the last report of the scope. Every outcome is written if none
+        were carried forward, or another report of the scope was saved since they were read.
+        """
+        columns = f"Scope, CaseID, {', '.join(OUTCOME_COLUMNS)}"
+        row = conn.execute("SELECT ReportID, ChangeID FROM IncrementalScopes WHERE Scope = ?", (self.scope,)).fetchone()
+        if self.changed is not None and row == self.base:
+            conn.executemany("DELETE FROM CaseOutcomes WHERE Scope = ? AND CaseID = ?", ((self.scope, caseID) for caseID in self.changed))
+        else:
+            conn.execute("DELETE FROM CaseOutcomes WHERE Scope = ?", (self.scope,))
+            if self.changed is not None:
+                # Only the compared cases were staged
+                conn.executemany(f"INSERT INTO CaseOutcomes ({columns}) VALUES ({', '.join('?' * (len(OUTCOME_COLUMNS) + 2))})",
+                                 ((self.scope, caseID, *values) for caseID, values in self.outcomes.items() if caseID not in self.changed))
+        conn.execute(f"INSERT INTO CaseOutcomes ({columns}) SELECT ?, * FROM staging.StagedOutcomes ORDER BY rowid", (self.scope,))
+        conn.execute("INSERT OR REPLACE INTO IncrementalScopes (Scope, Year, ReportID, ChangeID, EventCodes) VALUES (?, ?, ?, ?, ?)",
+                     (self.scope, self.year, reportId, self.position, self.eventCodes))
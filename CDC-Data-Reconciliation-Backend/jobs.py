@@ -0,0 +1,155 @@
+import sqlite3
+import time
+import uuid
+
+# Report jobs. Creating a report returns a job ID straight away and the report is made in the background,
+# going through the stages query, load, dedup, compare and persist. A job's progress is kept in the Jobs table
+# of the reports database, so every server worker can report on or cancel any job. A job's status is one of
+# queued, running, done, failed or cancelled. Progress updates never wait for the reports database, they are skipped
+# while another report is being saved.
+
+# How many rows are processed between progress updates, which is also how often cancellation is checked
+PROGRESS_INTERVAL = 10000
+
+# Finished jobs are removed from the Jobs table after this many seconds
+JOB_RETENTION_SECONDS = 24 * 60 * 60
+
+# How many times a status write is tried, each waiting up to sqlite_timeout for the write lock, before it fails.
+# The final status of a job is tried for longer, so a job is not left running when another report holds the lock
+STATUS_ATTEMPTS = 3
+FINAL_STATUS_ATTEMPTS = 20
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    """
+    Progress of one report job, written to the Jobs table through a pool of SQLite connections.
+    """
+    def __init__(self, pool, jobID) -> None:
+        self.pool = pool
+        self.id = jobID
+        self.rows = 0
+        # Passed to reports_db.save_report to save rows along with the job's report, if set
+        self.save_hooks = None
+
+    def update(self, attempts=STATUS_ATTEMPTS, **fields):
+        """
+        Writes fields of the job's row, trying again up to attempts times while the database is locked.
+        """
+        for attempt in range(1, attempts + 1):
+            try:
+                with self.pool.connection() as conn:
+                    conn.execute(f"UPDATE Jobs SET {', '.join(f'{field} = ?' for field in fields)} WHERE ID = ?",
+                                 (*fields.values(), self.id))
+                    conn.commit()
+                return
+            except sqlite3.OperationalError as e:
+                if attempt == attempts or not is_locked(e):
+                    raise
+                print(f"Job {self.id} waiting for the reports database: {e}")
+
+    def update_progress(self):
+        """
+        Writes RowsProcessed if the reports database is free, without waiting for a report being saved.
+        """
+        with self.pool.connection() as conn:
+            timeout = conn.execute("PRAGMA busy_timeout").fetchone()[0]
+            conn.execute("PRAGMA busy_timeout = 0")
+            try:
+                conn.execute("UPDATE Jobs SET RowsProcessed = ? WHERE ID = ?", (self.rows, self.id))
+                conn.commit()
+            except sqlite3.OperationalError:
+                # Locked, the next update or the end of the stage writes the count instead
+                conn.rollback()
+            finally:
+                conn.execute(f"PRAGMA busy_timeout = {int(timeout)}")
+
+    def check(self):
+        """
+        Raises JobCancelled if the job was asked to stop.
+        """
+        with self.pool.connection() as conn:
+            cancelled = conn.execute("SELECT CancelRequested FROM Jobs WHERE ID = ?", (self.id,)).fetchone()
+        if cancelled is None or cancelled[0]:
+            raise JobCancelled()
+
+    def start(self):
+        self.check()
+        self.update(Status='running', StartedAt=time.time())
+
+    def set_stage(self, stage):
+        self.check()
+        self.update(Stage=stage, RowsProcessed=self.rows)
+
+    def track(self, rows, stage=None, next_stage=None):
+        """
+        Yields the rows while counting them, moving the job to stage when the first row is asked for and to
+        next_stage once every row was read. Stops with JobCancelled if the job is cancelled part way through.
+        """
+        if stage is not None:
+            self.set_stage(stage)
+        for row in rows:
+            yield row
+            self.rows += 1
+            if self.rows % PROGRESS_INTERVAL == 0:
+                # Reading the Jobs table is never blocked in WAL mode
+                self.check()
+                self.update_progress()
+        if next_stage is not None:
+            self.set_stage(next_stage)
+
+    def finish(self, reportID):
+        self.update(FINAL_STATUS_ATTEMPTS, Status='done', RowsProcessed=self.rows, FinishedAt=time.time(), ReportID=reportID)
+
+    def fail(self, error):
+        self.update(FINAL_STATUS_ATTEMPTS, Status='failed', RowsProcessed=self.rows, FinishedAt=time.time(), Error=error)
+
+    def mark_cancelled(self):
+        self.update(FINAL_STATUS_ATTEMPTS, Status='cancelled', RowsProcessed=self.rows, FinishedAt=time.time())
+
+def is_locked(error):
+    return "locked" in str(error) or "busy" in str(error)
+
+def create_job(pool, name):
+    """
+    Adds a queued job to the Jobs table, removing old finished jobs, and returns it.
+    """
+    jobID = uuid.uuid4().hex
+    now = time.time()
+    with pool.connection() as conn:
+        conn.execute("DELETE FROM Jobs WHERE FinishedAt < ?", (now - JOB_RETENTION_SECONDS,))
+        conn.execute("INSERT INTO Jobs (ID, Name, Status, Stage, RowsProcessed, CreatedAt, CancelRequested) VALUES (?, ?, 'queued', 'queued', 0, ?, 0)",
+                     (jobID, name, now))
+        conn.commit()
+    return Job(pool, jobID)
+
+def get_job(pool, jobID):
+    """
+    Returns a job's row from the Jobs table as a dictionary with its elapsed time in seconds, or None if there is no such job.
+    """
+    with pool.connection() as conn:
+        cur = conn.execute("SELECT ID, Name, Status, Stage, RowsProcessed, CreatedAt, StartedAt, FinishedAt, ReportID, Error FROM Jobs WHERE ID = ?", (jobID,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        job = dict(zip([column[0] for column in cur.description], row))
+
+    # Time spent running, or waiting for a free slot while the job is still queued
+    start = job['StartedAt'] or job['CreatedAt']
+    job['ElapsedSeconds'] = round((job['FinishedAt'] or time.time()) - start, 1)
+    return job
+
+def cancel_job(pool, jobID):
+    """
+    Asks a job to stop. A queued job is cancelled straight away and a running one stops at its next progress update.
+    Returns False if there is no such job.
+    """
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE Jobs SET CancelRequested = 1 WHERE ID = ?", (jobID,))
+        if cur.rowcount == 0:
+            return False
+        cur.execute("UPDATE Jobs SET Status = 'cancelled', FinishedAt = ? WHERE ID = ? AND Status = 'queued'", (time.time(), jobID))
+        conn.commit()
+    return True
@@ -0,0 +1,125 @@
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+import compare
+
+# Multi-core comparison for the python engine. Both datasets are split into partitions by a hash of the CaseID, so
+# every row of a case is in the same partition, and each partition is compared by a compare.Reconciler in its own
+# process. Every row keeps the line it came from, which is used to merge the results and stats of the partitions
+# back into the order compare.run_comparison gives them.
+
+# A single Reconciler finds the CDC duplicates as it loads the CDC rows, then goes through the state cases in the
+# order of their first row and then through the CDC cases missing from the state data. Results and stats entries
+# are ordered by (phase, line) to put them back in that order.
+LOAD_CDC, COMPARE_STATE, MISSING_STATE = 0, 1, 2
+
+STATS_COUNTS = ['totalCases', 'totalDuplicates', 'totalMissingCDC', 'totalMissingState', 'totalWrongAttributes']
+
+def split_rows(rows, columns, partitions, eventCodes=None, state=False):
+    """
+    Splits rows into partitions by CaseID, returning a (lines, values) pair of lists for each partition with the line
+    of each row and the values of its columns as a CompactRow tuple. State rows that compare.load_state_rows would
+    skip are left out here, and the event codes of CDC rows are added to eventCodes if it is a set.
+    """
+    parts = [([], []) for _ in range(partitions)]
+    for line, row in enumerate(compare.compact_rows(rows, columns)):
+        if state:
+            if not row['EventCode'].isnumeric() or (eventCodes is not None and row['EventCode'] not in eventCodes):
+                continue
+        elif eventCodes is not None:
+            eventCodes.add(row['EventCode'])
+        lines, values = parts[hash(row['CaseID']) % partitions]
+        lines.append(line)
+        values.append(row.values)
+    return parts
+
+def compare_partition(state_columns, state_part, cdc_columns, cdc_part, compare_attributes=None, profile=None):
+    """
+    Compares the state and CDC rows of one partition. Returns its results as a list of (key, result row) pairs in
+    the order of their keys, and its stats with the key and event name of the row that first added each event code.
+    """
+    state_index = compare.RowLayout(state_columns).index
+    cdc_index = compare.RowLayout(cdc_columns).index
+    state_rows = [compare.CompactRow(state_index, values) for values in state_part[1]]
+    cdc_rows = [compare.CompactRow(cdc_index, values) for values in cdc_part[1]]
+
+    # Lines of the first row of each case and of the CDC duplicates
+    cdc_first = {}
+    duplicate_lines = []
+    added = {}
+    for line, row in zip(cdc_part[0], cdc_rows):
+        if cdc_first.setdefault(row['CaseID'], line) != line:
+            duplicate_lines.append(line)
+        added.setdefault(row['EventCode'], ((LOAD_CDC, line), row['EventName']))
+    state_first = {}
+    for line, row in zip(state_part[0], state_rows):
+        state_first.setdefault(row['CaseID'], line)
+
+    reconciler = compare.Reconciler(profile)
+    # The first CDC row with the event code of a duplicate can be in another partition, so every event code of the
+    # partition's CDC rows starts with an empty stats entry
+    for code, (_, eventName) in added.items():
+        reconciler.stats[code] = {'eventName': eventName, 'totalCases': 0, 'totalDuplicates': 0, 'totalMissingCDC': 0, 'totalMissingState': 0, 'totalWrongAttributes': 0}
+
+    cdc_dict, _ = reconciler.load_cdc_rows(cdc_rows, False, cdc_columns)
+    state_dict = compare.load_state_rows(state_rows, None, state_columns)
+    # Event codes that are not in the CDC data are added by the first state case that has them
+    for caseID, row in state_dict.items():
+        added.setdefault(row['EventCode'], ((COMPARE_STATE, state_first[caseID]), row['EventName']))
+    reconciler.comp(state_dict, cdc_dict, compare_attributes)
+
+    duplicates = iter(duplicate_lines)
+    results = []
+    for result in reconciler.results:
+        if result.reasonID == "1":
+            key = (LOAD_CDC, next(duplicates))
+        elif result.reasonID == "4":
+            key = (MISSING_STATE, cdc_first[result.caseID])
+        else:
+            key = (COMPARE_STATE, state_first[result.caseID])
+        results.append((key, compare.result_row(result)))
+
+    stats = {code: (added[code], [counts[count] for count in STATS_COUNTS]) for code, counts in reconciler.stats.items()}
+    return results, stats
+
+def merge_stats(partition_stats):
+    """
+    Adds up the stats of every partition, keeping the event name from the row that first added each event code
+    and ordering the event codes by when they were added.
+    """
+    added = {}
+    totals = {}
+    for stats in partition_stats:
+        for code, (first, counts) in stats.items():
+            if code not in totals:
+                added[code] = first
+                totals[code] = counts
+                continue
+            added[code] = min(added[code], first)
+            totals[code] = [total + count for total, count in zip(totals[code], counts)]
+
+    merged = {}
+    for code in sorted(totals, key=lambda code: added[code][0]):
+        merged[code] = {'eventName': added[code][1], **dict(zip(STATS_COUNTS, totals[code]))}
+    return merged
+
+def run_comparison(state_rows, cdc_rows, filterCDC=False, compare_attributes=None, workers=2, profile=None):
+    """
+    Compares iterables of state and CDC row dictionaries across workers processes and returns the same
+    (results, stats) as compare.run_comparison.
+    """
+    state_columns, state_rows = compare.peek_columns(state_rows)
+    cdc_columns, cdc_rows = compare.peek_columns(cdc_rows)
+    state_columns, cdc_columns = compare.kept_columns(state_columns, cdc_columns, compare_attributes)
+
+    cdcEventCodes = set() if filterCDC else None
+    cdc_parts = split_rows(cdc_rows, cdc_columns, workers, cdcEventCodes)
+    state_parts = split_rows(state_rows, state_columns, workers, cdcEventCodes, state=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(compare_partition, state_columns, state_part, cdc_columns, cdc_part, compare_attributes, profile)
+                   for state_part, cdc_part in zip(state_parts, cdc_parts)]
+        partitions = [future.result() for future in futures]
+
+    results = [compare.CaseResult(*row) for _, row in heapq.merge(*(results for results, _ in partitions), key=itemgetter(0))]
+    return results, merge_stats(stats for _, stats in partitions)
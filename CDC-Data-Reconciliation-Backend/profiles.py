@@ -0,0 +1,96 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+# Comparison profiles say how the values of each attribute are normalised before a state and CDC value are compared,
+# so values that only differ in format, like the dates 1970-03-02 and 3/2/1970, are not reported as discrepancies.
+# Profiles are named in the comparison_profiles setting of config.json, for example:
+#   "comparison_profiles": {"normalized": {"default": "null", "columns": {"BirthDate": "date", "MMWRWeek": "week"}, "ignore": ["add_time"]}}
+# Without a profile, values are compared as they are, with empty values matching NULL.
+
+# Values that are read as NULL by every normaliser except exact
+NULL_VALUES = {"", "NULL", "null", "Null", "None", "N/A"}
+
+# Formats dates are read in by the date normaliser, the state data's first
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%m/%d/%Y %H:%M:%S", "%m/%d/%y", "%Y%m%d")
+
+def exact(value):
+    return "NULL" if value == "" else value
+
+def null(value):
+    value = value.strip()
+    return "NULL" if value in NULL_VALUES else value
+
+def casefold(value):
+    return null(value).casefold()
+
+def date(value):
+    # Dates that cannot be read are compared as they are
+    value = null(value)
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date().isoformat()
+        except ValueError:
+            continue
+    return value
+
+def week(value):
+    value = null(value)
+    return str(int(value)) if value.isdigit() else value
+
+def number(value):
+    value = null(value)
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        return value
+    if not number.is_finite():
+        return value
+    # 52, 52.0 and 052 are all 52
+    return format(number.normalize() + 0, 'f')
+
+NORMALISERS = {'exact': exact, 'null': null, 'casefold': casefold, 'date': date, 'week': week, 'number': number}
+
+class ComparisonProfile:
+    """
+    The normaliser of each attribute of a comparison and the attributes it never compares.
+    """
+    def __init__(self, name="exact", default="exact", columns=None, ignore=()) -> None:
+        self.name = name
+        self.default = default
+        self.columns = dict(columns or {})
+        self.ignore = list(ignore)
+        for normaliser in [default, *self.columns.values()]:
+            if normaliser not in NORMALISERS:
+                raise ValueError(f"Unknown normaliser {normaliser} in comparison profile {name}")
+
+    def normaliser(self, column):
+        return NORMALISERS[self.columns.get(column, self.default)]
+
+    def attributes(self, state_columns, cdc_columns, compare_attributes=None):
+        """
+        Returns the attributes compared between rows with the given columns: the compare_attributes, or every state
+        column when none are given, that the CDC rows have and the profile does not ignore.
+        """
+        attributes_to_compare = compare_attributes if compare_attributes is not None else state_columns
+        return [attribute for attribute in attributes_to_compare if attribute in cdc_columns and attribute not in self.ignore]
+
+    def definition(self):
+        return {'name': self.name, 'default': self.default, 'columns': self.columns, 'ignore': self.ignore}
+
+# Values compared as they are, which is how every comparison was made before profiles
+EXACT = ComparisonProfile()
+
+def load_profile(config, name=None):
+    """
+    Returns the comparison profile with the given name from the comparison_profiles setting of a config, or the
+    config's comparison_profile if no name is given. Raises ValueError if there is no profile with that name.
+    """
+    name = name or config.get("comparison_profile")
+    if not name:
+        return EXACT
+    definition = config.get("comparison_profiles", {}).get(name)
+    if definition is None:
+        if name == EXACT.name:
+            return EXACT
+        raise ValueError(f"Unknown comparison profile: {name}")
+    return ComparisonProfile(name, definition.get("default", "exact"), definition.get("columns"), definition.get("ignore", ()))
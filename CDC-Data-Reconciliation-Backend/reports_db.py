@@ -0,0 +1,679 @@
+import base64
+import contextlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import uuid
+import compare
+
+# The SQLite database the server keeps its reports in. Connections use WAL mode so reports can still be
+# listed and read while a new report is being written. A report's cases are streamed into a staging database file
+# as the comparison results are read, without building a list of rows first, and then copied into the Cases table
+# in one short transaction, so the write lock is not held while the comparison runs. Each case
+# only stores a small ReasonCode, and the text of each distinct reason of a report is stored once in CaseReasons,
+# along with the attributes of attribute mismatches as a JSON list. The CaseRows view gives the cases with their reason.
+
+# Applied to every connection. WAL mode is stored in the database file, the rest only last for the connection
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    # With WAL, NORMAL only syncs at checkpoints, which is still safe against corruption
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    # Page cache of about 16 MB per connection
+    "PRAGMA cache_size = -16000",
+]
+
+# Schema changes made after the tables were first created. The database's user_version is the number of
+# migrations already applied, and each migration is a list of statements run in one transaction
+MIGRATIONS = [
+    # Indexes so a report's cases and statistics are found without scanning every report. SQLite adds the row ID to
+    # the end of every index, so each one also gives a report's cases in ID order for keyset pagination
+    [
+        "CREATE INDEX IF NOT EXISTS CasesReportID ON Cases(ReportID)",
+        "CREATE INDEX IF NOT EXISTS CasesReportIDReasonID ON Cases(ReportID, ReasonID)",
+        "CREATE INDEX IF NOT EXISTS CasesReportIDEventCode ON Cases(ReportID, EventCode)",
+        "CREATE INDEX IF NOT EXISTS StatisticsReportID ON Statistics(ReportID)",
+    ],
+    # The rows of a case in a state snapshot are replaced when the case changes
+    [
+        "CREATE INDEX IF NOT EXISTS StateSnapshotRowsYearCaseID ON StateSnapshotRows(Year, CaseID)",
+    ],
+    # Reason codes. Cases saved before them keep their Reason and have no ReasonCode
+    [
+        "ALTER TABLE Cases ADD COLUMN ReasonCode INTEGER",
+        """CREATE VIEW IF NOT EXISTS CaseRows AS
+            SELECT Cases.ID AS ID, Cases.ReportID AS ReportID, CaseID, EventCode, EventName, MMWRYear, MMWRWeek,
+                COALESCE(Cases.Reason, CaseReasons.Reason) AS Reason, ReasonID, CaseClassStatus
+            FROM Cases LEFT JOIN CaseReasons ON CaseReasons.ReportID = Cases.ReportID AND CaseReasons.ReasonCode = Cases.ReasonCode""",
+    ],
+    # Case counts of the reports saved before CaseCounts, for trends
+    [
+        "CREATE INDEX IF NOT EXISTS CaseCountsReportIDEventCode ON CaseCounts(ReportID, EventCode)",
+        "INSERT INTO CaseCounts (ReportID, EventCode, ReasonID, MMWRWeek, CaseClassStatus, Count) "
+        "SELECT ReportID, EventCode, ReasonID, MMWRWeek, CaseClassStatus, COUNT(*) FROM Cases "
+        "WHERE ReportID NOT IN (SELECT ReportID FROM CaseCounts) GROUP BY ReportID, EventCode, ReasonID, MMWRWeek, CaseClassStatus",
+    ],
+    # Finds a case of one report in another for report diffs
+    [
+        "CREATE INDEX IF NOT EXISTS CasesReportIDCaseID ON Cases(ReportID, CaseID, ReasonID)",
+    ],
+    # Finds the rows of a snapshot that is being made
+    [
+        "CREATE INDEX IF NOT EXISTS StateSnapshotStagingBuild ON StateSnapshotStaging(Build)",
+    ],
+    # Incremental reports: the position in StateSnapshotChanges after which every change of a snapshot is kept,
+    # and the scopes whose last report is deleted
+    [
+        "ALTER TABLE StateSnapshots ADD COLUMN ChangesFrom INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS IncrementalScopesReportID ON IncrementalScopes(ReportID)",
+    ],
+    # The sort columns without an index of their own, see CASE_SORT_COLUMNS
+    [
+        "CREATE INDEX IF NOT EXISTS CasesReportIDMMWRWeek ON Cases(ReportID, MMWRWeek)",
+        "CREATE INDEX IF NOT EXISTS CasesReportIDCaseClassStatus ON Cases(ReportID, CaseClassStatus)",
+    ],
+]
+
+# Columns the cases of a report can be filtered on, with the type their values are stored as
+CASE_FILTERS = {'EventCode': str, 'ReasonID': int, 'CaseClassStatus': str, 'MMWRWeek': int}
+# Columns the cases of a report can be sorted on. Each one has an index on (ReportID, column), so a page of cases is
+# read in order from the index wherever it is in the report
+CASE_SORT_COLUMNS = ['ID', 'CaseID', 'EventCode', 'MMWRWeek', 'ReasonID', 'CaseClassStatus']
+
+# The tables holding the rows saved with a report, and their column with the report's ID
+REPORT_TABLES = [('Cases', 'ReportID'), ('CaseReasons', 'ReportID'), ('CaseCounts', 'ReportID'), ('Statistics', 'ReportID'), ('Reports', 'ID')]
+
+# Cases of two reports are matched on their CaseID and ReasonID. The new cases of a report are the ones its base
+# report does not have, the resolved ones are the base report's cases it does not have, and the unchanged ones are
+# the cases both have, as they are in the report
+DIFF_CATEGORIES = ['new', 'resolved', 'unchanged']
+DIFF_MATCH = "EXISTS (SELECT 1 FROM Cases m WHERE m.ReportID = ? AND m.CaseID = c.CaseID AND m.ReasonID = c.ReasonID)"
+
+# The totals trends give for each ReasonID, named like the columns of the Statistics table
+TREND_TOTALS = {1: 'TotalDuplicates', 2: 'TotalMissingFromCDC', 3: 'TotalWrongAttributes', 4: 'TotalMissingFromState'}
+
+def connect(database_file, timeout=30):
+    """
+    Opens a connection to the reports database that can be used from any thread (one at a time).
+    """
+    conn = sqlite3.connect(database_file, timeout=timeout, check_same_thread=False)
+    # Lets compact give the space of deleted reports back to the file system. It only takes effect in a new database,
+    # so it is set before anything writes to the file, and older databases are rebuilt with it by compact. Setting it
+    # on a database that is being written to would wait for the write lock
+    if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def create_tables(conn):
+    cur = conn.cursor()
+
+    # Reports table
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS Reports(
+            ID INTEGER PRIMARY KEY NOT NULL,
+            CreatedAtDate TEXT,
+            TimeOfCreation TEXT,
+            NumberOfDiscrepancies INTEGER,
+            Name TEXT
+    )''')
+
+    # Cases table
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS Cases(
+            ID INTEGER PRIMARY KEY NOT NULL,
+            ReportID INTEGER NOT NULL,
+            CaseID TEXT,
+            EventCode TEXT,
+            EventName TEXT,
+            MMWRYear INTEGER,
+            MMWRWeek INTEGER,
+            Reason TEXT,
+            ReasonID INTEGER,
+            CaseClassStatus TEXT,
+            FOREIGN KEY (ReportID) REFERENCES Reports(ID)
+    )''')
+
+    # The distinct reasons of each report's cases (see insert_cases)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS CaseReasons(
+            ReportID INTEGER NOT NULL,
+            ReasonCode INTEGER NOT NULL,
+            Reason TEXT NOT NULL,
+            Attributes TEXT,
+            PRIMARY KEY (ReportID, ReasonCode)
+    ) WITHOUT ROWID''')
+
+    # Statistics table
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS Statistics(
+            ID INTEGER PRIMARY KEY NOT NULL,
+            ReportID INTEGER NOT NULL,
+            EventCode TEXT NOT NULL,
+            EventName TEXT,
+            TotalCases INTEGER,
+            TotalDuplicates INTEGER,
+            TotalMissingFromCDC INTEGER,
+            TotalMissingFromState INTEGER,
+            TotalWrongAttributes INTEGER,
+            FOREIGN KEY (ReportID) REFERENCES Reports(ID)
+    )''')
+
+    # Number of cases of each report for every EventCode, ReasonID, MMWRWeek and CaseClassStatus, so trends across
+    # reports are read without going through their cases
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS CaseCounts(
+            ID INTEGER PRIMARY KEY NOT NULL,
+            ReportID INTEGER NOT NULL,
+            EventCode TEXT,
+            ReasonID INTEGER,
+            MMWRWeek INTEGER,
+            CaseClassStatus TEXT,
+            Count INTEGER NOT NULL,
+            FOREIGN KEY (ReportID) REFERENCES Reports(ID)
+    )''')
+
+    # Config table
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS Config(
+            ID INTEGER PRIMARY KEY NOT NULL,
+            FieldName TEXT NOT NULL,
+            FieldValue TEXT NOT NULL
+    )''')
+
+    # Jobs table, with the progress of the reports being created (see jobs.py)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS Jobs(
+            ID TEXT PRIMARY KEY NOT NULL,
+            Name TEXT,
+            Status TEXT NOT NULL,
+            Stage TEXT,
+            RowsProcessed INTEGER,
+            CreatedAt REAL,
+            StartedAt REAL,
+            FinishedAt REAL,
+            ReportID INTEGER,
+            Error TEXT,
+            CancelRequested INTEGER NOT NULL DEFAULT 0
+    )''')
+
+    # State snapshots (see state_snapshot.py): the watermark of each year's snapshot and its rows as JSON lists
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS StateSnapshots(
+            Year INTEGER PRIMARY KEY NOT NULL,
+            Columns TEXT NOT NULL,
+            QueryHash TEXT NOT NULL,
+            Watermark TEXT NOT NULL,
+            CreatedAt TEXT NOT NULL
+    )''')
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS StateSnapshotRows(
+            ID INTEGER PRIMARY KEY NOT NULL,
+            Year INTEGER NOT NULL,
+            CaseID TEXT NOT NULL,
+            Record TEXT NOT NULL
+    )''')
+
+    # The rows of snapshots that are being made, until each one replaces its year's rows
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS StateSnapshotStaging(
+            ID INTEGER PRIMARY KEY NOT NULL,
+            Build TEXT NOT NULL,
+            CaseID TEXT NOT NULL,
+            Record TEXT NOT NULL
+    )''')
+
+    # The cases whose snapshot rows changed, in the order they changed. AUTOINCREMENT so IDs are never used again
+    # once older changes are removed
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS StateSnapshotChanges(
+            ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Year INTEGER NOT NULL,
+            CaseID TEXT NOT NULL
+    )''')
+
+    # Incremental reports (see incremental.py): the last report of each scope, and the outcome of each of its cases
+    # along with a fingerprint of the case's CDC row
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS IncrementalScopes(
+            Scope TEXT PRIMARY KEY NOT NULL,
+            Year INTEGER NOT NULL,
+            ReportID INTEGER NOT NULL,
+            ChangeID INTEGER NOT NULL,
+            EventCodes TEXT,
+            FOREIGN KEY (ReportID) REFERENCES Reports(ID)
+    )''')
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS CaseOutcomes(
+            Scope TEXT NOT NULL,
+            CaseID TEXT NOT NULL,
+            Fingerprint INTEGER,
+            EventCode TEXT,
+            EventName TEXT,
+            MMWRYear TEXT,
+            MMWRWeek TEXT,
+            Reason TEXT,
+            Outcome INTEGER NOT NULL,
+            CaseClassStatus TEXT,
+            PRIMARY KEY (Scope, CaseID)
+    ) WITHOUT ROWID''')
+
+    # When each background task shared by the server workers last ran (see claim_task)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS Maintenance(
+            Task TEXT PRIMARY KEY NOT NULL,
+            LastRun REAL NOT NULL
+    )''')
+
+    conn.commit()
+    migrate(conn)
+
+def migrate(conn):
+    """
+    Applies the MIGRATIONS the database does not have yet, one transaction each. Every step takes the write lock
+    before reading user_version, so when several workers start at once only one of them applies it and the others
+    see it done.
+    """
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.rollback()
+                return
+            for statement in MIGRATIONS[version]:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+def insert_report(conn, noOfDiscrepancies, name = ""):
+    cur = conn.cursor()
+    cur.execute("INSERT INTO Reports (CreatedAtDate, TimeOfCreation, NumberOfDiscrepancies, Name)  VALUES (DATE('now'), TIME('now'), ?, ?)", (noOfDiscrepancies, name))
+    report_id = cur.lastrowid
+    # Set default name if none provided
+    if name == "":
+        cur.execute("UPDATE Reports SET Name = ? WHERE ID = ?", (f"Report {report_id}", report_id))
+    return report_id
+
+@contextlib.contextmanager
+def staging(conn, directory=None):
+    """
+    Attaches a new staging database file in directory (the system's temp folder by default) to the connection for
+    the duration of the block, then removes it. Writing to it does not take the reports database's write lock.
+    """
+    fd, path = tempfile.mkstemp(suffix=".db", dir=directory)
+    os.close(fd)
+    try:
+        conn.execute("ATTACH DATABASE ? AS staging", (path,))
+        try:
+            # The file is thrown away afterwards, so it is never synced
+            conn.execute("PRAGMA staging.journal_mode = OFF")
+            conn.execute("PRAGMA staging.synchronous = OFF")
+            yield conn
+        finally:
+            conn.rollback()
+            conn.execute("DETACH DATABASE staging")
+    finally:
+        os.remove(path)
+
+def stage_cases(conn, results, writer=None):
+    """
+    Writes CaseResults to the StagedCases table of the attached staging database as they are read from results,
+    also writing each one to the writer (a csv writer or compare.TableWriter) if one is given. Returns the
+    dictionary of their reasons to reason codes.
+    """
+    rows = map(compare.result_row, results)
+    if writer is not None:
+        rows = archived_rows(rows, writer)
+
+    conn.execute("CREATE TABLE staging.StagedCases(CaseID, EventCode, EventName, MMWRYear, MMWRWeek, ReasonCode, ReasonID, CaseClassStatus)")
+    # executemany reads the rows one at a time and reuses the same prepared statement for all of them
+    codes = {}
+    conn.executemany("INSERT INTO staging.StagedCases VALUES (?, ?, ?, ?, ?, ?, ?, ?)", coded_rows(rows, codes))
+    conn.commit()
+    return codes
+
+def insert_cases(conn, reportId, codes):
+    """
+    Copies the staged cases into the Cases table, in the order they were staged, and their reasons into
+    CaseReasons. Returns how many cases were inserted.
+    """
+    cur = conn.execute("INSERT INTO Cases (ReportID, CaseID, EventCode, EventName, MMWRYear, MMWRWeek, ReasonCode, ReasonID, CaseClassStatus) "
+                       "SELECT ?, CaseID, EventCode, EventName, MMWRYear, MMWRWeek, ReasonCode, ReasonID, CaseClassStatus "
+                       "FROM staging.StagedCases ORDER BY rowid", (reportId,))
+    count = cur.rowcount
+    conn.executemany(f"INSERT INTO CaseReasons (ReportID, ReasonCode, Reason, Attributes) VALUES ({int(reportId)}, ?, ?, ?)",
+                     ((code, reason, reason_attributes(reason)) for reason, code in codes.items()))
+    return count
+
+def archived_rows(rows, writer):
+    for row in rows:
+        writer.writerow(row)
+        yield row
+
+def coded_rows(rows, codes):
+    """
+    Yields result rows with their reason replaced by its code in codes, a dictionary of reasons to codes that each
+    new reason is added to.
+    """
+    for row in rows:
+        code = codes.get(row[5])
+        if code is None:
+            code = codes[row[5]] = len(codes)
+        yield row[:5] + (code,) + row[6:]
+
+def reason_attributes(reason):
+    attributes = compare.mismatch_attributes(reason)
+    return json.dumps(attributes) if attributes is not None else None
+
+def insert_case_counts(conn, reportId):
+    """
+    Counts the cases of a report for CaseCounts, once they are all inserted.
+    """
+    conn.execute("INSERT INTO CaseCounts (ReportID, EventCode, ReasonID, MMWRWeek, CaseClassStatus, Count) "
+                 "SELECT ReportID, EventCode, ReasonID, MMWRWeek, CaseClassStatus, COUNT(*) FROM Cases "
+                 "WHERE ReportID = ? GROUP BY EventCode, ReasonID, MMWRWeek, CaseClassStatus", (reportId,))
+
+def insert_statistics(conn, reportId, stats):
+    conn.executemany("INSERT INTO Statistics (ReportID, EventCode, EventName, TotalCases, TotalDuplicates, TotalMissingFromCDC, TotalMissingFromState, TotalWrongAttributes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     ((reportId, *row) for row in compare.stats_rows(stats)))
+
+def save_report(conn, results, stats, name = "", archive_path=None, archive_format="csv", staging_dir=None, hooks=None):
+    """
+    Saves the results and stats of a comparison as a new report and returns its ID. results can be any iterable of
+    CaseResults and is only read once, into a staging database in staging_dir, before the transaction that saves the
+    report starts. If archive_path is given, the results and stats are also written to results and stats files in a
+    folder named after the report ID, as csv, parquet or arrow files. If hooks are given, their stage method is
+    called with the connection once the results are staged, and their save method with the connection and report
+    ID before the transaction is committed, so rows saved along with the report can be staged first too.
+    """
+    archive_save_to = None
+    report_archive = None
+    try:
+        with staging(conn, staging_dir):
+            if archive_path:
+                # The report ID is only known once the report is saved, so the archive is written to a folder that is
+                # renamed after it then
+                archive_save_to = os.path.join(archive_path, f"saving-{uuid.uuid4().hex}")
+                os.makedirs(archive_save_to)
+                with compare.TableWriter(os.path.join(archive_save_to, f"results.{archive_format}"), compare.RESULT_FIELDNAMES) as writer:
+                    codes = stage_cases(conn, results, writer)
+                compare.write_stats(stats, os.path.join(archive_save_to, f"stats.{archive_format}"))
+            else:
+                codes = stage_cases(conn, results)
+            if hooks is not None:
+                hooks.stage(conn)
+
+            conn.execute("BEGIN IMMEDIATE")
+            reportId = insert_report(conn, 0, name)
+            numDiscrepancies = insert_cases(conn, reportId, codes)
+            insert_case_counts(conn, reportId)
+            insert_statistics(conn, reportId, stats)
+            conn.execute("UPDATE Reports SET NumberOfDiscrepancies = ? WHERE ID = ?", (numDiscrepancies, reportId))
+            if hooks is not None:
+                hooks.save(conn, reportId)
+            if archive_save_to is not None:
+                # A folder left by a report that was deleted is replaced
+                report_archive = os.path.join(archive_path, str(reportId))
+                shutil.rmtree(report_archive, ignore_errors=True)
+                os.replace(archive_save_to, report_archive)
+            conn.commit()
+    except BaseException:
+        conn.rollback()
+        # The report ID can be used again once the insert is rolled back, so remove its archive too
+        for folder in (archive_save_to, report_archive):
+            if folder is not None:
+                shutil.rmtree(folder, ignore_errors=True)
+        raise
+
+    return reportId
+
+def delete_reports(conn, report_ids):
+    """
+    Deletes reports along with every row saved with them, each through an index on its report ID. Does not commit.
+    Returns how many reports were deleted.
+    """
+    rows = [(report_id,) for report_id in report_ids]
+    # The outcomes of an incremental report's scope are only kept while the report is
+    conn.executemany("DELETE FROM CaseOutcomes WHERE Scope IN (SELECT Scope FROM IncrementalScopes WHERE ReportID = ?)", rows)
+    conn.executemany("DELETE FROM IncrementalScopes WHERE ReportID = ?", rows)
+    for table, column in REPORT_TABLES:
+        cur = conn.executemany(f"DELETE FROM {table} WHERE {column} = ?", rows)
+    # The last table is Reports
+    return cur.rowcount
+
+def expired_reports(conn, max_age_days=None, max_reports=None):
+    """
+    Returns the IDs of the reports created more than max_age_days ago and of the reports older than the newest
+    max_reports. Either can be None to not limit reports by it.
+    """
+    report_ids = set()
+    if max_age_days is not None:
+        report_ids.update(report_id for (report_id,) in
+                          conn.execute("SELECT ID FROM Reports WHERE CreatedAtDate < DATE('now', ?)", (f"-{int(max_age_days)} days",)))
+    if max_reports is not None:
+        # Report IDs go up as reports are created
+        report_ids.update(report_id for (report_id,) in
+                          conn.execute("SELECT ID FROM Reports ORDER BY ID DESC LIMIT -1 OFFSET ?", (max_reports,)))
+    return sorted(report_ids)
+
+def claim_task(conn, task, interval_seconds):
+    """
+    Returns True, and records the time, if the task has not run in the last interval_seconds, so that when every
+    server worker tries to run it only one of them does.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT LastRun FROM Maintenance WHERE Task = ?", (task,)).fetchone()
+        now = time.time()
+        if row is not None and now - row[0] < interval_seconds:
+            conn.rollback()
+            return False
+        conn.execute("INSERT OR REPLACE INTO Maintenance (Task, LastRun) VALUES (?, ?)", (task, now))
+        conn.commit()
+        return True
+    except BaseException:
+        conn.rollback()
+        raise
+
+def compact(conn, rebuild=False):
+    """
+    Gives the pages freed by deleted reports back to the file system with an incremental vacuum, which only moves
+    the free pages. A database made before incremental vacuum was turned on is rebuilt with it by a full VACUUM if
+    rebuild is True, and left as it is otherwise. Returns whether the database was compacted.
+    """
+    conn.commit()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        if not rebuild:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    else:
+        # execute only runs the pragma for one page, executescript runs it until every free page is given back
+        conn.executescript("PRAGMA incremental_vacuum;")
+    # The database file only shrinks once the WAL is written back into it
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return True
+
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(json.dumps(row).encode()).decode()
+
+def decode_cursor(cursor):
+    """
+    Returns the [sort value, ID] pair in a cursor from fetch_cases. Raises ValueError if it is not a valid cursor.
+    """
+    try:
+        value, caseID = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(caseID, int):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return value, caseID
+
+def case_conditions(report_id, filters=None):
+    """
+    Returns the conditions and their parameters for the cases of a report that match the filters.
+    """
+    conditions = ["ReportID = ?"]
+    params = [report_id]
+    for column, value in (filters or {}).items():
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(CASE_FILTERS[column](value))
+    return conditions, params
+
+def fetch_cases(conn, report_id, filters=None, sort="ID", descending=False, limit=None, after=None):
+    """
+    Returns (cases, total, next) for the cases of a report that match the filters, a dictionary of CASE_FILTERS
+    columns to values. The cases are sorted by the sort column, then by ID. If a limit is given, only that many cases
+    are returned, starting after the cursor after, and next is the cursor for the following page (None on the last one).
+    total is the number of cases that match the filters.
+    """
+    if sort not in CASE_SORT_COLUMNS:
+        raise ValueError(f"Cannot sort by {sort}")
+
+    conditions, params = case_conditions(report_id, filters)
+    where = " AND ".join(conditions)
+
+    total = conn.execute(f"SELECT COUNT(*) FROM Cases WHERE {where}", params).fetchone()[0]
+
+    # Keyset pagination: the next page starts after the (sort value, ID) of the last case of the previous one,
+    # so reading a page costs the same no matter how far into the report it is. NULLs sort before every other value
+    # but are never greater or less than one, so the cases with a NULL sort value are read as a separate range of
+    # the index, before the others in ascending order and after them in descending order
+    order = "DESC" if descending else "ASC"
+    comparison = "<" if descending else ">"
+    if sort == "ID":
+        ranges = [(None, f"ID {order}")]
+    else:
+        ranges = [(True, f"ID {order}"), (False, f"{sort} {order}, ID {order}")]
+        if descending:
+            ranges.reverse()
+
+    start = 0
+    if after is not None:
+        value, caseID = decode_cursor(after)
+        start = [is_null for is_null, _ in ranges].index(None if sort == "ID" else value is None)
+
+    cases = []
+    for position, (is_null, ordering) in enumerate(ranges[start:], start):
+        page_conditions = list(conditions)
+        page_params = list(params)
+        if is_null is not None:
+            page_conditions.append(f"{sort} IS NULL" if is_null else f"{sort} IS NOT NULL")
+        if after is not None and position == start:
+            if is_null is False:
+                page_conditions.append(f"({sort}, ID) {comparison} (?, ?)")
+                page_params.extend([value, caseID])
+            else:
+                page_conditions.append(f"ID {comparison} ?")
+                page_params.append(caseID)
+        query = f"SELECT * FROM CaseRows WHERE {' AND '.join(page_conditions)} ORDER BY {ordering}"
+        if limit is not None:
+            query += " LIMIT ?"
+            page_params.append(limit - len(cases))
+
+        cur = conn.execute(query, page_params)
+        columns = [column[0] for column in cur.description]
+        cases.extend(dict(zip(columns, row)) for row in cur.fetchall())
+        if limit is not None and len(cases) == limit:
+            break
+
+    next_cursor = None
+    if limit is not None and len(cases) == limit:
+        next_cursor = encode_cursor([cases[-1][sort], cases[-1]['ID']])
+    return cases, total, next_cursor
+
+def fetch_trends(conn, filters=None, limit=20):
+    """
+    Returns the case totals of the last limit reports, oldest first, counting only the cases that match the filters,
+    a dictionary of CASE_FILTERS columns to values. Each report has its TotalDiscrepancies and a total for each
+    ReasonID named in TREND_TOTALS.
+    """
+    conditions = []
+    params = []
+    for column, value in (filters or {}).items():
+        if value is not None:
+            conditions.append(f"AND c.{column} = ?")
+            params.append(CASE_FILTERS[column](value))
+
+    # The counts are joined to the reports rather than filtered after, so reports without matching cases still have totals of 0
+    cur = conn.execute(f"""
+        SELECT r.ID, r.Name, r.CreatedAtDate, r.TimeOfCreation, c.ReasonID, SUM(c.Count)
+        FROM (SELECT ID, Name, CreatedAtDate, TimeOfCreation FROM Reports ORDER BY ID DESC LIMIT ?) r
+        LEFT JOIN CaseCounts c ON c.ReportID = r.ID {' '.join(conditions)}
+        GROUP BY r.ID, c.ReasonID
+        ORDER BY r.ID""", [limit, *params])
+
+    trends = {}
+    for reportID, name, createdAtDate, timeOfCreation, reasonID, count in cur:
+        trend = trends.get(reportID)
+        if trend is None:
+            trend = trends[reportID] = {'ReportID': reportID, 'Name': name, 'CreatedAtDate': createdAtDate,
+                                        'TimeOfCreation': timeOfCreation, 'TotalDiscrepancies': 0,
+                                        **{total: 0 for total in TREND_TOTALS.values()}}
+        if reasonID in TREND_TOTALS:
+            trend[TREND_TOTALS[reasonID]] = count
+            trend['TotalDiscrepancies'] += count
+    return list(trends.values())
+
+def diff_conditions(report_id, base_id, category, filters=None):
+    """
+    Returns the conditions and their parameters for the cases of a DIFF_CATEGORIES category between a report and its
+    base report that match the filters. Raises ValueError if there is no such category.
+    """
+    if category not in DIFF_CATEGORIES:
+        raise ValueError(f"Unknown diff category: {category}")
+    # Resolved cases are the base report's, the other categories are the report's
+    shown, other = (base_id, report_id) if category == 'resolved' else (report_id, base_id)
+    conditions, params = case_conditions(shown, filters)
+    conditions.append(DIFF_MATCH if category == 'unchanged' else f"NOT {DIFF_MATCH}")
+    params.append(other)
+    return conditions, params
+
+def diff_counts(conn, report_id, base_id, filters=None):
+    """
+    Returns the number of cases of each DIFF_CATEGORIES category between a report and its base report that match
+    the filters. Each case is looked up in the other report through the CasesReportIDCaseID index.
+    """
+    counts = {}
+    for category in DIFF_CATEGORIES:
+        conditions, params = diff_conditions(report_id, base_id, category, filters)
+        counts[category] = conn.execute(f"SELECT COUNT(*) FROM Cases c WHERE {' AND '.join(conditions)}", params).fetchone()[0]
+    return counts
+
+def fetch_diff(conn, report_id, base_id, category, filters=None, limit=None, after=None):
+    """
+    Returns (cases, next) for the cases of a DIFF_CATEGORIES category between a report and its base report that match
+    the filters, in ID order. Pages work like those of fetch_cases. Raises ValueError for an unknown category or a
+    cursor from another category.
+    """
+    conditions, params = diff_conditions(report_id, base_id, category, filters)
+    if after is not None:
+        value, caseID = decode_cursor(after)
+        if value != category:
+            raise ValueError(f"Invalid cursor: {after}")
+        conditions.append("ID > ?")
+        params.append(caseID)
+    query = f"SELECT * FROM CaseRows c WHERE {' AND '.join(conditions)} ORDER BY ID"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    cur = conn.execute(query, params)
+    columns = [column[0] for column in cur.description]
+    cases = [dict(zip(columns, row)) for row in cur.fetchall()]
+
+    next_cursor = None
+    if limit is not None and len(cases) == limit:
+        next_cursor = encode_cursor([category, cases[-1]['ID']])
+    return cases, next_cursor
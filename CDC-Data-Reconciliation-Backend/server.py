@@ -1,26 +1,45 @@
-import subprocess
 import uvicorn
-from fastapi import FastAPI, File, Form, Response, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, Query, Response, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Optional
 import asyncio
-import csv
+import contextlib
+import gzip
 import os
-import sys
 import uuid
+import zipfile
 import pyodbc
 import json
 import sqlite3
-import shutil
 import mimetypes
+import compare
+import cdc_cache
+import csv_scan
+import jobs
+import profiles
+import reports_db
+import state_snapshot
+from connection_pool import ConnectionPool
+from incremental import IncrementalRun
 
 # Fix mimetypes for .js and .css files
 mimetypes.init()
 mimetypes.add_type("application/javascript", ".js")
 mimetypes.add_type("text/css", ".css")
 
-app = FastAPI()
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Old reports are cleaned up in the background for as long as the server runs
+    cleanup = asyncio.create_task(cleanup_reports())
+    yield
+    cleanup.cancel()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:5173"
@@ -29,6 +48,37 @@ origins = [
 app.add_middleware(CORSMiddleware, allow_origins=origins,
                    allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 
+class RequestSizeLimit:
+    """
+    Rejects requests with a body larger than the limit for their path in path_limits, or max_bytes for any other path,
+    as it is received, before the whole body is read. Starlette saves the files of a form to a temporary file before
+    any endpoint runs, so the size of an upload can only be limited here.
+    """
+    def __init__(self, app, max_bytes, path_limits=None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        max_bytes = self.path_limits.get(scope["path"], self.max_bytes)
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+            response = JSONResponse({"detail": "Request body too large"}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+        return await self.app(scope, limited_receive, send)
+
 # Serve the static files from the React app only if the assets folder exists
 if os.path.exists(os.path.join(os.path.dirname(__file__), "..", "CDC-Data-Reconciliation-Frontend", "dist", "assets")):
     app.mount("/assets", StaticFiles(directory=os.path.join(os.path.dirname(__file__), "..", "CDC-Data-Reconciliation-Frontend", "dist", "assets")), name="assets")
@@ -53,395 +103,667 @@ else:
     connection_string_auth = 'Trusted_Connection=yes;'
 
 connection_string = connection_string_base + connection_string_auth
-app.conn = pyodbc.connect(connection_string)
 
-# SQLite reports and cases tables setup
+def check_nbs_connection(conn):
+    # Raises if the connection to the SQL Server was dropped, so the pool opens a new one
+    conn.execute("SELECT 1").fetchone()
+
+# Queries take a connection from a pool, so several can run at once on the comparison pool's threads
+app.nbsPool = ConnectionPool(lambda: pyodbc.connect(connection_string), app.config.get("nbs_pool_size", 4), check_nbs_connection)
+
+# SQLite reports and cases tables setup. Each request takes its own connection from the pool, and waits up to
+# sqlite_timeout seconds for another request or server worker to finish writing instead of failing with "database is locked"
 database_file_path = os.path.join(app.dir, "database.db")
-app.liteConn = sqlite3.connect(database_file_path)
-cur = app.liteConn.cursor()
-
-# Reports table
-cur.execute('''
-    CREATE TABLE IF NOT EXISTS Reports(
-        ID INTEGER PRIMARY KEY NOT NULL, 
-        CreatedAtDate TEXT,
-        TimeOfCreation TEXT, 
-        NumberOfDiscrepancies INTEGER,
-        Name TEXT    
-)''')
-
-# Cases table
-cur.execute('''
-    CREATE TABLE IF NOT EXISTS Cases(
-        ID INTEGER PRIMARY KEY NOT NULL,
-        ReportID INTEGER NOT NULL,
-        CaseID TEXT, 
-        EventCode TEXT,
-        EventName TEXT,
-        MMWRYear INTEGER, 
-        MMWRWeek INTEGER,
-        Reason TEXT, 
-        ReasonID INTEGER,
-        CaseClassStatus TEXT,
-        FOREIGN KEY (ReportID) REFERENCES Reports(ID)
-)''')
-
-# Statistics table
-cur.execute('''
-    CREATE TABLE IF NOT EXISTS Statistics(
-        ID INTEGER PRIMARY KEY NOT NULL,
-        ReportID INTEGER NOT NULL,
-        EventCode TEXT NOT NULL,
-        EventName TEXT,
-        TotalCases INTEGER,
-        TotalDuplicates INTEGER,
-        TotalMissingFromCDC INTEGER,
-        TotalMissingFromState INTEGER,
-        TotalWrongAttributes INTEGER,
-        FOREIGN KEY (ReportID) REFERENCES Reports(ID)
-)''')
-
-# Statistics table
-cur.execute('''
-    CREATE TABLE IF NOT EXISTS Config(
-        ID INTEGER PRIMARY KEY NOT NULL,
-        FieldName TEXT NOT NULL,
-        FieldValue TEXT NOT NULL
-)''')
-
-app.liteConn.commit()
-
-@app.post("/manual_report")
+app.litePool = ConnectionPool(
+    lambda: reports_db.connect(database_file_path, app.config.get("sqlite_timeout", 30)),
+    app.config.get("sqlite_pool_size", 8))
+with app.litePool.connection() as liteConn:
+    reports_db.create_tables(liteConn)
+
+# Comparisons run in this process on a pool of threads instead of starting compare.py for every report
+app.comparisonPool = ThreadPoolExecutor(max_workers=app.config.get("comparison_workers", 4))
+
+# Loaded CDC files are cached by their contents for the python engine, so comparing the same file again skips parsing it
+cdc_cache_mb = app.config.get("cdc_cache_mb", 0)
+app.cdcCache = cdc_cache.CDCCache(app.config.get("cdc_cache_dir") or os.path.join(app.dir, "cdc_cache"),
+                                  cdc_cache_mb * 1024 * 1024) if cdc_cache_mb > 0 else None
+
+# Uploads are copied to the temp folder in chunks of this many bytes, so they are never held in memory all at once
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+ZIP_MAGIC = b'PK\x03\x04'
+PARQUET_MAGIC = b'PAR1'
+ARROW_MAGIC = b'ARROW1'
+
+# A compressed upload is no larger than the file it decompresses to, so requests are limited to max_upload_mb for
+# each file they upload, plus 1 MB for the form's other fields and the compression's own headers
+max_upload_bytes = app.config.get("max_upload_mb", 2048) * 1024 * 1024
+app.add_middleware(RequestSizeLimit, max_bytes=max_upload_bytes + 1024 * 1024,
+                   path_limits={"/manual_report": 2 * max_upload_bytes + 1024 * 1024})
+
+# Report jobs waiting for or holding one of the max_concurrent_jobs slots of this server worker
+app.jobTasks = set()
+app.jobSlots = asyncio.Semaphore(app.config.get("max_concurrent_jobs", 2))
+
+@app.post("/manual_report", status_code=202)
 async def manual_report(isCDCFilter: bool, reportName: str, state_file: UploadFile = File(None), 
-                        cdc_file:  UploadFile = File(None), attributes: str = Form("[]")):
-    folder_name = "temp"
-    if not os.path.exists(os.path.join(app.dir, "temp")):
-        os.makedirs(os.path.join(app.dir, "temp"))
-
+                        cdc_file:  UploadFile = File(None), attributes: str = Form("[]"), engine: str = "python",
+                        workers: Optional[int] = Query(None, ge=1), profile: Optional[str] = None):
+    check_engine(engine)
+    attributes_list = json.loads(attributes)
+    workers = workers or app.config.get("partition_workers", 1)
+    comparison_profile = get_profile(profile)
+
+    # The uploads are only open until this request returns, so the job compares copies saved to the temp folder
+    state_path = await run_in_threadpool(save_upload, state_file)
     try:
-        id = str(uuid.uuid4())
-        os.makedirs(os.path.join(app.dir, folder_name, id), mode=0o777)
-        
-        # Fetching the archive_path for saving the Report
-        archive_path = await get_config_setting("archive_path")
-
-        cdc_content = await cdc_file.read()
-        cdc_save_to = os.path.join(app.dir, folder_name, id, "cdc.csv")
-        with open(cdc_save_to, "wb") as f:
-            f.write(cdc_content)
-
-        state_content = await state_file.read()
-        state_save_to = os.path.join(app.dir, folder_name, id, "state.csv")
-        with open(state_save_to, "wb") as f:
-            f.write(state_content)
-
-        res_file = os.path.join(app.dir, folder_name, id, "results.csv")
-        
-        # Creating argument list for running compare.py
-        subprocess_args = [sys.executable,
-                        os.path.join(app.dir, "compare.py"),
-                        '-c', cdc_save_to,
-                        '-s', state_save_to,
-                        '-o', res_file]
-        
-        if isCDCFilter:
-            subprocess_args.append('-f')
-        
-        attributes_list = json.loads(attributes)
-        subprocess_args.extend(['-a', *attributes_list])
-        
-        try:
-            process = await asyncio.create_subprocess_exec(*subprocess_args,
-                                                            stderr=subprocess.PIPE)
-            _, stderr = await process.communicate()  # Wait for subprocess to finish and get stderr
-            if process.returncode != 0:  # Non-zero return code indicates an error
-                error_message = stderr.decode().strip()  # Decode error message from bytes to string
-                raise RuntimeError(f"Subprocess failed with error: {error_message}")
-        except Exception as e:
-            print(f"Error running comparison: {e}")
-            raise HTTPException(status_code=500, detail="Error running comparison")
+        cdc_path = await run_in_threadpool(save_upload, cdc_file)
+    except Exception:
+        os.remove(state_path)
+        raise
+    jobID = await start_job(reportName, manual_pipeline, [state_path, cdc_path],
+                            state_path, cdc_path, isCDCFilter, attributes_list, engine, workers, comparison_profile)
 
-        res = []
-        with open(res_file, newline='') as csvfile:
-            # Create a CSV reader object
-            reader = csv.DictReader(csvfile)
-            # Loop through each row in the CSV file
-            for row in reader:
-                # Add the row as a dictionary to the list
-                res.append(tuple(row.values()))
+    return {"jobID": jobID}
 
-        numDiscrepancies = len(res)
-        reportId = insert_report(numDiscrepancies, reportName)
+@app.post("/automatic_report", status_code=202)
+async def automatic_report(year: int, isCDCFilter: bool, reportName: str,
+                           cdc_file:  UploadFile = File(None), attributes: str = Form("[]"), engine: str = "python",
+                           workers: Optional[int] = Query(None, ge=1), profile: Optional[str] = None,
+                           incremental: bool = False):
+    check_engine(engine)
+    attributes_list = json.loads(attributes)
+    workers = workers or app.config.get("partition_workers", 1)
+    comparison_profile = get_profile(profile)
+    if incremental and not (app.config.get("state_snapshot", False) and engine == "python" and workers == 1):
+        raise HTTPException(status_code=400, detail="Incremental reports need state_snapshot and the python engine with a single worker")
+
+    cdc_path = await run_in_threadpool(save_upload, cdc_file)
+    jobID = await start_job(reportName, automatic_pipeline, [cdc_path],
+                            year, cdc_path, isCDCFilter, attributes_list, engine, workers, comparison_profile, incremental)
+
+    return {"jobID": jobID}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """
+    Endpoint to fetch the status, stage, rows processed and elapsed time of a report job.
+    """
+    job = jobs.get_job(app.litePool, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    if not jobs.cancel_job(app.litePool, job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return Response(status_code=200)
+
+async def start_job(reportName: str, pipeline, uploads, *args):
+    """
+    Queues a report job that runs pipeline(job, *args) to get the results and stats, then saves them as a report.
+    The uploaded files are removed once the job is over. Returns the job's ID.
+    """
+    if len(app.jobTasks) >= app.config.get("max_queued_jobs", 20):
+        for path in uploads:
+            os.remove(path)
+        raise HTTPException(status_code=429, detail="Too many reports are being created, try again later")
 
-        stats_file = os.path.join(app.dir, folder_name, id, "stats.csv")
-        stats_list = []
+    try:
+        job = await run_in_threadpool(jobs.create_job, app.litePool, reportName)
+    except sqlite3.OperationalError as e:
+        for path in uploads:
+            os.remove(path)
+        if not jobs.is_locked(e):
+            raise
+        raise HTTPException(status_code=503, detail="The reports database is busy, try again later")
+    task = asyncio.create_task(run_job(job, reportName, pipeline, uploads, args))
+    # Keep a reference to the task so it is not garbage collected while it runs
+    app.jobTasks.add(task)
+    task.add_done_callback(app.jobTasks.discard)
+    return job.id
+
+async def run_job(job, reportName: str, pipeline, uploads, args):
+    try:
+        try:
+            # At most max_concurrent_jobs reports are made at once, the rest wait here as queued
+            async with app.jobSlots:
+                await run_in_threadpool(job.start)
+                results, stats = await pipeline(job, *args)
+                await run_in_threadpool(job.set_stage, "persist")
+                reportId = await run_in_threadpool(save_report, job.track(results), stats, reportName, job.save_hooks)
+            await run_in_threadpool(job.finish, reportId)
+        except jobs.JobCancelled:
+            await run_in_threadpool(job.mark_cancelled)
+        except HTTPException as e:
+            await run_in_threadpool(job.fail, e.detail)
+        except Exception as e:
+            print(f"Error creating report: {e}")
+            await run_in_threadpool(job.fail, "Internal Server Error")
+    except Exception as e:
+        # Even the final status could not be written, after trying for jobs.FINAL_STATUS_ATTEMPTS times sqlite_timeout
+        print(f"Error saving the status of job {job.id}: {e}")
+    finally:
+        for path in uploads:
+            os.remove(path)
+
+async def manual_pipeline(job, state_path, cdc_path, isCDCFilter: bool, attributes_list, engine: str, workers: int, profile):
+    # Only the columns the comparison uses are read from Parquet and Arrow uploads
+    columns = compare.needed_columns(attributes_list)
+    if engine == "columnar":
+        import columnar
+        await run_in_threadpool(job.set_stage, "load")
+        state_frame = await run_comparison(columnar.read_table, state_path, columns)
+        cdc_frame = await run_comparison(columnar.read_table, cdc_path, columns)
+        job.rows = len(state_frame) + len(cdc_frame)
+        await run_in_threadpool(job.set_stage, "compare")
+        return await run_comparison(columnar.run_comparison, state_frame, cdc_frame, isCDCFilter, attributes_list, profile)
+
+    if engine == "python" and workers > 1:
+        state_rows = job.track(compare.read_rows(state_path, columns), None, "compare")
+        cdc_rows = job.track(csv_scan.read_rows(cdc_path, columns, app.config.get("scan_workers")), "load")
+        return await run_comparison(partitioned_comparison, state_rows, cdc_rows, isCDCFilter, attributes_list, workers, profile)
+
+    if engine == "python":
+        reconciler = compare.Reconciler(profile)
+        (cdc_dict, cdcEventCodes) = await run_comparison(load_cdc, job, reconciler, cdc_path, isCDCFilter, attributes_list, "load")
+        # The state rows are deduplicated as they are loaded
+        state_rows = job.track(compare.read_rows(state_path, columns), "dedup", "compare")
+        return await run_comparison(reconciler.compare_state, state_rows, cdc_dict, cdcEventCodes, attributes_list, True)
+
+    state_rows = job.track(compare.read_rows(state_path, columns), None, "compare")
+    cdc_rows = job.track(compare.read_rows(cdc_path, columns), "load")
+    return await run_comparison(external_comparison, state_rows, cdc_rows, isCDCFilter, attributes_list, profile)
+
+async def automatic_pipeline(job, year: int, cdc_path, isCDCFilter: bool, attributes_list, engine: str, workers: int,
+                             profile, incremental: bool):
+    columns = compare.needed_columns(attributes_list)
+    loop = asyncio.get_running_loop()
+    await run_in_threadpool(job.set_stage, "query")
+
+    # Run query to retrieve data from NBS ODSE database off the event loop, loading the user-uploaded CDC data at the same time.
+    # Incremental reports only bring the snapshot up to date, and read the cases they compare from it themselves
+    query = loop.run_in_executor(app.comparisonPool, run_query, year, not incremental)
+    if engine == "columnar":
+        import columnar
+        cdc_load = run_comparison(columnar.read_table, cdc_path, columns)
+    elif engine == "python" and workers == 1:
+        reconciler = compare.Reconciler(profile)
+        cdc_load = run_comparison(load_cdc, job, reconciler, cdc_path, isCDCFilter, attributes_list)
+    else:
+        # The external engine and the python engine with several workers split up the CDC data themselves
+        # once the state data is available
+        cdc_load = asyncio.sleep(0)
+
+    # Wait for both before raising any error so the CDC file is not removed while it is still being read
+    query_result, cdc_data = await asyncio.gather(query, cdc_load, return_exceptions=True)
+    for result in (query_result, cdc_data):
+        if isinstance(result, BaseException):
+            raise result
+
+    (column_names, state_content) = query_result
+    if state_content is None:
+        raise HTTPException(status_code=400, detail="Query resulted in no data")
 
-        with open(stats_file, newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                tup = (reportId,) + tuple(row.values())
-                stats_list.append(tup)
+    # Do comparison on the queried state data and the user-uploaded CDC data
+    if engine == "columnar":
+        job.rows = len(cdc_data)
+        await run_in_threadpool(job.set_stage, "compare")
+        return await run_comparison(columnar_query_comparison, column_names, state_content, cdc_data, isCDCFilter, attributes_list, profile)
+
+    if engine == "python" and workers > 1:
+        state_rows = job.track(compare.query_rows(column_names, state_content), "load", "compare")
+        cdc_rows = job.track(csv_scan.read_rows(cdc_path, columns, app.config.get("scan_workers")))
+        return await run_comparison(partitioned_comparison, state_rows, cdc_rows, isCDCFilter, attributes_list, workers, profile)
+
+    if incremental:
+        # Only the cases that changed since the last report for this year, filter, attributes and profile are compared,
+        # and their outcomes are saved along with the report
+        (cdc_dict, cdcEventCodes) = cdc_data
+        run = IncrementalRun(app.litePool, year, isCDCFilter, attributes_list, track=lambda rows: job.track(rows, "dedup", "compare"))
+        job.save_hooks = run
+        return await run_comparison(run.compare_state, reconciler, column_names, cdc_dict, cdcEventCodes, attributes_list,
+                                    app.config.get("query_batch_size", 10000))
+
+    if engine == "python":
+        (cdc_dict, cdcEventCodes) = cdc_data
+        state_rows = job.track(compare.query_rows(column_names, state_content), "dedup", "compare")
+        return await run_comparison(reconciler.compare_state, state_rows, cdc_dict, cdcEventCodes, attributes_list, True)
+
+    state_rows = job.track(compare.query_rows(column_names, state_content), "load", "compare")
+    cdc_rows = job.track(compare.read_rows(cdc_path, columns))
+    return await run_comparison(external_comparison, state_rows, cdc_rows, isCDCFilter, attributes_list, profile)
+
+def save_upload(upload: UploadFile):
+    """
+    Copies an uploaded CSV, Parquet or Arrow file to the temp folder a chunk at a time and returns its path, which has
+    the extension of the file's format. Gzip and zip compressed uploads are decompressed as they are copied, and their
+    format is that of the decompressed file. Uploads larger than max_upload_mb once decompressed are rejected.
+    """
+    temp_dir = os.path.join(app.dir, "temp")
+    os.makedirs(temp_dir, exist_ok=True)
+    max_upload_mb = app.config.get("max_upload_mb", 2048)
+    path = None
 
-        if archive_path:
-            # Making a folder for the specific reportId
-            archive_save_to = os.path.join(archive_path, str(reportId))
-            os.makedirs(archive_save_to, exist_ok=True)
+    try:
+        with open_upload(upload) as source:
+            chunk = source.read(UPLOAD_CHUNK_SIZE)
+            path = os.path.join(temp_dir, f"{uuid.uuid4().hex}.{upload_format(chunk)}")
+            with open(path, 'wb') as f:
+                size = 0
+                while chunk:
+                    size += len(chunk)
+                    if size > max_upload_mb * 1024 * 1024:
+                        raise HTTPException(status_code=413, detail=f"{upload.filename} is larger than {max_upload_mb} MB")
+                    f.write(chunk)
+                    chunk = source.read(UPLOAD_CHUNK_SIZE)
+    except (gzip.BadGzipFile, zipfile.BadZipFile, EOFError) as e:
+        if path is not None:
+            os.remove(path)
+        print(f"Error decompressing upload: {e}")
+        raise HTTPException(status_code=400, detail=f"{upload.filename} could not be decompressed")
+    except BaseException:
+        if path is not None:
+            os.remove(path)
+        raise
+
+    return path
+
+def upload_format(data: bytes):
+    """
+    Returns 'parquet', 'arrow' or 'csv' for the start of an uploaded file, going by its magic number.
+    """
+    magic = data[:6]
+    if magic[:4] == PARQUET_MAGIC:
+        return "parquet"
+    if magic == ARROW_MAGIC:
+        return "arrow"
+    return "csv"
+
+def open_upload(upload: UploadFile):
+    """
+    Opens an uploaded file for reading, decompressing it if it starts with the magic number of a gzip or zip file.
+    """
+    upload.file.seek(0)
+    magic = upload.file.read(4)
+    upload.file.seek(0)
+
+    if magic[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=upload.file, mode='rb')
+    if magic == ZIP_MAGIC:
+        archive = zipfile.ZipFile(upload.file)
+        members = [member for member in archive.infolist() if not member.is_dir()]
+        if len(members) != 1:
+            raise HTTPException(status_code=400, detail=f"{upload.filename} should contain exactly one CSV file")
+        return archive.open(members[0])
+    # Leave the upload's file open so FastAPI can close it once the request is done
+    return contextlib.nullcontext(upload.file)
+
+def get_profile(name: Optional[str]):
+    """
+    Returns the comparison profile with the given name, or the comparison_profile setting's if no name is given.
+    """
+    try:
+        return profiles.load_profile(app.config, name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-            # writing the newly created results file to the archive folder too
-            shutil.copy2(res_file, archive_save_to)
-            shutil.copy2(stats_file, archive_save_to)
+def check_engine(engine: str):
+    if engine not in compare.ENGINES:
+        raise HTTPException(status_code=400, detail=f"Unknown comparison engine: {engine}")
 
-        # Add reportId to each row
-        new_res = [(reportId,) + row for row in res]
+def load_cdc(job, reconciler, cdc_path, isCDCFilter: bool, attributes_list, stage=None):
+    """
+    Loads a CDC file into a Reconciler for the python engine, from the CDC cache if it is enabled.
+    """
+    scan_workers = app.config.get("scan_workers")
+    if app.cdcCache is None:
+        cdc_rows = job.track(csv_scan.read_rows(cdc_path, compare.needed_columns(attributes_list), scan_workers), stage)
+        return reconciler.load_cdc(cdc_rows, isCDCFilter, attributes_list)
+    # The cache keeps every column, so the same entry can be used whichever attributes are compared
+    return app.cdcCache.load_cdc(reconciler, cdc_path, lambda path: job.track(csv_scan.read_rows(path, None, scan_workers), stage),
+                                 isCDCFilter, attributes_list)
+
+@app.get("/cdc_cache")
+def get_cdc_cache():
+    """
+    Endpoint to fetch the hit and miss counts of this server worker's CDC cache, and its number of entries and size in bytes.
+    """
+    if app.cdcCache is None:
+        raise HTTPException(status_code=404, detail="The CDC cache is disabled")
+    return app.cdcCache.info()
 
-        insert_cases(new_res)
-        insert_statistics(stats_list)
+def external_comparison(state_rows, cdc_rows, isCDCFilter: bool, attributes_list, profile):
+    """
+    Runs the external sort-merge engine with its spill files in the temp folder. Its results are read back from
+    the spill files while they are saved.
+    """
+    import sortmerge
+    spill_dir = os.path.join(app.dir, "temp")
+    os.makedirs(spill_dir, exist_ok=True)
+    results, stats = sortmerge.run_comparison(state_rows, cdc_rows, isCDCFilter, attributes_list,
+                                              app.config.get("spill_rows", sortmerge.DEFAULT_SPILL_ROWS), spill_dir, profile)
+    return results, stats
+
+def partitioned_comparison(state_rows, cdc_rows, isCDCFilter: bool, attributes_list, workers: int, profile):
+    """
+    Runs the python engine split across workers processes by CaseID.
+    """
+    import partitioned
+    return partitioned.run_comparison(state_rows, cdc_rows, isCDCFilter, attributes_list, workers, profile)
 
-        # remove temp files / folder
-        shutil.rmtree(os.path.join(app.dir, folder_name, id))
+def columnar_query_comparison(column_names, state_content, cdc_frame, isCDCFilter: bool, attributes_list, profile):
+    """
+    Runs the columnar engine on queried state records and an already loaded CDC DataFrame.
+    """
+    import columnar
+    state_frame = columnar.query_frame(column_names, state_content)
+    return columnar.run_comparison(state_frame, cdc_frame, isCDCFilter, attributes_list, profile)
 
-        return Response(status_code=200)
+async def run_comparison(comparison, *args):
+    """
+    Runs a step of a comparison engine on the comparison pool so the event loop is free while it runs.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(app.comparisonPool, comparison, *args)
+    except jobs.JobCancelled:
+        raise
     except Exception as e:
-        # remove temp files / folder
-        shutil.rmtree(os.path.join(app.dir, folder_name, id))
-        raise e
+        print(f"Error running comparison: {e}")
+        raise HTTPException(status_code=500, detail="Error running comparison")
 
-@app.post("/automatic_report")
-async def automatic_report(year: int, isCDCFilter: bool, reportName: str,
-                           cdc_file:  UploadFile = File(None), attributes: str = Form("[]")):
-    # Run query to retrieve data from NBS ODSE database
-    (column_names, state_content) = run_query(year)
-    if not len(state_content) > 0:
-        raise HTTPException(status_code=400, detail="Query resulted in no data")
-
-    # Create temp file structure
-    folder_name = "temp"
-    if not os.path.exists(os.path.join(app.dir, folder_name)):
-        os.makedirs(os.path.join(app.dir, folder_name))
-    try:
-        # Fetching the archive_path for saving the Report
-        archive_path = await get_config_setting("archive_path")
-        
-        id = str(uuid.uuid4())
-        os.makedirs(os.path.join(app.dir, folder_name, id), mode=0o777)
-
-        # Write queried state data to csv
-        state_save_to = os.path.join(app.dir, folder_name, id, "state.csv")
-        with open(state_save_to, "w", newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(column_names)
-            writer.writerows(state_content)
-
-        # Write user-uploaded CDC data to local csv
-        cdc_content = await cdc_file.read()
-        cdc_save_to = os.path.join(app.dir, folder_name, id, "cdc.csv")
-        with open(cdc_save_to, "wb") as f:
-            f.write(cdc_content)
-
-        # Do comparison
-        res_file = os.path.join(app.dir, folder_name, id, "results.csv")
-        # Creating argument list for running compare.py
-        subprocess_args = [sys.executable,
-                        os.path.join(app.dir, "compare.py"),
-                        '-c', cdc_save_to,
-                        '-s', state_save_to,
-                        '-o', res_file]
-        
-        if isCDCFilter:
-            subprocess_args.append('-f')
-        
-        attributes_list = json.loads(attributes)
-        subprocess_args.extend(['-a', *attributes_list])
-        
-        try:
-            process = await asyncio.create_subprocess_exec(*subprocess_args,
-                                                            stderr=subprocess.PIPE)
-            _, stderr = await process.communicate()  # Wait for subprocess to finish and get stderr
-            if process.returncode != 0:  # Non-zero return code indicates an error
-                error_message = stderr.decode().strip()  # Decode error message from bytes to string
-                raise RuntimeError(f"Subprocess failed with error: {error_message}")
-        except Exception as e:
-            print(f"Error running comparison: {e}")
-            raise HTTPException(status_code=500, detail="Error running comparison")
-        
-        # Add results to the response
-        res = []
-        with open(res_file, newline='') as csvfile:
-            # Create a CSV reader object
-            reader = csv.DictReader(csvfile)
-            # Loop through each row in the CSV file
-            for row in reader:
-                # Add the row as a dictionary to the list
-                res.append(tuple(row.values()))
-
-        numDiscrepancies = len(res)
-        reportId = insert_report(numDiscrepancies, reportName)
-
-        stats_file = os.path.join(app.dir, folder_name, id, "stats.csv")
-        stats_list = []
-
-        with open(stats_file, newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                tup = (reportId,) + tuple(row.values())
-                stats_list.append(tup)
-        
-        if archive_path:
-            # Making a folder for the specific reportId
-            archive_save_to = os.path.join(archive_path, str(reportId))
-            os.makedirs(archive_save_to, exist_ok=True)
-
-            # writing the newly created results file to the archive folder too
-            shutil.copy2(res_file, archive_save_to)
-            shutil.copy2(stats_file, archive_save_to)
-
-        # Add reportId to each row
-        new_res = [(reportId,) + row for row in res]
-
-        insert_cases(new_res)
-        insert_statistics(stats_list)
-        
-        # remove temp files / folder
-        shutil.rmtree(os.path.join(app.dir, folder_name, id))
+def save_report(results, stats, reportName: str, hooks=None):
+    """
+    Saves the results and stats of a comparison as a new report and archives them if an archive_path is set.
+    """
+    # Fetching the archive_path for saving the Report
+    archive_path = get_config_setting("archive_path")
 
-        return Response(status_code=200)
-    except Exception as e:
-        # remove temp files / folder
-        shutil.rmtree(os.path.join(app.dir, folder_name, id))
-        raise e
+    # The results are streamed into a staging file in the temp folder, and the archive, before the report is saved
+    with app.litePool.connection() as conn:
+        return reports_db.save_report(conn, results, stats, reportName, archive_path, app.config.get("archive_format", "csv"),
+                                      os.path.join(app.dir, "temp"), hooks)
 
 @app.get("/reports")
-async def get_report_summaries():
+def get_report_summaries():
     # Fetch all reports from the SQLite database, ordered by date and time (newest reports at the top)
     try:
-        cur = app.liteConn.cursor()
-        cur.execute(
-            "SELECT * FROM Reports ORDER BY CreatedAtDate DESC, TimeOfCreation DESC;")
+        with app.litePool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT * FROM Reports ORDER BY CreatedAtDate DESC, TimeOfCreation DESC;")
 
-        return [dict(zip([column[0] for column in cur.description], row)) for row in cur.fetchall()]
+            return [dict(zip([column[0] for column in cur.description], row)) for row in cur.fetchall()]
 
     except sqlite3.Error as e:
         print(f"Database error: {e}")
         return None
 
 @app.get("/reports/{report_id}")
-async def get_report_cases(report_id: int):
+def get_report_cases(report_id: int, limit: Optional[int] = Query(None, ge=1, le=10000), after: Optional[str] = None,
+                     sort: str = "ID", descending: bool = False, EventCode: Optional[str] = None, ReasonID: Optional[int] = None,
+                     CaseClassStatus: Optional[str] = None, MMWRWeek: Optional[int] = None):
     """
-    Endpoint to fetch cases for a report by its ID.
+    Endpoint to fetch cases for a report by its ID, filtered by EventCode, ReasonID, CaseClassStatus and MMWRWeek and
+    sorted by a column of reports_db.CASE_SORT_COLUMNS. Without a limit every matching case is returned as a list. With a limit, one page is returned
+    as {"cases", "total", "next"}, and the next page is fetched by passing next as after.
     """
-    report = fetch_reports_from_db(report_id)
+    filters = {'EventCode': EventCode, 'ReasonID': ReasonID, 'CaseClassStatus': CaseClassStatus, 'MMWRWeek': MMWRWeek}
+    try:
+        report = fetch_reports_from_db(report_id, filters, sort, descending, limit, after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if report is None:
         raise HTTPException(status_code=404, detail="Report not found")
-    return report
+
+    cases, total, next_cursor = report
+    if limit is None:
+        return cases
+    return {"cases": cases, "total": total, "next": next_cursor}
+
+@app.get("/reports/{report_id}/diff")
+def get_report_diff(report_id: int, base: int, EventCode: Optional[str] = None, ReasonID: Optional[int] = None,
+                    CaseClassStatus: Optional[str] = None, MMWRWeek: Optional[int] = None):
+    """
+    Endpoint to count the cases of a report that are new, resolved or unchanged since the base report, matching
+    cases on their CaseID and ReasonID. The cases can be filtered like those of /reports/{report_id}.
+    """
+    filters = {'EventCode': EventCode, 'ReasonID': ReasonID, 'CaseClassStatus': CaseClassStatus, 'MMWRWeek': MMWRWeek}
+    try:
+        with app.litePool.connection() as conn:
+            check_reports_exist(conn, report_id, base)
+            return {"report": report_id, "base": base, **reports_db.diff_counts(conn, report_id, base, filters)}
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        raise HTTPException(status_code = 500, detail = "Internal Server Error")
+
+@app.get("/reports/{report_id}/diff/{category}")
+def get_report_diff_cases(report_id: int, category: str, base: int, limit: Optional[int] = Query(None, ge=1, le=10000),
+                          after: Optional[str] = None, EventCode: Optional[str] = None, ReasonID: Optional[int] = None,
+                          CaseClassStatus: Optional[str] = None, MMWRWeek: Optional[int] = None):
+    """
+    Endpoint to fetch the new, resolved or unchanged cases of a report since the base report. Without a limit every
+    case is returned as a list. With a limit, one page is returned as {"cases", "next"}, and the next page is fetched
+    by passing next as after.
+    """
+    filters = {'EventCode': EventCode, 'ReasonID': ReasonID, 'CaseClassStatus': CaseClassStatus, 'MMWRWeek': MMWRWeek}
+    try:
+        with app.litePool.connection() as conn:
+            check_reports_exist(conn, report_id, base)
+            cases, next_cursor = reports_db.fetch_diff(conn, report_id, base, category, filters, limit, after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        raise HTTPException(status_code = 500, detail = "Internal Server Error")
+
+    if limit is None:
+        return cases
+    return {"cases": cases, "next": next_cursor}
+
+def check_reports_exist(conn, *report_ids):
+    for report_id in report_ids:
+        if conn.execute("SELECT 1 FROM Reports WHERE ID = ?", (report_id,)).fetchone() is None:
+            raise HTTPException(status_code=404, detail=f"Report {report_id} not found")
+
+@app.get("/trends")
+def get_trends(limit: int = Query(20, ge=1, le=1000), EventCode: Optional[str] = None, ReasonID: Optional[int] = None,
+               CaseClassStatus: Optional[str] = None, MMWRWeek: Optional[int] = None):
+    """
+    Endpoint to fetch the discrepancy totals of the last limit reports, oldest first, counting only the cases with
+    the given EventCode, ReasonID, CaseClassStatus and MMWRWeek. See reports_db.fetch_trends.
+    """
+    filters = {'EventCode': EventCode, 'ReasonID': ReasonID, 'CaseClassStatus': CaseClassStatus, 'MMWRWeek': MMWRWeek}
+    try:
+        with app.litePool.connection() as conn:
+            return reports_db.fetch_trends(conn, filters, limit)
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        raise HTTPException(status_code = 500, detail = "Internal Server Error")
 
 @app.get("/report_statistics/{report_id}")
-async def get_report_statistics(report_id: int):
+def get_report_statistics(report_id: int):
     try:
-        cur = app.liteConn.cursor()
-        cur.execute(
-            "SELECT * FROM Statistics WHERE ReportID = ?", (report_id,))
-        results = cur.fetchall()
-        if not results:
-            raise HTTPException(status_code = 404, detail = "Report Not Found")
-        return [dict(zip([column[0] for column in cur.description], row)) for row in results]
+        with app.litePool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT * FROM Statistics WHERE ReportID = ?", (report_id,))
+            results = cur.fetchall()
+            if not results:
+                raise HTTPException(status_code = 404, detail = "Report Not Found")
+            return [dict(zip([column[0] for column in cur.description], row)) for row in results]
     
     except sqlite3.Error as e:
         print(f"Database error: {e}")
         raise HTTPException(status_code = 500, detail = "Internal Server Error")
     
 @app.post("/reports")
-async def rename_report(report_id: int, new_name: str):
+def rename_report(report_id: int, new_name: str):
+    # The pool rolls back the changes of a connection that raised an error
     try:
-        cur = app.liteConn.cursor()
-        cur.execute("UPDATE Reports SET Name = ? WHERE ID = ?", (f"Report {report_id}" if new_name == "" else new_name, report_id))
-        app.liteConn.commit()
+        with app.litePool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("UPDATE Reports SET Name = ? WHERE ID = ?", (f"Report {report_id}" if new_name == "" else new_name, report_id))
+            conn.commit()
         return Response(status_code=200)
     except sqlite3.Error as e:
         print(f"Database error: {e}")
-        app.liteConn.rollback()
         return HTTPException(status_code = 500, detail = "Internal Server Error")
 
 @app.delete("/reports/{report_id}")
-async def delete_report(report_id: int):
+def delete_report(report_id: int):
     """
-    Deletes a report from all 3 tables.
+    Deletes a report from all of its tables.
     """
     try:
-        cur = app.liteConn.cursor()
-        cur.execute("DELETE FROM Reports WHERE ID = ?", (report_id,))
-        cur.execute("DELETE FROM Cases WHERE ReportID = ?", (report_id,))
-        cur.execute("DELETE FROM Statistics WHERE ReportID = ?", (report_id,))
-        app.liteConn.commit()
+        with app.litePool.connection() as conn:
+            reports_db.delete_reports(conn, [report_id])
+            conn.commit()
         return Response(status_code=200)
     except sqlite3.Error as e:
         print(f"Database error: {e}")
-        app.liteConn.rollback()
         return HTTPException(status_code = 500, detail = "Internal Server Error")
 
-def fetch_reports_from_db(report_id: int):
+@app.delete("/reports")
+def delete_old_reports(older_than_days: Optional[int] = Query(None, ge=0), keep: Optional[int] = Query(None, ge=0)):
     """
-    Function to fetch a report from the SQLite database.
+    Deletes the reports created more than older_than_days days ago and the reports older than the newest keep
+    reports, then gives their space back to the file system. Returns how many reports were deleted.
     """
+    if older_than_days is None and keep is None:
+        raise HTTPException(status_code=400, detail="Give older_than_days or keep")
     try:
-        cur = app.liteConn.cursor()
-        cur.execute("SELECT * FROM Cases WHERE ReportID = ?", (report_id,))
-        return [dict(zip([column[0] for column in cur.description], row)) for row in cur.fetchall()]
+        return {"deleted": remove_expired_reports(older_than_days, keep)}
     except sqlite3.Error as e:
         print(f"Database error: {e}")
-        return None
-
-def insert_report(noOfDiscrepancies, name = ""):
-    try:
-        cur = app.liteConn.cursor()
-        cur.execute("INSERT INTO Reports (CreatedAtDate, TimeOfCreation, NumberOfDiscrepancies, Name)  VALUES (DATE('now'), TIME('now'), ?, ?)", (noOfDiscrepancies, name))
-        report_id = cur.lastrowid
-        # Set default name if none provided
-        if name == "":
-            cur.execute("UPDATE Reports SET Name = ? WHERE ID = ?", (f"Report {report_id}", report_id))
-        app.liteConn.commit()
-        return report_id
-    except Exception as e:
-        app.liteConn.rollback()
-        raise e  
-
-def insert_statistics(stats):
-    try:
-        cur = app.liteConn.cursor()
-        cur.executemany("INSERT INTO Statistics (ReportID, EventCode, EventName, TotalCases, TotalDuplicates, TotalMissingFromCDC, TotalMissingFromState, TotalWrongAttributes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", stats)
-        app.liteConn.commit()
-    except Exception as e:
-        app.liteConn.rollback()
-        raise e
+        raise HTTPException(status_code = 500, detail = "Internal Server Error")
 
-def insert_cases(res):
+def remove_expired_reports(max_age_days=None, max_reports=None, rebuild=False, interval_seconds=None):
+    """
+    Deletes the reports given by reports_db.expired_reports and compacts the database. If interval_seconds is given,
+    nothing is done when another server worker already did this in the last interval_seconds. Returns how many
+    reports were deleted, or None if nothing was done.
+    """
+    with app.litePool.connection() as conn:
+        if interval_seconds is not None and not reports_db.claim_task(conn, "cleanup_reports", interval_seconds):
+            return None
+        deleted = reports_db.delete_reports(conn, reports_db.expired_reports(conn, max_age_days, max_reports))
+        conn.commit()
+        reports_db.compact(conn, rebuild)
+    return deleted
+
+async def cleanup_reports():
+    """
+    Deletes the reports past report_retention_days or report_retention_count (when they are not 0), and the CDC
+    cache entries not used in the last cdc_cache_days, every cleanup_interval_hours, starting when the server starts. Every server worker runs this, but only one of them
+    cleans up in each interval, so the rebuild of a database made before incremental vacuum was turned on (which
+    lets it be compacted) never runs in two workers at once.
+    """
+    interval_hours = app.config.get("cleanup_interval_hours", 24)
+    if interval_hours <= 0:
+        return
+    while True:
+        try:
+            await run_in_threadpool(remove_expired_reports, app.config.get("report_retention_days") or None,
+                                    app.config.get("report_retention_count") or None, True, interval_hours * 3600)
+        except sqlite3.Error as e:
+            print(f"Error cleaning up reports: {e}")
+        if app.cdcCache is not None:
+            await run_in_threadpool(app.cdcCache.purge, app.config.get("cdc_cache_days", 7) * 86400)
+        await asyncio.sleep(interval_hours * 3600)
+
+def fetch_reports_from_db(report_id: int, filters=None, sort="ID", descending=False, limit=None, after=None):
+    """
+    Function to fetch a report's cases from the SQLite database, see reports_db.fetch_cases.
+    """
     try:
-        cur = app.liteConn.cursor()
-        cur.executemany("INSERT INTO Cases (ReportID, CaseID, EventCode, EventName, MMWRYear, MMWRWeek, Reason, ReasonID, CaseClassStatus) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", res)
-        app.liteConn.commit()
-    except Exception as e:
-        app.liteConn.rollback()
-        raise e
+        with app.litePool.connection() as conn:
+            return reports_db.fetch_cases(conn, report_id, filters, sort, descending, limit, after)
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return None
 
-def run_query(year: int):
+def run_query(year: int, read_records: bool = True):
     query = None
     query_file_path = os.path.join(app.dir, "query.sql")
     with open(query_file_path, 'r') as f:
         query = f.read()
 
-    cursor = app.conn.cursor()
-    cursor.execute(query, year)
-    # Return the queried data as a list of dicts
+    if app.config.get("state_snapshot", False):
+        return snapshot_query(year, query, read_records)
+
+    conn = app.nbsPool.acquire()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, year)
+    except Exception:
+        app.nbsPool.release(conn, failed=True)
+        raise
+
+    # Return the column names and the queried records, which are fetched in batches as they are used.
+    # The records are None if the query returned nothing
     column_names = [col[0] for col in cursor.description]
-    data = cursor.fetchall()
+    data = query_records(conn, cursor)
+    first_record = next(data, None)
+    if first_record is None:
+        return (column_names, None)
 
-    return (column_names, data)
+    return (column_names, chain([first_record], data))
+
+def snapshot_query(year: int, query: str, read_records: bool = True):
+    """
+    Like run_query, but only pulls the cases that changed since the last report for the year into a local
+    snapshot of the state data, and reads the records from the snapshot. If read_records is False, the records are
+    left for the comparison to read and are True in their place when the snapshot has any.
+    """
+    with open(os.path.join(app.dir, "delta_query.sql"), 'r') as f:
+        delta_query = f.read()
+    batch_size = app.config.get("query_batch_size", 10000)
+
+    with app.nbsPool.connection() as nbsConn, app.litePool.connection() as liteConn:
+        column_names = state_snapshot.update(nbsConn, liteConn, year, query, delta_query, app.config.get("snapshot_overlap_minutes", 60),
+                                             app.config.get("snapshot_refresh_days", 7), batch_size)
+
+    if not read_records:
+        with app.litePool.connection() as liteConn:
+            return (column_names, state_snapshot.has_records(liteConn, year) or None)
+
+    conn = app.litePool.acquire()
+    data = snapshot_records(conn, year, batch_size)
+    first_record = next(data, None)
+    if first_record is None:
+        return (column_names, None)
+
+    return (column_names, chain([first_record], data))
+
+def snapshot_records(conn, year: int, batch_size: int):
+    """
+    Yields the records of a year's state snapshot, giving the connection back to the pool once they have all been read.
+    """
+    try:
+        yield from state_snapshot.snapshot_records(conn, year, batch_size)
+    finally:
+        app.litePool.release(conn)
+
+def query_records(conn, cursor):
+    """
+    Yields the records of an executed query in batches, giving its connection back to the pool once they have all been read.
+    """
+    try:
+        yield from compare.fetch_records(cursor, app.config.get("query_batch_size", 10000))
+    finally:
+        cursor.close()
+        app.nbsPool.release(conn)
 
 @app.get("/config/{field_name}")
-async def get_config_setting(field_name: str):
+def get_config_setting(field_name: str):
     try:
-        cur = app.liteConn.cursor()
-        cur.execute("SELECT * FROM Config WHERE FieldName = ?", (field_name,))
-        value = cur.fetchall()
+        with app.litePool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM Config WHERE FieldName = ?", (field_name,))
+            value = cur.fetchall()
         if len(value) > 0:
             # value is [(idx, field_name, field_value)] so need to return value[0][2]
             return value[0][2]
@@ -451,25 +773,22 @@ async def get_config_setting(field_name: str):
         return None
     
 @app.post("/config")
-async def set_config_setting(field_name: str, value: str, password: str):
+def set_config_setting(field_name: str, value: str, password: str):
     # Do not allow changing config settings if password is wrong
     if password != app.config["config_password"]:
         raise HTTPException(status_code = 401, detail = "Unauthorized: password incorrect") 
     
-    current_setting = await get_config_setting(field_name)
+    current_setting = get_config_setting(field_name)
     # print(f"Setting config setting {field_name} to {value}. Previous value: {current_setting}")
-    try:
-        cur = app.liteConn.cursor()
+    with app.litePool.connection() as conn:
+        cur = conn.cursor()
         # If the setting already exists, update it
         if current_setting is not None:
             cur.execute("UPDATE Config SET FieldValue = ? WHERE FieldName = ?", (value, field_name))
         else:
             # Otherwise, create the entry
             cur.execute("INSERT INTO Config (FieldName, FieldValue) VALUES (?, ?)", (field_name, value))
-        app.liteConn.commit()
-    except Exception as e:
-        app.liteConn.rollback()
-        raise e
+        conn.commit()
     
 # Route to serve React index.html (for client-side routing)
 @app.get("/{catchall:path}")
@@ -482,8 +801,8 @@ async def serve_react_app(catchall: str):
 
 if __name__ == "__main__":
     # Run the API with uvicorn
-    # If application is slow, try increasing the number of workers
-    uvicorn.run("server:app", host="0.0.0.0", port=app.config["port"], workers=1)
+    # If application is slow, try increasing the number of workers with server_workers in config.json
+    uvicorn.run("server:app", host="0.0.0.0", port=app.config["port"], workers=app.config.get("server_workers", 1))
 
     # Use this command to run the API with reloading enabled (DOES NOT WORK ON WINDOWS)
     # uvicorn.run("server:app", host="localhost", port=app.config["port"], reload=True)
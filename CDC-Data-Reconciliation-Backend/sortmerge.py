@@ -0,0 +1,204 @@
+import csv
+import heapq
+import os
+import tempfile
+from itertools import groupby
+import compare
+
+# Out-of-core comparison engine for inputs that do not fit in memory. Both datasets are sorted by CaseID
+# into spill files on disk, and the sorted files are then merge-joined one CaseID at a time. Every row
+# keeps the line it came from, so the results can be put back in the same order compare.run_comparison
+# gives them. At most spill_rows rows of each dataset are held in memory at once.
+
+DEFAULT_SPILL_ROWS = 500000
+
+def case_key(record):
+    return (record[0], int(record[1]))
+
+def result_key(record):
+    return (int(record[0]), int(record[1]))
+
+class SpillFiles:
+    """
+    Sorts records that may not fit in memory by writing sorted runs of at most spill_rows records to
+    CSV files and merging the runs back together.
+    """
+    def __init__(self, directory, name, spill_rows, key) -> None:
+        self.directory = directory
+        self.name = name
+        self.spill_rows = spill_rows
+        self.key = key
+        self.runs = []
+        self.buffer = []
+
+    def add(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.spill_rows:
+            self.spill()
+
+    def spill(self):
+        if not self.buffer:
+            return
+        self.buffer.sort(key=self.key)
+        run_file = os.path.join(self.directory, f"{self.name}-{len(self.runs)}.csv")
+        with open(run_file, 'w', newline='', encoding='utf-8') as csvfile:
+            csv.writer(csvfile).writerows(self.buffer)
+        self.runs.append(run_file)
+        self.buffer = []
+
+    def sorted(self):
+        """
+        Yields every record that was added in sorted order.
+        """
+        # Everything fit in memory, so there is nothing to merge
+        if not self.runs:
+            self.buffer.sort(key=self.key)
+            yield from self.buffer
+            return
+
+        self.spill()
+        files = [open(run_file, newline='', encoding='utf-8') for run_file in self.runs]
+        try:
+            yield from heapq.merge(*(csv.reader(csvfile) for csvfile in files), key=self.key)
+        finally:
+            for csvfile in files:
+                csvfile.close()
+
+def case_groups(records):
+    """
+    Groups sorted records by CaseID, yielding (CaseID, records) with the records in the order of their lines.
+    """
+    for case_id, group in groupby(records, key=lambda record: record[0]):
+        yield case_id, list(group)
+
+def new_counts():
+    return {'totalCases': 0, 'totalDuplicates': 0, 'totalMissingCDC': 0, 'totalMissingState': 0, 'totalWrongAttributes': 0}
+
+def result_record(phase, line, row, reason, reasonID):
+    return (phase, line, row['CaseID'], row['EventCode'], row['EventName'], row['MMWRYear'], row['MMWRWeek'],
+            reason, reasonID, row['CaseClassStatus'])
+
+def ordered_results(results_spill, spill_directory):
+    """
+    Yields the CaseResults in the same order as compare.run_comparison, removing the spill files once done.
+    """
+    try:
+        for record in results_spill.sorted():
+            yield compare.CaseResult(*record[2:])
+    finally:
+        spill_directory.cleanup()
+
+def run_comparison(state_rows, cdc_rows, filterCDC=False, compare_attributes=None,
+                   spill_rows=DEFAULT_SPILL_ROWS, spill_dir=None, profile=None):
+    """
+    Compares iterables of state and CDC row dictionaries without holding either dataset in memory.
+    Returns (results, stats) like compare.run_comparison, except that results is an iterator that
+    reads the results back from disk and should be consumed once.
+    """
+    spill_directory = tempfile.TemporaryDirectory(dir=spill_dir)
+    try:
+        # Only the columns this comparison uses are written to the spill files
+        state_columns, state_rows = compare.peek_columns(state_rows)
+        cdc_columns, cdc_rows = compare.peek_columns(cdc_rows)
+        state_columns, cdc_columns = compare.kept_columns(state_columns, cdc_columns, compare_attributes)
+
+        cdc_spill = SpillFiles(spill_directory.name, "cdc", spill_rows, case_key)
+        cdcEventCodes = set() if filterCDC else None
+        for line, row in enumerate(cdc_rows):
+            if filterCDC:
+                cdcEventCodes.add(row['EventCode'])
+            cdc_spill.add((row['CaseID'], line, *(row[column] for column in cdc_columns)))
+
+        state_spill = SpillFiles(spill_directory.name, "state", spill_rows, case_key)
+        for line, row in enumerate(state_rows):
+            # Same filtering as compare.load_state_rows
+            if row['EventCode'].isnumeric() == False:
+                continue
+            if cdcEventCodes is not None and row['EventCode'] not in cdcEventCodes:
+                continue
+            state_spill.add((row['CaseID'], line, *(row[column] for column in state_columns)))
+
+        results_spill = SpillFiles(spill_directory.name, "results", spill_rows, result_key)
+        comparer = compare.AttributeComparer(compare_attributes, profile)
+        counts = {}
+        # (line, EventName) of the first row with each EventCode, which decides the order and names of the stats
+        cdc_names = {}
+        state_names = {}
+
+        def count(eventCode, total):
+            if eventCode not in counts:
+                counts[eventCode] = new_counts()
+            counts[eventCode][total] += 1
+
+        def first_name(names, eventCode, line, eventName):
+            if eventCode not in names or line < names[eventCode][0]:
+                names[eventCode] = (line, eventName)
+
+        def cdc_case(records):
+            # The first row of a CaseID is kept and every later one is a duplicate
+            cdc_row = dict(zip(cdc_columns, records[0][2:]))
+            first_name(cdc_names, cdc_row['EventCode'], int(records[0][1]), cdc_row['EventName'])
+            for record in records[1:]:
+                duplicate_row = dict(zip(cdc_columns, record[2:]))
+                results_spill.add(result_record(1, record[1], duplicate_row, "Duplicate CaseID found in CDC dataset", "1"))
+                count(duplicate_row['EventCode'], 'totalDuplicates')
+            return cdc_row, int(records[0][1])
+
+        def state_case(records):
+            # Keep the row with the latest add_time, the first row wins when add_times are equal
+            winner = records[0]
+            winner_time = None
+            for record in records[1:]:
+                add_time = 2 + state_columns.index('add_time')
+                if winner_time is None:
+                    winner_time = compare.time_key(winner[add_time])
+                new_time = compare.time_key(record[add_time])
+                if new_time > winner_time:
+                    winner, winner_time = record, new_time
+            state_row = dict(zip(state_columns, winner[2:]))
+            first_line = int(records[0][1])
+            first_name(state_names, state_row['EventCode'], first_line, state_row['EventName'])
+            count(state_row['EventCode'], 'totalCases')
+            return state_row, first_line
+
+        state_cases = case_groups(state_spill.sorted())
+        cdc_cases = case_groups(cdc_spill.sorted())
+        next_state = next(state_cases, None)
+        next_cdc = next(cdc_cases, None)
+        while next_state is not None or next_cdc is not None:
+            if next_cdc is None or (next_state is not None and next_state[0] < next_cdc[0]):
+                # CaseID only in the state data
+                state_row, first_line = state_case(next_state[1])
+                results_spill.add(result_record(2, first_line, state_row, "CaseID not found in CDC dataset", "2"))
+                count(state_row['EventCode'], 'totalMissingCDC')
+                next_state = next(state_cases, None)
+
+            elif next_state is None or next_cdc[0] < next_state[0]:
+                # CaseID only in the CDC data
+                cdc_row, line = cdc_case(next_cdc[1])
+                results_spill.add(result_record(3, line, cdc_row, "CaseID not found in State dataset", "4"))
+                count(cdc_row['EventCode'], 'totalMissingState')
+                count(cdc_row['EventCode'], 'totalCases')
+                next_cdc = next(cdc_cases, None)
+
+            else:
+                state_row, first_line = state_case(next_state[1])
+                cdc_row, _ = cdc_case(next_cdc[1])
+                att_list = comparer.differing(state_row, cdc_row)
+                if att_list != []:
+                    results_spill.add(result_record(2, first_line, state_row, compare.mismatch_reason(att_list), "3"))
+                    count(state_row['EventCode'], 'totalWrongAttributes')
+                next_state = next(state_cases, None)
+                next_cdc = next(cdc_cases, None)
+
+        # Stats are ordered like compare.Reconciler creates them: EventCodes from the CDC data first, then the state data
+        stats = {}
+        ordered_names = sorted(cdc_names.items(), key=lambda item: item[1][0]) + \
+            sorted(((eventCode, name) for eventCode, name in state_names.items() if eventCode not in cdc_names), key=lambda item: item[1][0])
+        for eventCode, (_, eventName) in ordered_names:
+            stats[eventCode] = {'eventName': eventName, **counts.get(eventCode, new_counts())}
+    except Exception:
+        spill_directory.cleanup()
+        raise
+
+    return ordered_results(results_spill, spill_directory), stats
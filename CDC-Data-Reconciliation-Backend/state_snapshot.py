@@ -0,0 +1,218 @@
+import hashlib
+import json
+import uuid
+from datetime import datetime, timedelta
+import compare
+
+# Local snapshots of the state data of each MMWR year, kept in the reports database so automatic reports do not run
+# the whole year's query against the NBS database every time. The first report for a year runs query.sql and saves
+# its rows along with a watermark, the NBS database's time when the query started. Later reports run
+# delta_query.sql, which returns every row of the cases changed since the watermark, and replace the snapshot rows of
+# those cases with them before the comparison reads the snapshot. The snapshot is made again from query.sql when
+# either query changes or the snapshot is older than refresh_days.
+#
+# Incremental reports (see incremental.py) need to know which cases changed since their last report, so the
+# CaseIDs whose rows each pull changes are logged in StateSnapshotChanges. A full pull only works them out while some
+# incremental report of the year needs them, otherwise it logs an empty CaseID that moves the year's ChangesFrom past
+# every earlier change. The changes older than every incremental report of the year are removed after each pull.
+
+# Most CaseIDs looked up in one query by case_records
+CASE_BATCH = 500
+
+def query_hash(*queries):
+    return hashlib.blake2b("\0".join(queries).encode(), digest_size=16).hexdigest()
+
+def nbs_time(nbsConn):
+    """
+    Returns the current time of the NBS database, which the change times of its records are compared against.
+    """
+    cursor = nbsConn.cursor()
+    try:
+        cursor.execute("SELECT SYSDATETIME()")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+def formatted(record):
+    # The same values compare.query_rows gives
+    return ["" if value is None else str(value) for value in record]
+
+def change_position(liteConn):
+    """
+    Returns the ID of the last change logged in StateSnapshotChanges, or 0 if none ever was.
+    """
+    row = liteConn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'StateSnapshotChanges'").fetchone()
+    return 0 if row is None else row[0]
+
+def has_incremental_reports(liteConn, year):
+    return liteConn.execute("SELECT 1 FROM IncrementalScopes WHERE Year = ? LIMIT 1", (year,)).fetchone() is not None
+
+def log_changes(liteConn, year, caseIDs):
+    liteConn.executemany("INSERT INTO StateSnapshotChanges (Year, CaseID) VALUES (?, ?)", ((year, caseID) for caseID in caseIDs))
+
+def prune_changes(liteConn, year):
+    """
+    Removes the changes of a year that every incremental report of the year has already seen, along with those
+    of reports older than the year's ChangesFrom, and moves ChangesFrom up to the changes that are left.
+    """
+    (changes_from,) = liteConn.execute("SELECT ChangesFrom FROM StateSnapshots WHERE Year = ?", (year,)).fetchone()
+    (oldest,) = liteConn.execute("SELECT MIN(ChangeID) FROM IncrementalScopes WHERE Year = ? AND ChangeID >= ?",
+                                 (year, changes_from)).fetchone()
+    if oldest is None:
+        oldest = change_position(liteConn)
+    liteConn.execute("DELETE FROM StateSnapshotChanges WHERE Year = ? AND ID <= ?", (year, oldest))
+    liteConn.execute("UPDATE StateSnapshots SET ChangesFrom = MAX(ChangesFrom, ?) WHERE Year = ?", (oldest, year))
+
+def row_hashes(rows):
+    """
+    Returns a hash of the records of each case from (CaseID, record JSON) rows, only comparable within this process.
+    """
+    hashes = {}
+    for caseID, record in rows:
+        hashes[caseID] = hash((hashes.get(caseID), record))
+    return hashes
+
+def full_pull(nbsConn, liteConn, year, query, queries, batch_size=10000):
+    """
+    Makes the snapshot of a year from query.sql and returns its column names. The rows are committed to
+    StateSnapshotStaging in batches so the reports database is not locked while the query runs, then replace the
+    year's rows and header in one transaction. When several reports make the same year's snapshot at once, each one
+    stages its own rows and the last to finish replaces the others'.
+    """
+    build = uuid.uuid4().hex
+    old_hashes = None
+    new_hashes = None
+    try:
+        if has_incremental_reports(liteConn, year):
+            # The cases whose rows change are found by comparing the hashes of their old and new rows. Cases changed
+            # by delta pulls committed after the old rows are read are logged again along with them
+            liteConn.execute("BEGIN")
+            logged_to = change_position(liteConn)
+            old_hashes = row_hashes(liteConn.execute("SELECT CaseID, Record FROM StateSnapshotRows WHERE Year = ? ORDER BY ID", (year,)))
+            liteConn.commit()
+            new_hashes = {}
+
+        watermark = nbs_time(nbsConn)
+        cursor = nbsConn.cursor()
+        try:
+            cursor.execute(query, year)
+            column_names = [col[0] for col in cursor.description]
+            case_position = column_names.index('CaseID')
+            while batch := cursor.fetchmany(batch_size):
+                rows = [(str(record[case_position]), json.dumps(formatted(record))) for record in batch]
+                if new_hashes is not None:
+                    for caseID, record in rows:
+                        new_hashes[caseID] = hash((new_hashes.get(caseID), record))
+                liteConn.executemany("INSERT INTO StateSnapshotStaging (Build, CaseID, Record) VALUES (?, ?, ?)",
+                                     ((build, caseID, record) for caseID, record in rows))
+                liteConn.commit()
+        finally:
+            cursor.close()
+
+        liteConn.execute("BEGIN IMMEDIATE")
+        previous = liteConn.execute("SELECT ChangesFrom FROM StateSnapshots WHERE Year = ?", (year,)).fetchone()
+        if old_hashes is not None and previous is not None and has_incremental_reports(liteConn, year):
+            changes_from = previous[0]
+            changed = {caseID for caseID in old_hashes.keys() | new_hashes.keys() if old_hashes.get(caseID) != new_hashes.get(caseID)}
+            changed.update(caseID for (caseID,) in
+                           liteConn.execute("SELECT CaseID FROM StateSnapshotChanges WHERE Year = ? AND ID > ?", (year, logged_to)))
+            log_changes(liteConn, year, changed)
+        else:
+            changes_from = liteConn.execute("INSERT INTO StateSnapshotChanges (Year, CaseID) VALUES (?, '')", (year,)).lastrowid
+        liteConn.execute("DELETE FROM StateSnapshotRows WHERE Year = ?", (year,))
+        # In ID order, so the snapshot keeps the order query.sql gave the rows in
+        liteConn.execute("INSERT INTO StateSnapshotRows (Year, CaseID, Record) "
+                         "SELECT ?, CaseID, Record FROM StateSnapshotStaging WHERE Build = ? ORDER BY ID", (year, build))
+        liteConn.execute("INSERT OR REPLACE INTO StateSnapshots (Year, Columns, QueryHash, Watermark, CreatedAt, ChangesFrom) VALUES (?, ?, ?, ?, ?, ?)",
+                         (year, json.dumps(column_names), queries, str(watermark), datetime.now().isoformat(sep=' '), changes_from))
+        prune_changes(liteConn, year)
+        liteConn.execute("DELETE FROM StateSnapshotStaging WHERE Build = ?", (build,))
+        liteConn.commit()
+    except BaseException:
+        liteConn.rollback()
+        liteConn.execute("DELETE FROM StateSnapshotStaging WHERE Build = ?", (build,))
+        liteConn.commit()
+        raise
+    return column_names
+
+def delta_pull(nbsConn, liteConn, year, delta_query, column_names, watermark, overlap_minutes=60):
+    """
+    Replaces the snapshot rows of the cases changed since the watermark with their rows from delta_query.sql, leaving
+    out cases that were deleted or moved to another year. Returns False if the delta query's columns do not match
+    the snapshot's, so it has to be made again.
+    """
+    new_watermark = nbs_time(nbsConn)
+    # Changes saved by transactions that were still running at the watermark can have slightly earlier change times
+    since = datetime.fromisoformat(watermark) - timedelta(minutes=overlap_minutes)
+    cursor = nbsConn.cursor()
+    try:
+        cursor.execute(delta_query, since)
+        delta_columns = [col[0] for col in cursor.description]
+        if delta_columns[:-1] != column_names:
+            return False
+        case_position = column_names.index('CaseID')
+        year_position = column_names.index('MMWRYear')
+        changed = {}
+        for record in compare.fetch_records(cursor):
+            record = formatted(record)
+            rows = changed.setdefault(record[case_position], [])
+            if record[year_position] == str(year) and record[-1] != 'LOG_DEL':
+                rows.append(record[:-1])
+    finally:
+        cursor.close()
+
+    try:
+        liteConn.executemany("DELETE FROM StateSnapshotRows WHERE Year = ? AND CaseID = ?", ((year, caseID) for caseID in changed))
+        liteConn.executemany("INSERT INTO StateSnapshotRows (Year, CaseID, Record) VALUES (?, ?, ?)",
+                             ((year, caseID, json.dumps(row)) for caseID, rows in changed.items() for row in rows))
+        log_changes(liteConn, year, changed)
+        prune_changes(liteConn, year)
+        liteConn.execute("UPDATE StateSnapshots SET Watermark = ? WHERE Year = ?", (str(new_watermark), year))
+        liteConn.commit()
+    except BaseException:
+        liteConn.rollback()
+        raise
+    return True
+
+def update(nbsConn, liteConn, year, query, delta_query, overlap_minutes=60, refresh_days=7, batch_size=10000):
+    """
+    Brings the snapshot of a year up to date with the NBS database and returns its column names.
+    """
+    queries = query_hash(query, delta_query)
+    snapshot = liteConn.execute("SELECT Columns, QueryHash, Watermark, CreatedAt FROM StateSnapshots WHERE Year = ?", (year,)).fetchone()
+    if snapshot is not None and snapshot[1] == queries and \
+            datetime.fromisoformat(snapshot[3]) > datetime.now() - timedelta(days=refresh_days):
+        column_names = json.loads(snapshot[0])
+        if delta_pull(nbsConn, liteConn, year, delta_query, column_names, snapshot[2], overlap_minutes):
+            return column_names
+    return full_pull(nbsConn, liteConn, year, query, queries, batch_size)
+
+def has_records(liteConn, year):
+    return liteConn.execute("SELECT 1 FROM StateSnapshotRows WHERE Year = ? LIMIT 1", (year,)).fetchone() is not None
+
+def snapshot_records(liteConn, year, batch_size=10000):
+    """
+    Yields the records of the snapshot of a year, fetching batch_size records at a time.
+    """
+    # In the order the rows were saved, which is the order query.sql gave them in
+    cursor = liteConn.execute("SELECT Record FROM StateSnapshotRows WHERE Year = ? ORDER BY ID", (year,))
+    try:
+        for (record,) in compare.fetch_records(cursor, batch_size):
+            yield json.loads(record)
+    finally:
+        cursor.close()
+
+def case_records(liteConn, year, caseIDs):
+    """
+    Yields the records of the given cases in the snapshot of a year, in the order snapshot_records gives them.
+    """
+    caseIDs = list(caseIDs)
+    rows = []
+    for start in range(0, len(caseIDs), CASE_BATCH):
+        batch = caseIDs[start:start + CASE_BATCH]
+        placeholders = ", ".join("?" * len(batch))
+        rows.extend(liteConn.execute(f"SELECT ID, Record FROM StateSnapshotRows WHERE Year = ? AND CaseID IN ({placeholders})",
+                                     (year, *batch)))
+    rows.sort()
+    for _, record in rows:
+        yield json.loads(record)
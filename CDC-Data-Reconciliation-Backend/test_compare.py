@@ -0,0 +1,24 @@
+from datetime import datetime
+import pytest
+import compare
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+def test_nanosecond_timestamps_read_as_add_times(tmp_path):
+    add_times = [datetime(2023, 2, 7, 14, 5, 37, 225000), datetime(2023, 2, 8, 9, 0, 0), None]
+    table = pa.table({
+        'CaseID': ['1', '2', '3'],
+        'add_time': pa.array(add_times, pa.timestamp('ns')),
+        'local_time': pa.array(add_times, pa.timestamp('ns', tz='America/New_York')),
+    })
+    data_file = tmp_path / "state.parquet"
+    pq.write_table(table, data_file)
+
+    rows = list(compare.read_rows(data_file))
+    assert [row['add_time'] for row in rows] == ['2023-02-07 14:05:37.225000', '2023-02-08 09:00:00.000000', '']
+    # Times with a time zone are read as their local time
+    assert rows[0]['local_time'] == '2023-02-07 09:05:37.225000'
+    for row, add_time in zip(rows[:2], add_times):
+        assert compare.ADD_TIME_PATTERN.fullmatch(row['add_time'])
+        assert compare.parse_time(row['add_time']) == add_time
@@ -0,0 +1,67 @@
+import os
+import pytest
+import compare
+
+EXAMPLE_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'example-data')
+STATE_FILE = os.path.join(EXAMPLE_DATA, 'state.csv')
+CDC_FILE = os.path.join(EXAMPLE_DATA, 'cdc.csv')
+
+@pytest.fixture
+def cdc_file(tmp_path):
+    """
+    The example CDC data with a duplicate of its first case, so the engines also find a duplicate. The example
+    state data already has cases whose rows have the same add_time.
+    """
+    with open(CDC_FILE) as f:
+        lines = f.read().splitlines()
+    cdc_file = tmp_path / "cdc.csv"
+    cdc_file.write_text("\n".join(lines + [lines[1].replace("Confirmed", "Probable", 1)]) + "\n")
+    return str(cdc_file)
+
+def compared(results, stats):
+    """
+    Returns the results and stats of a comparison as sorted row tuples, so engines that give the results in another
+    order can be checked against each other.
+    """
+    return sorted(compare.result_row(result) for result in results), sorted(compare.stats_rows(stats))
+
+def python_comparison(cdc_file, filterCDC):
+    columns = compare.needed_columns(None)
+    return compared(*compare.run_comparison(compare.read_rows(STATE_FILE, columns), compare.read_rows(cdc_file, columns), filterCDC))
+
+@pytest.mark.parametrize('filterCDC', [False, True])
+def test_columnar_engine_matches_python(cdc_file, filterCDC):
+    columnar = pytest.importorskip("columnar")
+    expected = python_comparison(cdc_file, filterCDC)
+    assert {row[6] for row in expected[0]} == {'1', '2', '3', '4'}
+    assert compared(*columnar.run_comparison(STATE_FILE, cdc_file, filterCDC)) == expected
+
+@pytest.mark.parametrize('filterCDC', [False, True])
+def test_external_engine_matches_python(cdc_file, filterCDC, tmp_path):
+    import sortmerge
+    columns = compare.needed_columns(None)
+    spill_dir = tmp_path / "spill"
+    spill_dir.mkdir()
+    # Few rows per run, so both files are spilled to many sorted runs that are merged
+    results, stats = sortmerge.run_comparison(compare.read_rows(STATE_FILE, columns), compare.read_rows(cdc_file, columns),
+                                              filterCDC, spill_rows=50, spill_dir=str(spill_dir))
+    assert compared(results, stats) == python_comparison(cdc_file, filterCDC)
+    # The runs are removed once the results are read
+    assert not os.listdir(spill_dir)
+
+@pytest.mark.parametrize('filterCDC', [False, True])
+def test_partitioned_engine_matches_python(cdc_file, filterCDC, monkeypatch):
+    import csv_scan
+    import partitioned
+    # Small byte ranges, so the CDC file is scanned by several processes
+    row_ranges = csv_scan.row_ranges
+    monkeypatch.setattr(csv_scan, 'row_ranges', lambda mm, start: row_ranges(mm, start, 1024))
+    columns = compare.needed_columns(None)
+    cdc_rows = list(csv_scan.read_rows(cdc_file, columns, workers=2))
+    assert [row['CaseID'] for row in cdc_rows] == [row['CaseID'] for row in compare.read_rows(cdc_file)]
+
+    expected = python_comparison(cdc_file, filterCDC)
+    assert compared(*compare.run_comparison(compare.read_rows(STATE_FILE, columns), iter(cdc_rows), filterCDC, stream=True)) == expected
+    results, stats = partitioned.run_comparison(compare.read_rows(STATE_FILE, columns), iter(cdc_rows), filterCDC,
+                                                workers=2)
+    assert compared(results, stats) == expected
@@ -15,6 +15,8 @@ export default function CreateReport({ onDone }) {
     "Sex", "BirthDate", "Age", "AgeType", "Race", "Ethnicity"
   ])
   const [reportName, setReportName] = useState('')
+  const [jobID, setJobID] = useState(null)
+  const [jobProgress, setJobProgress] = useState('')
 
   const currYear = 2023
   const yearList = Array.from({ length: 101}, (_, index) => currYear + index)
@@ -59,6 +61,43 @@ export default function CreateReport({ onDone }) {
     ).join(errors.length > 2 ? ", " : ", ").replace(/, (?=[^,]*$)/, ", and ") + "."
   }
 
+  // The server creates the report in the background, so poll the job until it is done
+  const waitForJob = async (id) => {
+    setJobID(id)
+    setJobProgress('Queued')
+    try {
+      while (true) {
+        const response = await fetch(config.API_URL + `/jobs/${id}`)
+        const job = await response.json()
+        if (!response.ok) {
+          throw new Error(job.detail)
+        }
+        if (job.Status === 'done') {
+          return
+        }
+        if (job.Status === 'failed') {
+          throw new Error(job.Error)
+        }
+        if (job.Status === 'cancelled') {
+          throw new Error("Report creation was cancelled")
+        }
+        setJobProgress(`${job.Status === 'queued' ? 'Queued' : `Stage: ${job.Stage}`} - ${job.RowsProcessed} rows processed, ${job.ElapsedSeconds}s elapsed`)
+        await new Promise((resolve) => setTimeout(resolve, 1000))
+      }
+    } finally {
+      setJobID(null)
+      setJobProgress('')
+    }
+  }
+
+  const handleCancel = async () => {
+    try {
+      await fetch(config.API_URL + `/jobs/${jobID}/cancel`, { method: "POST" })
+    } catch (e) {
+      console.error("Error cancelling report - " + e)
+    }
+  }
+
   const handleSubmit = async (e) => {
     e.preventDefault()
 
@@ -105,6 +144,8 @@ export default function CreateReport({ onDone }) {
         })
 
         if (response.ok) {
+          const res = await response.json()
+          await waitForJob(res.jobID)
           console.log("Automatic report fetched successfully!")
           onDone()
         } else {
@@ -156,6 +197,8 @@ export default function CreateReport({ onDone }) {
         })
 
         if (response.ok) {
+          const res = await response.json()
+          await waitForJob(res.jobID)
           console.log("Files uploaded successfully!")
           onDone()
         } else {
@@ -216,7 +259,7 @@ export default function CreateReport({ onDone }) {
             <hr></hr>
             <label htmlFor='cdc_file' className="font-bold ml-4">Upload CDC <span className="italic">.csv</span> File:</label>
             <div className="-mt-4 ml-4">
-              <input type='file' id='cdc_file' onChange={handleCDCFileChange}  />
+              <input type='file' id='cdc_file' accept='.csv,.gz,.zip,.parquet,.arrow,.feather' onChange={handleCDCFileChange}  />
             </div>
             <hr></hr>
             {isAutomatic && (
@@ -265,7 +308,7 @@ export default function CreateReport({ onDone }) {
               <>
                 <label htmlFor='state_file' className="font-bold ml-4">Upload State <span className="italic">.csv</span> File:</label>
                 <div className="ml-4">
-                  <input type='file' id='state_file' onChange={handleStateFileChange} />
+                  <input type='file' id='state_file' accept='.csv,.gz,.zip,.parquet,.arrow,.feather' onChange={handleStateFileChange} />
                 </div>
                 <hr></hr>
                 
@@ -310,12 +353,24 @@ export default function CreateReport({ onDone }) {
             />
 
             <div className="items-center justify-center mx-auto">
-              <Button
-                type='submit'
-                text='Submit'
-                onClick={() => {}}
-                className='px-4 py-2 w-20'>
-              </Button>
+              {jobID === null ? (
+                <Button
+                  type='submit'
+                  text='Submit'
+                  onClick={() => {}}
+                  className='px-4 py-2 w-20'>
+                </Button>
+              ) : (
+                <div className="flex flex-col items-center gap-2">
+                  <p>{jobProgress}</p>
+                  <Button
+                    type='button'
+                    text='Cancel'
+                    onClick={handleCancel}
+                    className='px-4 py-2 w-20'>
+                  </Button>
+                </div>
+              )}
             </div>
           </div>
         </form>
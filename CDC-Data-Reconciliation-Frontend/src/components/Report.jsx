@@ -25,14 +25,22 @@ import {
   flexRender,
 } from "@tanstack/react-table"
 
+// The discrepancies are paged, sorted and filtered by the backend, which can only filter and sort on these columns
+const FILTER_COLUMNS = ["EventCode", "ReasonID", "CaseClassStatus", "MMWRWeek"]
+const SORT_COLUMNS = ["CaseID", "EventCode", "MMWRWeek", "ReasonID", "CaseClassStatus"]
+
 export default function Report({ reportID }) {
-  const [results, setResults] = useState(null)
+  const [cases, setCases] = useState(null)
+  const [totalCases, setTotalCases] = useState(0)
+  // The after cursor of each page read so far, null for the first page
+  const [cursors, setCursors] = useState([null])
+  const [discPagination, setDiscPagination] = useState({ pageIndex: 0, pageSize: 5 })
+  const [discSorting, setDiscSorting] = useState([])
   const [statistics, setStatistics] = useState(null)
   const [totalStatistics, setTotalStatistics] = useState({})
   const [showDiseaseStats, setShowDiseaseStats] = useState(false)
 
   const [discColumnFilters, setDiscColumnFilters] = useState([])
-  const [discGlobalFilter, setDiscGlobalFilter] = useState("")
 
   const [statColumnFilters, setStatColumnFilters] = useState([])
   const [statGlobalFilter, setStatGlobalFilter] = useState("")
@@ -59,19 +67,19 @@ export default function Report({ reportID }) {
     },
     {
       header: "CaseClassStatus",
-      accessorFn: (row) => row.CaseClassStatus.toString(),
+      accessorFn: (row) => String(row.CaseClassStatus ?? ""),
       id: "CaseClassStatus",
       footer: (props) => props.column.id,
     },
     {
       header: "MMWRYear",
-      accessorFn: (row) => row.MMWRYear.toString(),
+      accessorFn: (row) => String(row.MMWRYear ?? ""),
       id: "MMWRYear",
       footer: (props) => props.column.id,
     },
     {
       header: "MMWRWeek",
-      accessorFn: (row) => row.MMWRWeek.toString(),
+      accessorFn: (row) => String(row.MMWRWeek ?? ""),
       id: "MMWRWeek",
       footer: (props) => props.column.id,
     },
@@ -82,11 +90,14 @@ export default function Report({ reportID }) {
     },
     {
       header: "ReasonID",
-      accessorFn: (row) => row.ReasonID.toString(),
+      accessorFn: (row) => String(row.ReasonID ?? ""),
       id: "ReasonID",
       footer: (props) => props.column.id,
     },
-  ])
+  ].map((column) => {
+    const id = column.id ?? column.accessorKey
+    return { ...column, enableColumnFilter: FILTER_COLUMNS.includes(id), enableSorting: SORT_COLUMNS.includes(id) }
+  }), [])
 
   const statColumns = useMemo(() => [
     {
@@ -163,18 +174,25 @@ export default function Report({ reportID }) {
     },
   ])
 
+  // Goes back to the first page, as the cursors of the other pages only work for the same sort and filters
+  const resetDiscPages = (pageSize) => {
+    setCursors([null])
+    setDiscPagination((pagination) => ({ pageIndex: 0, pageSize: pageSize ?? pagination.pageSize }))
+  }
+
   const discTable = useReactTable({
-    data: results,
+    data: cases ?? [],
     columns: discColumns,
+    pageCount: Math.ceil(totalCases / discPagination.pageSize),
     state: {
       columnFilters: discColumnFilters,
-      globalFilter: discGlobalFilter,
-    },
-    initialState: {
-      pagination: {
-        pageSize: 5,
-      },
+      sorting: discSorting,
+      pagination: discPagination,
     },
+    manualPagination: true,
+    manualSorting: true,
+    manualFiltering: true,
+    enableMultiSort: false,
     onColumnFiltersChange: (columnFilters) => {
       if (diseaseStatClicked) {
         setDiseaseStatClicked(false)
@@ -183,20 +201,14 @@ export default function Report({ reportID }) {
       }
 
       setDiscColumnFilters(columnFilters)
+      resetDiscPages()
     },
-    onGlobalFilterChange: (filter) => {
-      if (diseaseStatClicked) {
-        setDiseaseStatClicked(false)
-        setCurrentDisease("")
-        setCurrentDiscType("")
-      }
-
-      setDiscGlobalFilter(filter)
+    onSortingChange: (sorting) => {
+      setDiscSorting(sorting)
+      resetDiscPages()
     },
+    onPaginationChange: setDiscPagination,
     getCoreRowModel: getCoreRowModel(),
-    getFilteredRowModel: getFilteredRowModel(),
-    getSortedRowModel: getSortedRowModel(),
-    getPaginationRowModel: getPaginationRowModel(),
     getFacetedRowModel: getFacetedRowModel(),
     getFacetedUniqueValues: getFacetedUniqueValues(),
   })
@@ -225,8 +237,9 @@ export default function Report({ reportID }) {
 
   useEffect(() => {
     setStatistics(null)
-    setResults(null)
+    setCases(null)
     setTotalStatistics(null)
+    resetDiscPages()
     const fetchReportStatistics = async () => {
       try {
         const statsResponse = await fetch(config.API_URL + "/report_statistics/" + reportID)
@@ -264,29 +277,73 @@ export default function Report({ reportID }) {
 
     if (reportID) {
       fetchReportStatistics()
-      fetchReport(reportID)
     }
   }, [reportID])
 
-  const fetchReport = async (reportID) => {
-    try {
-      const response = await fetch(config.API_URL + "/reports/" + reportID)
-      if (response.ok) {
+  // The query parameters for the discrepancies with the current filters and sort
+  const discParams = () => {
+    const params = new URLSearchParams()
+    discColumnFilters.forEach(({ id, value }) => {
+      if (value !== "") params.set(id, value)
+    })
+    if (discSorting.length > 0) {
+      params.set("sort", discSorting[0].id)
+      params.set("descending", discSorting[0].desc)
+    }
+    return params
+  }
+
+  // Fetches one page of discrepancies, starting after the cursor the previous page gave
+  useEffect(() => {
+    const after = cursors[discPagination.pageIndex]
+    if (!reportID || after === undefined) return
+
+    let ignore = false
+    const fetchPage = async () => {
+      const params = discParams()
+      params.set("limit", discPagination.pageSize)
+      if (after !== null) params.set("after", after)
+      try {
+        const response = await fetch(`${config.API_URL}/reports/${reportID}?${params}`)
+        if (!response.ok) {
+          console.error("Failed to fetch report!")
+          return
+        }
         const data = await response.json()
-        setResults(data)
-      } else {
-        console.error("Failed to fetch report!")
+        if (ignore) return
+        setCases(data.cases)
+        setTotalCases(data.total)
+        setCursors((previous) => [...previous.slice(0, discPagination.pageIndex + 1), data.next])
+      } catch (e) {
+        console.error("Error fetching report - " + e)
       }
-    } catch (e) {
-      console.error("Error fetching report - " + e)
     }
-  }
+
+    fetchPage()
+    return () => {
+      ignore = true
+    }
+  }, [reportID, discColumnFilters, discSorting, discPagination])
 
   const toggleDiseaseStats = () => {
     setShowDiseaseStats(!showDiseaseStats)
   }
 
-  const handleResultsDownload = (e) => {
+  const handleResultsDownload = async (e) => {
+    // Every discrepancy with the current filters and sort, not just the page shown
+    let results
+    try {
+      const response = await fetch(`${config.API_URL}/reports/${reportID}?${discParams()}`)
+      if (!response.ok) {
+        console.error("Failed to fetch report!")
+        return
+      }
+      results = await response.json()
+    } catch (e) {
+      console.error("Error fetching report - " + e)
+      return
+    }
+
     const csvData =
       "CaseID,EventCode,EventName,CaseClassStatus,MMWRYear,MMWRWeek,Reason,ReasonID\n" +
       results
@@ -406,7 +463,6 @@ export default function Report({ reportID }) {
 
   const clearDiscFilters = () => {
     discTable.setColumnFilters([])
-    discTable.setGlobalFilter("")
     setDiseaseStatClicked(false)
     setCurrentDisease("")
     setCurrentDiscType("")
@@ -419,11 +475,19 @@ export default function Report({ reportID }) {
 
   return (
     <div className='mt-5 py-5 px-12 mx-auto w-full max-w-[1400px] min-w-[1020px] flex flex-col items-center gap-6'>
-      {results && (
+      {cases && (
         <>
           <div className='flex flex-col items-center mb-5'>
             <h2 className='text-2xl font-bold'>Results</h2>
-            <h3>Number of Cases Different: {results.length}</h3>
+            {totalStatistics && (
+              <h3>
+                Number of Cases Different:{" "}
+                {totalStatistics.TotalDuplicates +
+                  totalStatistics.TotalMissingFromCDC +
+                  totalStatistics.TotalMissingFromState +
+                  totalStatistics.TotalWrongAttributes}
+              </h3>
+            )}
           </div>
 
           {statistics && (
@@ -626,12 +690,6 @@ export default function Report({ reportID }) {
           <div>
             <div className='w-full flex flex-row items-center justify-between'>
               <div className="flex items-center gap-2">
-                <DebouncedInput
-                  value={discGlobalFilter ?? ""}
-                  onChange={(value) => discTable.setGlobalFilter(String(value))}
-                  className='p-2 font-lg shadow border border-block'
-                  placeholder='Search all columns...'
-                />
                 <Button
                   text='Clear Filters'
                   className='px-5 py-2 flex flex-row items-center justify-around gap-2'
@@ -714,6 +772,7 @@ export default function Report({ reportID }) {
               </table>
             </div>
             <div className='flex items-center gap-2 justify-center'>
+              {/* Pages are read one after another, so there is no jumping to the last page or a page number */}
               <button
                 className='border rounded p-1 border-slate-400'
                 onClick={() => discTable.setPageIndex(0)}
@@ -731,40 +790,21 @@ export default function Report({ reportID }) {
               <button
                 className='border rounded p-1 border-slate-400'
                 onClick={() => discTable.nextPage()}
-                disabled={!discTable.getCanNextPage()}
+                disabled={!discTable.getCanNextPage() || !cursors[discPagination.pageIndex + 1]}
               >
                 <MdKeyboardArrowRight className='text-xl' />
               </button>
-              <button
-                className='border rounded p-1 border-slate-400'
-                onClick={() => discTable.setPageIndex(discTable.getPageCount() - 1)}
-                disabled={!discTable.getCanNextPage()}
-              >
-                <MdKeyboardDoubleArrowRight className='text-xl' />
-              </button>
               <span className='flex items-center gap-1'>
                 <div>Page</div>
                 <strong>
-                  {discTable.getState().pagination.pageIndex + 1} of {discTable.getPageCount()}
+                  {discTable.getState().pagination.pageIndex + 1} of {Math.max(discTable.getPageCount(), 1)}
                 </strong>
               </span>
-              <span className='flex items-center gap-1'>
-                | Go to page:
-                <input
-                  type='number'
-                  defaultValue={discTable.getState().pagination.pageIndex + 1}
-                  onChange={(e) => {
-                    const page = e.target.value ? Number(e.target.value) - 1 : 0
-                    discTable.setPageIndex(page)
-                  }}
-                  className='border p-1 rounded w-16 border-slate-400'
-                />
-              </span>
               <select
                 className='border p-1 rounded border-slate-400'
                 value={discTable.getState().pagination.pageSize}
                 onChange={(e) => {
-                  discTable.setPageSize(Number(e.target.value))
+                  resetDiscPages(Number(e.target.value))
                 }}
               >
                 {[5, 10, 20, 30, 40, 50, 100].map((pageSize) => (